@@ -0,0 +1,240 @@
+"""Command line interface for bulk shading calculations.
+
+The ``twoaxistracking run`` command calculates the shaded fraction for a file
+of solar positions. The input is processed in batches, such that the memory
+usage does not depend on the size of the input file.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import shapely
+
+from twoaxistracking import trackerfield
+
+
+def _read_geometry(value):
+    """Parse a geometry from a WKT or GeoJSON string or a file containing it."""
+    if os.path.isfile(value):
+        with open(value) as f:
+            value = f.read()
+    value = value.strip()
+    if value.startswith('{'):
+        return shapely.from_geojson(value)
+    return shapely.from_wkt(value)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('pyarrow is required for reading and writing Parquet '
+                          'files.') from e
+    return pyarrow
+
+
+def _count_rows(path, columns):
+    """Count the number of rows in a Parquet or CSV file."""
+    if path.endswith('.parquet'):
+        pyarrow = _import_pyarrow()
+        return pyarrow.parquet.ParquetFile(path).metadata.num_rows
+    return sum(len(chunk) for chunk in pd.read_csv(path, usecols=columns[:1],
+                                                   chunksize=2**20))
+
+
+def _iter_batches(path, columns, batch_size):
+    """Iterate over a Parquet or CSV file in batches of solar positions."""
+    if path.endswith('.parquet'):
+        pyarrow = _import_pyarrow()
+        parquet_file = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield [batch.column(c).to_numpy(zero_copy_only=False) for c in columns]
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=batch_size):
+            yield [chunk[c].to_numpy(dtype=float) for c in columns]
+
+
+class _ParquetResultWriter:
+    """Write each batch of results as a row group of a Parquet file."""
+
+    def __init__(self, path):
+        self.pyarrow = _import_pyarrow()
+        schema = self.pyarrow.schema([('shaded_fraction', self.pyarrow.float64())])
+        self.writer = self.pyarrow.parquet.ParquetWriter(path, schema)
+
+    def out(self, n_values):
+        """Preallocated output array for the next batch, if any."""
+        return None
+
+    def write(self, values):
+        self.writer.write_table(self.pyarrow.table({'shaded_fraction': values}))
+
+    def close(self):
+        self.writer.close()
+
+
+class _NpyResultWriter:
+    """Write the results to a memory-mapped ``.npy`` file."""
+
+    def __init__(self, path, n_rows):
+        self.array = np.lib.format.open_memmap(path, mode='w+', dtype=float,
+                                               shape=(n_rows,))
+        self.n_written = 0
+
+    def out(self, n_values):
+        # The results of the next batch are written directly into the file
+        return self.array[self.n_written:self.n_written+n_values]
+
+    def write(self, values):
+        self.n_written += len(values)
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+
+def _build_parser():
+    parser = argparse.ArgumentParser(
+        prog='twoaxistracking',
+        description='Simulate self-shading of two-axis tracking solar collectors.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser(
+        'run', help='Calculate the shaded fraction for a file of solar positions.')
+    run_parser.set_defaults(func=run)
+    run_parser.add_argument('input', help='Parquet or CSV file with solar positions.')
+    run_parser.add_argument('output', help='Output file (.parquet or .npy).')
+    run_parser.add_argument('--geometry', required=True,
+                            help='Total collector geometry as WKT or GeoJSON (or a file '
+                                 'containing it).')
+    run_parser.add_argument('--active-geometry',
+                            help='Active collector geometry as WKT or GeoJSON (or a file '
+                                 'containing it). Defaults to the total collector geometry.')
+    run_parser.add_argument('--gcr', type=float, required=True, help='Ground cover ratio.')
+    run_parser.add_argument('--neighbor-order', type=int, default=2,
+                            help='Order of neighbors to include in layout (default: 2).')
+    run_parser.add_argument(
+        '--layout-type', choices=list(trackerfield.STANDARD_FIELD_LAYOUT_PARAMETERS),
+        help='Standard layout type.')
+    run_parser.add_argument('--aspect-ratio', type=float,
+                            help='Ratio of the spacing in the primary direction to the '
+                                 'secondary. Required if no layout type is specified.')
+    run_parser.add_argument('--offset', type=float,
+                            help='Relative row offset in the secondary direction, '
+                                 '-0.5 <= offset < 0.5. Required if no layout type is '
+                                 'specified.')
+    run_parser.add_argument('--rotation', type=float,
+                            help='Counterclockwise rotation of the field in degrees, '
+                                 '0 <= rotation < 180. Required if no layout type is '
+                                 'specified.')
+    run_parser.add_argument('--slope-azimuth', type=float, default=0,
+                            help='Direction of the normal to the slope in degrees '
+                                 '(default: 0).')
+    run_parser.add_argument('--slope-tilt', type=float, default=0,
+                            help='Tilt of the slope in degrees (default: 0).')
+    run_parser.add_argument('--elevation-column', default='solar_elevation',
+                            help='Name of the solar elevation column (default: solar_elevation).')
+    run_parser.add_argument('--azimuth-column', default='solar_azimuth',
+                            help='Name of the solar azimuth column (default: solar_azimuth).')
+    run_parser.add_argument('--batch-size', type=int, default=100_000,
+                            help='Number of solar positions per batch (default: 100000).')
+    run_parser.add_argument('--quiet', action='store_true', help='Do not report progress.')
+    return parser
+
+
+def _read_columns(path):
+    """Read the column names of a Parquet or CSV file."""
+    if path.endswith('.parquet'):
+        pyarrow = _import_pyarrow()
+        return pyarrow.parquet.ParquetFile(path).schema_arrow.names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def _validate_args(args):
+    """Check the arguments and create the TrackerField before processing the input.
+
+    Only the column names of the input file are read.
+    """
+    if not args.output.endswith(('.parquet', '.npy')):
+        raise ValueError('The output file needs to be a .parquet or .npy file.')
+    if args.output.endswith('.parquet'):
+        _import_pyarrow()
+    if args.batch_size < 1:
+        raise ValueError('The batch size needs to be positive.')
+    if not os.path.isfile(args.input):
+        raise ValueError(f'The input file {args.input!r} does not exist.')
+    columns = [args.elevation_column, args.azimuth_column]
+    missing = [c for c in columns if c not in _read_columns(args.input)]
+    if missing:
+        raise ValueError(f'The input file does not contain the columns {missing}.')
+
+    try:
+        total_collector_geometry = _read_geometry(args.geometry)
+        if args.active_geometry is None:
+            active_collector_geometry = total_collector_geometry
+        else:
+            active_collector_geometry = _read_geometry(args.active_geometry)
+    except shapely.errors.ShapelyError as e:
+        raise ValueError(f'Invalid collector geometry: {e}') from e
+    return trackerfield.TrackerField(
+        total_collector_geometry=total_collector_geometry,
+        active_collector_geometry=active_collector_geometry,
+        neighbor_order=args.neighbor_order,
+        gcr=args.gcr,
+        layout_type=args.layout_type,
+        aspect_ratio=args.aspect_ratio,
+        offset=args.offset,
+        rotation=args.rotation,
+        slope_azimuth=args.slope_azimuth,
+        slope_tilt=args.slope_tilt)
+
+
+def run(args, field):
+    """Calculate the shaded fraction of the solar positions in ``args.input``
+    for the TrackerField created by :py:func:`_validate_args`."""
+    columns = [args.elevation_column, args.azimuth_column]
+    if args.output.endswith('.parquet'):
+        writer = _ParquetResultWriter(args.output)
+        total = ''
+    else:
+        # The number of rows is only counted for preallocating the .npy file
+        n_rows = _count_rows(args.input, columns)
+        writer = _NpyResultWriter(args.output, n_rows)
+        total = f'/{n_rows}'
+
+    start_time = time.perf_counter()
+    n_processed = 0
+    try:
+        for solar_elevation, solar_azimuth in _iter_batches(
+                args.input, columns, args.batch_size):
+            shaded_fractions = field.get_shaded_fraction(
+                solar_elevation, solar_azimuth, out=writer.out(len(solar_elevation)))
+            writer.write(shaded_fractions)
+            n_processed += len(shaded_fractions)
+            if not args.quiet:
+                elapsed = time.perf_counter() - start_time
+                print(f'{n_processed}{total} solar positions '
+                      f'({n_processed / max(elapsed, 1e-9):.0f} per second)',
+                      file=sys.stderr)
+    finally:
+        writer.close()
+
+
+def main(argv=None):
+    """Entry point of the ``twoaxistracking`` console script."""
+    parser = _build_parser()
+    args = parser.parse_args(argv)
+    try:
+        field = _validate_args(args)
+    except (ValueError, ImportError) as e:
+        # Invalid arguments are reported before any input is processed
+        parser.error(str(e))
+    args.func(args, field)
+
+
+if __name__ == '__main__':
+    main()
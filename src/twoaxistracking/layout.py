@@ -16,9 +16,150 @@ def _calculate_min_tracker_spacing(collector_geometry):
     return min_tracker_spacing
 
 
+def _layout_feasibility(gcr, total_collector_area, min_tracker_spacing,
+                        aspect_ratio, offset, rotation):
+    """Check whether field layout parameters are feasible.
+
+    The checks are vectorized and the parameters can be arrays.
+
+    Returns
+    -------
+    violations: list of tuples
+        Tuples of (mask, message), where mask is True for the parameter
+        combinations that violate the limit described by the message.
+    """
+    # Avoid "RuntimeWarning: invalid value encountered in sqrt" for offsets
+    # outside the valid range
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gcr_max = total_collector_area / (min_tracker_spacing**2 * np.sqrt(1-offset**2))
+        violations = [
+            # Check parameters are within their ranges
+            ((offset < -0.5) | (offset >= 0.5),
+             'The specified offset is outside the valid range.'),
+            ((rotation < 0) | (rotation >= 180),
+             'The specified rotation is outside the valid range.'),
+            # Check if Lmin is physically possible given the collector area.
+            (min_tracker_spacing < np.sqrt(4*total_collector_area/np.pi),
+             'Lmin is not physically possible.'),
+            # Check if mimimum and maximum ground cover ratios are exceeded
+            ((gcr < 0) | (gcr > gcr_max),
+             'Maximum ground cover ratio exceeded or less than 0.'),
+            (aspect_ratio < np.sqrt(1-offset**2),
+             'Aspect ratio is too low and not feasible'),
+            (aspect_ratio > total_collector_area/(gcr*min_tracker_spacing**2),
+             'Aspect ratio is too high and not feasible'),
+        ]
+    return violations
+
+
+def _check_layout_parameters(gcr, total_collector_area, min_tracker_spacing,
+                             aspect_ratio, offset, rotation):
+    """Raise a ValueError if any of the field layout parameters are not feasible."""
+    violations = _layout_feasibility(gcr, total_collector_area, min_tracker_spacing,
+                                     aspect_ratio, offset, rotation)
+    for mask, message in violations:
+        if np.any(mask):
+            raise ValueError(message)
+
+
+def _neighbor_indices(neighbor_order):
+    """Calculate the lattice indices of the neighbors relative to the reference."""
+    N = 1 + 2 * neighbor_order  # Number of collectors along each side
+
+    # Generation of X and Y arrays with coordinates
+    X = np.tile(np.arange(int(-N/2), int(N/2)+1), N)
+    Y = np.repeat(np.arange(int(-N/2), int(N/2)+1), N)
+    # Remove reference collector point (origin)
+    X = np.delete(X, int(N**2/2))
+    Y = np.delete(Y, int(N**2/2))
+    return X, Y
+
+
+def _unit_field_layout(neighbor_order, aspect_ratio, offset, rotation):
+    """Calculate the neighbor positions of the unscaled field layout.
+
+    The unscaled layout has a spacing of one in the secondary direction, i.e.,
+    it does not depend on the ground cover ratio.
+    """
+    X, Y = _neighbor_indices(neighbor_order)
+
+    # Add offset and implement aspect ratio. Note that it is important to first
+    # calculate offset as it relies on the original X array.
+    Y = Y + offset*X
+    X = X * aspect_ratio
+    # Apply field rotation
+    X, Y = _rotate_origin(X, Y, rotation)
+    return X, Y
+
+
+def _slope_field_layout(X, Y, relative_azimuth, slope_azimuth, slope_tilt):
+    """Calculate relative heights and slopes of the unscaled field layout."""
+    # Calculate relative tracker height based on surface slope
+    Z = - X * np.sin(np.deg2rad(slope_azimuth)) * \
+        np.tan(np.deg2rad(slope_tilt)) \
+        - Y * np.cos(np.deg2rad(slope_azimuth)) * \
+        np.tan(np.deg2rad(slope_tilt))
+    # Relative slope of collectors
+    # positive means collector is higher than reference collector
+    relative_slope = np.rad2deg(np.arctan(-np.cos(np.deg2rad(slope_azimuth - relative_azimuth))
+                                          * np.tan(np.deg2rad(slope_tilt))))
+    return Z, relative_slope
+
+
+def _layout_scaling(gcr, total_collector_area, aspect_ratio):
+    """Calculate the factor that scales the unscaled layout to the gcr."""
+    return np.sqrt(total_collector_area / (gcr * aspect_ratio))
+
+
+def _lattice_vectors(gcr, total_collector_area, aspect_ratio, offset, rotation):
+    """Calculate the lattice vectors of the primary and secondary direction.
+
+    Returns a 2x2 array where the columns are the lattice vectors, i.e., the
+    position of the neighbors with lattice indices (1, 0) and (0, 1).
+    """
+    scaling = _layout_scaling(gcr, total_collector_area, aspect_ratio)
+    return np.array(_rotate_origin(np.array([aspect_ratio, 0]),
+                                   np.array([offset, 1]), rotation)) * scaling
+
+
+def _field_layout_derivatives(neighbor_order, gcr, total_collector_area, aspect_ratio,
+                              offset, rotation):
+    """Calculate the derivatives of the neighbor positions.
+
+    Returns arrays with the shape (4, n_neighbors) of the derivatives of the
+    neighbor positions X and Y with respect to ``gcr``, ``aspect_ratio``,
+    ``offset``, and ``rotation`` (per degree).
+    """
+    i, j = _neighbor_indices(neighbor_order)
+    scaling = _layout_scaling(gcr, total_collector_area, aspect_ratio)
+    X, Y = _unit_field_layout(neighbor_order, aspect_ratio, offset, rotation)
+    X, Y = X*scaling, Y*scaling
+    dX_aspect_ratio, dY_aspect_ratio = _rotate_origin(i*scaling, 0, rotation)
+    dX_offset, dY_offset = _rotate_origin(0, i*scaling, rotation)
+    dX = np.stack([-X/(2*gcr), dX_aspect_ratio - X/(2*aspect_ratio), dX_offset,
+                   -np.deg2rad(Y)])
+    dY = np.stack([-Y/(2*gcr), dY_aspect_ratio - Y/(2*aspect_ratio), dY_offset,
+                   np.deg2rad(X)])
+    return dX, dY
+
+
+def _unit_cell_points(lattice_vectors, resolution):
+    """Calculate a regular grid of sample points in the unit cell of a layout.
+
+    The unit cell is the parallelogram spanned by the lattice vectors and
+    centered on the reference collector. Returns the x and y coordinates as
+    arrays with the shape (resolution, resolution), where the first axis
+    corresponds to the primary direction.
+    """
+    fractions = (np.arange(resolution) + 0.5) / resolution - 0.5
+    i, j = np.meshgrid(fractions, fractions, indexing='ij')
+    x, y = lattice_vectors @ np.array([i.ravel(), j.ravel()])
+    return x.reshape(resolution, resolution), y.reshape(resolution, resolution)
+
+
 def generate_field_layout(gcr, total_collector_area, min_tracker_spacing,
                           neighbor_order, aspect_ratio, offset, rotation,
-                          slope_azimuth=0, slope_tilt=0):
+                          slope_azimuth=0, slope_tilt=0, return_feasible=False):
     """
     Generate a regularly-spaced collector field layout.
 
@@ -27,28 +168,36 @@ def generate_field_layout(gcr, total_collector_area, min_tracker_spacing,
     Any length unit can be used as long as the usage is consistent with the
     collector geometry.
 
+    All parameters except ``neighbor_order`` can be arrays, in which case
+    they are broadcast against each other and one layout is generated for
+    each parameter combination.
+
     Parameters
     ----------
-    gcr: float
+    gcr: float or array-like
         Ground cover ratio. Ratio of collector area to ground area.
-    total_collector_area: float
+    total_collector_area: float or array-like
         Surface area of one collector.
-    min_tracker_spacing: float
+    min_tracker_spacing: float or array-like
         Minimum distance between collectors.
     neighbor_order: int
         Order of neighbors to include in layout. It is recommended to use a
         neighbor order of 2.
-    aspect_ratio: float
+    aspect_ratio: float or array-like
         Ratio of the spacing in the primary direction to the secondary.
-    offset: float
+    offset: float or array-like
         Relative row offset in the secondary direction as fraction of the
         spacing in the primary direction. -0.5 <= offset < 0.5.
-    rotation: float
+    rotation: float or array-like
         Counterclockwise rotation of the field in degrees. 0 <= rotation < 180
-    slope_azimuth : float, optional
+    slope_azimuth : float or array-like, optional
         Direction of normal to slope on horizontal [degrees]
-    slope_tilt : float, optional
+    slope_tilt : float or array-like, optional
         Tilt of slope relative to horizontal [degrees]
+    return_feasible: bool, default: False
+        Whether to return a mask of the feasible parameter combinations. If
+        True, no error is raised for infeasible parameter combinations;
+        instead the layout of these are set to nan.
 
     Returns
     -------
@@ -68,63 +217,65 @@ def generate_field_layout(gcr, total_collector_area, min_tracker_spacing,
     relative_slope: array of floats
         Slope between neighboring trackers and reference tracker. A positive
         slope means neighboring collector is higher than reference collector.
+    feasible: bool or array of bools
+        Whether the layout parameters are feasible. Only returned if
+        ``return_feasible`` is True.
+
+    The returned layout arrays have the shape of the broadcast parameters
+    with an additional last axis corresponding to the neighbors, e.g.,
+    (n_layouts, n_neighbors) for one-dimensional parameter arrays.
+
+    Raises
+    ------
+    ValueError
+        If any of the parameter combinations are not feasible and
+        ``return_feasible`` is False.
 
     References
     ----------
     .. [1] `Shading and land use in regularly-spaced sun-tracking collectors, Cumpston & Pye.
        <https://doi.org/10.1016/j.solener.2014.06.012>`_
     """
-    # Check parameters are within their ranges
-    if (offset < -0.5) | (offset >= 0.5):
-        raise ValueError('The specified offset is outside the valid range.')
-    if (rotation < 0) | (rotation >= 180):
-        raise ValueError('The specified rotation is outside the valid range.')
-    # Check if Lmin is physically possible given the collector area.
-    if (min_tracker_spacing < np.sqrt(4*total_collector_area/np.pi)):
-        raise ValueError('Lmin is not physically possible.')
-    # Check if mimimum and maximum ground cover ratios are exceeded
-    gcr_max = total_collector_area / (min_tracker_spacing**2 * np.sqrt(1-offset**2))
-    if (gcr < 0) or (gcr > gcr_max):
-        raise ValueError('Maximum ground cover ratio exceeded or less than 0.')
-    if aspect_ratio < np.sqrt(1-offset**2):
-        raise ValueError('Aspect ratio is too low and not feasible')
-    if aspect_ratio > total_collector_area/(gcr*min_tracker_spacing**2):
-        raise ValueError('Aspect ratio is too high and not feasible')
+    (gcr, total_collector_area, min_tracker_spacing, aspect_ratio, offset, rotation,
+     slope_azimuth, slope_tilt) = np.broadcast_arrays(
+        gcr, total_collector_area, min_tracker_spacing, aspect_ratio, offset, rotation,
+        slope_azimuth, slope_tilt)
+    if return_feasible:
+        violations = _layout_feasibility(gcr, total_collector_area, min_tracker_spacing,
+                                         aspect_ratio, offset, rotation)
+        feasible = ~np.any([mask for mask, _ in violations], axis=0)
+    else:
+        _check_layout_parameters(gcr, total_collector_area, min_tracker_spacing,
+                                 aspect_ratio, offset, rotation)
 
-    N = 1 + 2 * neighbor_order  # Number of collectors along each side
-
-    # Generation of X and Y arrays with coordinates
-    X = np.tile(np.arange(int(-N/2), int(N/2)+1), N)
-    Y = np.repeat(np.arange(int(-N/2), int(N/2)+1), N)
-    # Remove reference collector point (origin)
-    X = np.delete(X, int(N**2/2))
-    Y = np.delete(Y, int(N**2/2))
+    # Add an axis for the neighbors to all parameters
+    (gcr, total_collector_area, aspect_ratio, offset, rotation, slope_azimuth,
+     slope_tilt) = [np.expand_dims(p, axis=-1) for p in (
+        gcr, total_collector_area, aspect_ratio, offset, rotation, slope_azimuth, slope_tilt)]
 
-    # Add offset and implement aspect ratio. Note that it is important to first
-    # calculate offset as it relies on the original X array.
-    Y = Y + offset*X
-    X = X * aspect_ratio
-    # Apply field rotation
-    X, Y = _rotate_origin(X, Y, rotation)
-    # Calculate relative tracker height based on surface slope
-    Z = - X * np.sin(np.deg2rad(slope_azimuth)) * \
-        np.tan(np.deg2rad(slope_tilt)) \
-        - Y * np.cos(np.deg2rad(slope_azimuth)) * \
-        np.tan(np.deg2rad(slope_tilt))
+    X, Y = _unit_field_layout(neighbor_order, aspect_ratio, offset, rotation)
+    # The relative azimuth is defined clockwise eastwards from north. As the
+    # scaling is positive, it can be calculated from the unscaled layout.
+    relative_azimuth = np.mod(450-np.rad2deg(np.arctan2(Y, X)), 360)
+    Z, relative_slope = _slope_field_layout(X, Y, relative_azimuth, slope_azimuth, slope_tilt)
     # Calculate and apply the scaling factor based on GCR
-    scaling = np.sqrt(total_collector_area / (gcr * aspect_ratio))
+    # Avoid "RuntimeWarning: invalid value encountered in sqrt" for infeasible
+    # parameter combinations, e.g., negative gcr
+    with np.errstate(invalid='ignore', divide='ignore'):
+        scaling = _layout_scaling(gcr, total_collector_area, aspect_ratio)
     X, Y = X*scaling, Y*scaling
 
-    # Calculate distance and angle of shading trackers relative to the center
+    # Calculate distance of shading trackers relative to the center
     tracker_distance = np.sqrt(X**2 + Y**2)
-    # The relative azimuth is defined clockwise eastwards from north
-    relative_azimuth = np.mod(450-np.rad2deg(np.arctan2(Y, X)), 360)
-    # Relative slope of collectors
-    # positive means collector is higher than reference collector
-    relative_slope = np.rad2deg(np.arctan(-np.cos(np.deg2rad(slope_azimuth - relative_azimuth))
-                                          * np.tan(np.deg2rad(slope_tilt))))
 
-    return X, Y, Z, tracker_distance, relative_azimuth, relative_slope
+    field_layout = (X, Y, Z, tracker_distance, relative_azimuth, relative_slope)
+    if return_feasible:
+        # Set the layout of infeasible parameter combinations to nan
+        field_layout = tuple(np.where(np.expand_dims(feasible, axis=-1), a, np.nan)
+                             for a in np.broadcast_arrays(*field_layout))
+        return field_layout + (feasible,)
+    else:
+        return field_layout
 
 
 def max_shading_elevation(total_collector_geometry, tracker_distance,
@@ -136,16 +287,22 @@ def max_shading_elevation(total_collector_geometry, tracker_distance,
     total_collector_geometry: :py:class:`Shapely Polygon <Polygon>`
         Polygon corresponding to the total collector area.
     tracker_distance: array-like
-        Distances between neighboring trackers and the reference tracker.
+        Distances between neighboring trackers and the reference tracker. The
+        last axis corresponds to the neighbors, i.e., multiple layouts can be
+        specified as an array with the shape (n_layouts, n_neighbors).
     relative_slope: array-like
         Slope between neighboring trackers and reference tracker. A positive
         slope means neighboring collector is higher than reference collector.
+        Broadcast against ``tracker_distance``.
 
     Returns
     -------
-    max_shading_elevation: float
+    max_shading_elevation: float or array of floats
         The highest solar elevation angle for which shading can occur for a
-        given field layout and collector geometry [degrees]
+        given field layout and collector geometry [degrees]. For multiple
+        layouts, an array with one value per layout is returned. The
+        elevation is nan for layouts where all tracker distances are nan
+        (e.g., infeasible layouts).
 
     Note
     ----
@@ -164,6 +321,8 @@ def max_shading_elevation(total_collector_geometry, tracker_distance,
     whereas for other geometries, the returned elevation is a conservative
     estimate.
     """
+    tracker_distance, relative_slope = np.broadcast_arrays(
+        np.asarray(tracker_distance, dtype=float), relative_slope)
     # Calculate extent of box bounding the total collector geometry
     x_min, y_min, x_max, y_max = total_collector_geometry.bounds
     # Collector rectangular bounding box dimensions
@@ -182,8 +341,275 @@ def max_shading_elevation(total_collector_geometry, tracker_distance,
         (D_min * np.cos(np.deg2rad(relative_slope)))/tracker_distance)) \
         + relative_slope
     # Compute max elevation (if both contain nan, then set max_elevation to 90)
-    max_elevation = np.min(
-        [np.nan_to_num(max_elevations_rectangular, nan=90).max(),
-         np.nan_to_num(max_elevations_circular, nan=90).max()])
+    max_elevation = np.minimum(
+        np.nan_to_num(max_elevations_rectangular, nan=90).max(axis=-1),
+        np.nan_to_num(max_elevations_circular, nan=90).max(axis=-1))
+    if np.ndim(max_elevation) > 0:
+        # Layouts without any tracker distances are infeasible layouts
+        max_elevation[np.isnan(tracker_distance).all(axis=-1)] = np.nan
 
     return max_elevation
+
+
+def _sample_elevation(elevation, x, y, cell_size, origin):
+    """Bilinearly interpolate an elevation raster at the points (x, y).
+
+    Only the raster cells surrounding the points are read, which means that
+    memory-mapped rasters are not loaded into memory.
+    """
+    n_rows, n_cols = elevation.shape
+    # Fractional raster indices with row 0 being the northern edge
+    col = (x - origin[0]) / cell_size - 0.5
+    row = (origin[1] - y) / cell_size - 0.5
+    c0 = np.clip(np.floor(col).astype(int), 0, n_cols - 2)
+    r0 = np.clip(np.floor(row).astype(int), 0, n_rows - 2)
+    fc, fr = col - c0, row - r0
+    z = (elevation[r0, c0] * (1 - fc) * (1 - fr)
+         + elevation[r0, c0 + 1] * fc * (1 - fr)
+         + elevation[r0 + 1, c0] * (1 - fc) * fr
+         + elevation[r0 + 1, c0 + 1] * fc * fr)
+    return z
+
+
+def generate_terrain_layout(elevation, cell_size, gcr, total_collector_area,
+                            min_tracker_spacing, neighbor_order, aspect_ratio,
+                            offset, rotation, origin=(0, 0)):
+    """
+    Generate a regularly-spaced collector field layout following the terrain.
+
+    The collectors are placed on the regular field layout described by the
+    layout parameters (see :py:func:`generate_field_layout`) within the
+    extent of the elevation raster, and the heights of the collectors are
+    determined by bilinear interpolation of the raster. In contrast to
+    :py:func:`generate_field_layout`, the relative slope between a collector
+    and its neighbors differs from collector to collector.
+
+    Parameters
+    ----------
+    elevation: 2D array-like
+        Elevation raster (digital elevation model) of the site, where the
+        first row corresponds to the northern edge. Large rasters can be
+        provided as memory-mapped arrays, e.g., using
+        ``numpy.load(filename, mmap_mode='r')``, as only the raster cells
+        surrounding the collectors are read.
+    cell_size: float
+        Side length of the raster cells. Needs to have the same unit as the
+        collector geometry.
+    gcr: float
+        Ground cover ratio. Ratio of collector area to ground area.
+    total_collector_area: float
+        Surface area of one collector.
+    min_tracker_spacing: float
+        Minimum distance between collectors.
+    neighbor_order: int
+        Order of neighbors to include in layout. It is recommended to use a
+        neighbor order of 2.
+    aspect_ratio: float
+        Ratio of the spacing in the primary direction to the secondary.
+    offset: float
+        Relative row offset in the secondary direction as fraction of the
+        spacing in the primary direction. -0.5 <= offset < 0.5.
+    rotation: float
+        Counterclockwise rotation of the field in degrees. 0 <= rotation < 180
+    origin: tuple of floats, default: (0, 0)
+        Coordinates (x, y) of the north-west (upper-left) corner of the raster.
+
+    Returns
+    -------
+    x: array of floats
+        East-west positions of the collectors. East is positive.
+    y: array of floats
+        North-south positions of the collectors. North is positive.
+    z: array of floats
+        Heights of the collectors.
+    X: array of floats
+        Distance of neighboring trackers to the reference tracker in the east-
+        west direction. East is positive.
+    Y: array of floats
+        Distance of neighboring trackers to the reference tracker in the north-
+        south direction. North is positive.
+    tracker_distance: array of floats
+        Distances between neighboring trackers and the reference tracker.
+    relative_azimuth: array of floats
+        Relative azimuth of neighboring trackers - measured clockwise from
+        north [degrees].
+    relative_slope: 2D array of floats
+        Slope between each collector (rows) and its neighboring collectors
+        (columns) [degrees]. A positive slope means the neighboring collector
+        is higher. The slope is nan for neighbors outside the raster extent.
+    """
+    elevation_shape = np.shape(elevation)
+    if (len(elevation_shape) != 2) or (min(elevation_shape) < 2):
+        raise ValueError('The elevation raster needs to be two-dimensional '
+                         'with at least two rows and columns.')
+    X, Y, _, tracker_distance, relative_azimuth, _ = generate_field_layout(
+        gcr=gcr, total_collector_area=total_collector_area,
+        min_tracker_spacing=min_tracker_spacing, neighbor_order=neighbor_order,
+        aspect_ratio=aspect_ratio, offset=offset, rotation=rotation)
+
+    # Collectors are placed within the extent of the raster cell centers
+    n_rows, n_cols = elevation_shape
+    x_min = origin[0] + cell_size / 2
+    x_max = origin[0] + cell_size * (n_cols - 0.5)
+    y_min = origin[1] - cell_size * (n_rows - 0.5)
+    y_max = origin[1] - cell_size / 2
+    center = np.array([(x_min + x_max) / 2, (y_min + y_max) / 2])
+
+    basis = _lattice_vectors(gcr, total_collector_area, aspect_ratio, offset, rotation)
+    # Determine the range of lattice indices covering the raster extent
+    corners = np.array([[x_min, x_max, x_min, x_max],
+                        [y_min, y_min, y_max, y_max]]) - center[:, np.newaxis]
+    corner_indices = np.linalg.solve(basis, corners)
+    i_min, j_min = np.floor(corner_indices.min(axis=1)).astype(int)
+    i_max, j_max = np.ceil(corner_indices.max(axis=1)).astype(int)
+    i, j = np.meshgrid(np.arange(i_min, i_max + 1), np.arange(j_min, j_max + 1),
+                       indexing='ij')
+    x, y = center[:, np.newaxis] + basis @ np.array([i.ravel(), j.ravel()])
+    inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+    x, y, i, j = x[inside], y[inside], i.ravel()[inside], j.ravel()[inside]
+    z = _sample_elevation(elevation, x, y, cell_size, origin)
+
+    # Look up the index of each neighbor using a grid of lattice indices,
+    # where -1 denotes lattice points outside the raster extent
+    index_grid = np.full((i_max - i_min + 3, j_max - j_min + 3), -1)
+    index_grid[i - i_min + 1, j - j_min + 1] = np.arange(len(x))
+    di, dj = _neighbor_indices(neighbor_order)
+    neighbor_i = np.clip(i[:, np.newaxis] + di - i_min + 1, 0, index_grid.shape[0] - 1)
+    neighbor_j = np.clip(j[:, np.newaxis] + dj - j_min + 1, 0, index_grid.shape[1] - 1)
+    neighbor = index_grid[neighbor_i, neighbor_j]
+    # Positive slope means the neighboring collector is higher
+    relative_slope = np.rad2deg(np.arctan((z[neighbor] - z[:, np.newaxis]) / tracker_distance))
+    relative_slope[neighbor == -1] = np.nan
+    return x, y, z, X, Y, tracker_distance, relative_azimuth, relative_slope
+
+
+def group_neighbor_profiles(relative_slope, slope_tolerance=0.01):
+    """Group collectors with near-identical relative slopes to their neighbors.
+
+    Collectors in the same group experience (nearly) the same shading, which
+    means that the shaded fraction only needs to be calculated once per group.
+
+    Parameters
+    ----------
+    relative_slope: 2D array-like
+        Slope between each collector (rows) and its neighboring collectors
+        (columns) [degrees]. Neighbors that do not exist are specified as nan.
+    slope_tolerance: float, default: 0.01
+        Relative slopes are considered identical if they round to the same
+        multiple of ``slope_tolerance`` [degrees].
+
+    Returns
+    -------
+    group: array of ints
+        Group index of each collector.
+    group_relative_slope: 2D array of floats
+        Mean relative slope of the collectors in each group (rows) to the
+        neighboring collectors (columns) [degrees].
+    """
+    relative_slope = np.asarray(relative_slope, dtype=float)
+    # Missing neighbors are set to infinity as nan values are never identical
+    rounded_slope = np.nan_to_num(np.round(relative_slope / slope_tolerance), nan=np.inf)
+    _, group = np.unique(rounded_slope, axis=0, return_inverse=True)
+    group = group.ravel()
+    n_groups = group.max() + 1
+    # Average the slopes of each group. Missing neighbors are the same within
+    # a group and remain nan.
+    group_relative_slope = np.zeros((n_groups, relative_slope.shape[1]))
+    np.add.at(group_relative_slope, group, relative_slope)
+    group_relative_slope /= np.bincount(group, minlength=n_groups)[:, np.newaxis]
+    return group, group_relative_slope
+
+
+def generate_coordinate_layout(x, y, z, min_tracker_spacing, max_distance,
+                               tolerance=1e-3):
+    """
+    Determine the neighbors of collectors with arbitrary positions.
+
+    The neighbors of each collector, i.e., the collectors within
+    ``max_distance``, are found using a KD-tree, which scales to fields with
+    many thousands of collectors. Collectors with identical neighbor offsets
+    are grouped, such that the shading only needs to be calculated once per
+    group.
+
+    Parameters
+    ----------
+    x: array-like
+        East-west positions of the collectors. East is positive.
+    y: array-like
+        North-south positions of the collectors. North is positive.
+    z: array-like
+        Heights of the collectors.
+    min_tracker_spacing: float
+        Minimum distance between collectors.
+    max_distance: float
+        Maximum horizontal distance between a collector and the neighbors that
+        may shade it.
+    tolerance: float, default: 1e-3
+        Neighbor offsets are considered identical if they round to the same
+        multiple of ``tolerance``. Needs to have the same unit as the
+        positions. The group layouts use the rounded offsets. For positions
+        with random deviations, a tolerance of about ten times the deviations
+        is needed for collectors to share groups.
+
+    Returns
+    -------
+    group: array of ints
+        Group index of each collector.
+    group_layouts: list of tuples
+        The neighbors of each group as a tuple of (tracker_distance,
+        relative_azimuth, relative_slope) arrays. See
+        :py:func:`generate_field_layout` for a description.
+
+    Raises
+    ------
+    ValueError
+        If any collectors are closer to each other than
+        ``min_tracker_spacing``.
+
+    Notes
+    -----
+    Requires scipy.
+    """
+    try:
+        from scipy.spatial import cKDTree
+    except ImportError:
+        raise ImportError('scipy is required for determining the neighbors of '
+                          'collectors with arbitrary positions.')
+    x, y, z = np.broadcast_arrays(np.asarray(x, dtype=float), y, z)
+    n_trackers = len(x)
+
+    tree = cKDTree(np.column_stack([x, y]))
+    # Collectors that are exactly min_tracker_spacing apart do not collide
+    if len(tree.query_pairs(np.nextafter(min_tracker_spacing, 0), output_type='ndarray')) > 0:
+        raise ValueError('One or more collectors are closer to each other than '
+                         'the minimum tracker spacing.')
+    pairs = tree.query_pairs(max_distance, output_type='ndarray')
+    # Each pair of collectors are neighbors to each other
+    tracker_index = np.concatenate([pairs[:, 0], pairs[:, 1]])
+    neighbor_index = np.concatenate([pairs[:, 1], pairs[:, 0]])
+
+    # Quantize the neighbor offsets and sort them per collector, such that
+    # collectors with identical neighbor offsets have identical sequences
+    offsets = np.round(np.column_stack([
+        x[neighbor_index] - x[tracker_index],
+        y[neighbor_index] - y[tracker_index],
+        z[neighbor_index] - z[tracker_index]]) / tolerance).astype(np.int64)
+    order = np.lexsort((offsets[:, 2], offsets[:, 1], offsets[:, 0], tracker_index))
+    offsets = offsets[order]
+    splits = np.cumsum(np.bincount(tracker_index, minlength=n_trackers))[:-1]
+
+    groups = {}
+    group = np.empty(n_trackers, dtype=int)
+    for i, tracker_offsets in enumerate(np.split(offsets, splits)):
+        group[i] = groups.setdefault(tracker_offsets.tobytes(), len(groups))
+
+    group_layouts = []
+    for key in groups:
+        X, Y, Z = np.frombuffer(key, dtype=np.int64).reshape(-1, 3).T * tolerance
+        tracker_distance = np.sqrt(X**2 + Y**2)
+        # The relative azimuth is defined clockwise eastwards from north
+        relative_azimuth = np.mod(450-np.rad2deg(np.arctan2(Y, X)), 360)
+        # Positive slope means the neighboring collector is higher
+        relative_slope = np.rad2deg(np.arctan(Z / tracker_distance))
+        group_layouts.append((tracker_distance, relative_azimuth, relative_slope))
+    return group, group_layouts
@@ -1,4 +1,5 @@
 import matplotlib.pyplot as plt
+from matplotlib import animation
 from matplotlib import collections
 from matplotlib import patches
 from shapely import geometry
@@ -37,21 +38,26 @@ def _plot_field_layout(X, Y, Z, min_tracker_spacing):
     return fig
 
 
-def _polygons_to_patch_collection(geometries, **kwargs):
-    """Convert Shapely Polygon or MultiPolygon to matplotlib PathCollection.
-
-    kwargs are passed to PatchCollection
-    """
+def _polygons_to_patches(geometries):
+    """Convert Shapely Polygon, MultiPolygon, or list of Polygons to a list of
+    matplotlib Polygon patches."""
     # Convert geometries to a list
     if isinstance(geometries, geometry.Polygon):
-        # If polygon has area of zero, make path collection empty
+        # If polygon has area of zero, return no patches
         if geometries.area == 0:
-            return collections.PatchCollection([], **kwargs)
+            return []
         geometries = [geometries]
     elif isinstance(geometries, geometry.MultiPolygon):
         geometries = list(geometries.geoms)
-    exteriors = [patches.Polygon(g.exterior.coords) for g in geometries]
-    path_collection = collections.PatchCollection(exteriors, **kwargs)
+    return [patches.Polygon(g.exterior.coords) for g in geometries]
+
+
+def _polygons_to_patch_collection(geometries, **kwargs):
+    """Convert Shapely Polygon or MultiPolygon to matplotlib PathCollection.
+
+    kwargs are passed to PatchCollection
+    """
+    path_collection = collections.PatchCollection(_polygons_to_patches(geometries), **kwargs)
     return path_collection
 
 
@@ -75,3 +81,58 @@ def _plot_shading(active_collector_geometry, unshaded_geometry,
         ax.set_xlim(-min_tracker_spacing, min_tracker_spacing)
         ax.set_ylim(-min_tracker_spacing, min_tracker_spacing)
     return fig
+
+
+def _default_writer(filename):
+    """Name of the default animation writer for a file.
+
+    Gif files are written using the first available pipe-based writer
+    (imagemagick or ffmpeg), which streams the frames to the external
+    process. If neither is installed, the pillow writer is used, which keeps
+    all frames in memory until the animation is finished.
+    """
+    if str(filename).endswith('.gif'):
+        for name in ['imagemagick', 'ffmpeg']:
+            if animation.writers.is_available(name):
+                return name
+        return 'pillow'
+    return 'ffmpeg'
+
+
+def _animate_shading(frames, active_collector_geometry, min_tracker_spacing, filename,
+                     writer=None, fps=10, dpi=100):
+    """Write an animation of the shaded and unshaded area for a sequence of frames.
+
+    The figure and the patch collections are created once and only the
+    patches are updated for each frame. The frames are passed one at a time
+    to a matplotlib animation writer; pipe-based writers (e.g., ffmpeg) stream
+    the frames, such that the memory usage does not depend on the number of
+    frames.
+
+    Parameters
+    ----------
+    frames : iterable
+        Iterable of tuples (title, unshaded_geometry, shading_geometries).
+    writer : str or matplotlib.animation.AbstractMovieWriter, optional
+        Animation writer or name of a registered writer. By default, see
+        :py:func:`_default_writer`.
+    """
+    if writer is None:
+        writer = _default_writer(filename)
+    if isinstance(writer, str):
+        writer = animation.writers[writer](fps=fps)
+
+    fig = _plot_shading(active_collector_geometry, geometry.Polygon(), [],
+                        min_tracker_spacing)
+    active_patches, shading_patches = fig.axes[0].collections
+    unshaded_patches, = fig.axes[1].collections
+    title = fig.suptitle('')
+    try:
+        with writer.saving(fig, filename, dpi):
+            for frame_title, unshaded_geometry, shading_geometries in frames:
+                title.set_text(frame_title)
+                unshaded_patches.set_paths(_polygons_to_patches(unshaded_geometry))
+                shading_patches.set_paths(_polygons_to_patches(shading_geometries))
+                writer.grab_frame()
+    finally:
+        plt.close(fig)
@@ -1,3 +1,6 @@
+import collections
+import importlib.util
+import shapely
 from shapely import affinity
 from shapely import geometry
 import numpy as np
@@ -30,12 +33,1255 @@ def horizon_elevation_angle(azimuth, slope_azimuth, slope_tilt):
     return horizon_elevation_angle
 
 
+def _far_horizon_elevation_angle(azimuth, horizon_profile):
+    """Interpolate a horizon profile (pandas Series of horizon elevation angles
+    indexed by azimuth) periodically at the specified azimuth angles."""
+    profile_azimuth = np.mod(np.asarray(horizon_profile.index, dtype=float), 360)
+    order = np.argsort(profile_azimuth)
+    return np.interp(azimuth, profile_azimuth[order],
+                     np.asarray(horizon_profile, dtype=float)[order], period=360)
+
+
+def _horizon_table(slope_azimuth, slope_tilt, horizon_profile, resolution=0.1):
+    """Tabulate the combined horizon of the slope and a horizon profile.
+
+    Returns the horizon elevation angles at regularly spaced azimuth angles
+    from 0 to 360 degrees, such that the horizon can be looked up for many
+    solar positions without searching (see :py:func:`_lookup_horizon`).
+    """
+    azimuth = np.linspace(0, 360, int(round(360 / resolution)) + 1)
+    return np.maximum(horizon_elevation_angle(azimuth, slope_azimuth, slope_tilt),
+                      _far_horizon_elevation_angle(azimuth, horizon_profile))
+
+
+def _lookup_horizon(horizon_table, azimuth):
+    """Linearly interpolate the horizon table at the specified azimuth angles."""
+    position = np.mod(np.asarray(azimuth, dtype=float), 360) / 360 * (len(horizon_table) - 1)
+    index = np.minimum(position.astype(int), len(horizon_table) - 2)
+    weight = position - index
+    return horizon_table[index] * (1 - weight) + horizon_table[index + 1] * weight
+
+
+def screen_neighbors(solar_elevation, solar_azimuth, min_tracker_spacing,
+                     tracker_distance, relative_azimuth, relative_slope):
+    """Identify the neighboring collectors that may shade the reference collector.
+
+    The screening is vectorized over all combinations of solar positions and
+    neighboring collectors. A neighboring collector is a shading candidate if
+    it is within the +/-90° field of view of the reference collector and its
+    projected geometry is closer than ``min_tracker_spacing``.
+
+    Parameters
+    ----------
+    solar_elevation: array-like
+        Solar elevation angles in degrees.
+    solar_azimuth: array-like
+        Solar azimuth angles in degrees.
+    min_tracker_spacing: float
+        Minimum distance between collectors.
+    tracker_distance: array-like
+        Distances between neighboring trackers and reference tracker. Can be
+        a 2D array with the shape (n_solar_positions, n_neighbors) in case the
+        neighbors differ between solar positions.
+    relative_azimuth: array-like
+        Relative azimuth between neigboring trackers and reference tracker.
+        Same shape as ``tracker_distance``.
+    relative_slope: array-like
+        Slope between neighboring trackers and reference tracker. A positive
+        slope means neighboring collector is higher than reference collector.
+        Same shape as ``tracker_distance``.
+
+    Returns
+    -------
+    time_index: array of ints
+        Index of the solar position of each shading candidate.
+    neighbor_index: array of ints
+        Index of the neighboring collector of each shading candidate.
+    xoff: array of floats
+        Offset of the projected geometry of each shading candidate in the
+        x-direction of the plane of the reference collector.
+    yoff: array of floats
+        Offset of the projected geometry of each shading candidate in the
+        y-direction of the plane of the reference collector.
+
+    Notes
+    -----
+    The shading candidates are sorted by ``time_index`` and then by
+    ``neighbor_index``.
+    """
+    in_view, xoff, yoff = _shadow_offsets(
+        solar_elevation, solar_azimuth, tracker_distance, relative_azimuth, relative_slope)
+    candidates = in_view & (np.sqrt(xoff**2+yoff**2) < min_tracker_spacing)
+    time_index, neighbor_index = np.nonzero(candidates)
+    return time_index, neighbor_index, xoff[candidates], yoff[candidates]
+
+
+def _shadow_offsets(solar_elevation, solar_azimuth, tracker_distance,
+                    relative_azimuth, relative_slope):
+    """Calculate the offsets of the projected neighbors for all solar positions.
+
+    Returns arrays with the shape (n_solar_positions, n_neighbors) of whether
+    the neighbors are within view and of the offsets in the x- and
+    y-direction of the plane of the reference collector.
+    """
+    solar_elevation = np.atleast_1d(solar_elevation)[:, np.newaxis]
+    solar_azimuth = np.atleast_1d(solar_azimuth)[:, np.newaxis]
+    tracker_distance = np.asarray(tracker_distance)
+    relative_slope = np.asarray(relative_slope)
+
+    azimuth_difference = solar_azimuth - relative_azimuth
+
+    # Only collectors within +/-90° view can cause shading
+    in_view = np.cos(np.deg2rad(azimuth_difference)) > 0
+
+    xoff = tracker_distance*np.sin(np.deg2rad(azimuth_difference))
+    yoff = - tracker_distance *\
+        np.cos(np.deg2rad(azimuth_difference)) * \
+        np.sin(np.deg2rad(solar_elevation-relative_slope)) / \
+        np.cos(np.deg2rad(relative_slope))
+    return in_view, xoff, yoff
+
+
+def _translate_geometries(geometry, xoff, yoff):
+    """Create an array of copies of a geometry translated by each offset.
+
+    Vectorized equivalent of calling :py:func:`shapely.affinity.translate`
+    for each offset.
+    """
+    geometries = np.full(len(xoff), geometry, dtype=object)
+    n_coordinates = shapely.get_num_coordinates(geometry)
+    offsets = np.repeat(np.column_stack([xoff, yoff]), n_coordinates, axis=0)
+    return shapely.transform(geometries, lambda coordinates: coordinates + offsets)
+
+
+def _transform_geometries(geometry, matrix, xoff, yoff):
+    """Create an array of copies of a geometry transformed by each affine map.
+
+    Vectorized equivalent of calling :py:func:`shapely.affinity.affine_transform`
+    for each of the 2x2 matrices, which have the shape (2, 2, n), and offsets.
+    """
+    geometries = np.full(len(xoff), geometry, dtype=object)
+    n_coordinates = shapely.get_num_coordinates(geometry)
+    matrices = np.repeat(np.moveaxis(matrix, -1, 0), n_coordinates, axis=0)
+    offsets = np.repeat(np.column_stack([xoff, yoff]), n_coordinates, axis=0)
+    return shapely.transform(geometries, lambda coordinates: np.einsum(
+        'nij,nj->ni', matrices, coordinates) + offsets)
+
+
+def _unshaded_geometries(total_collector_geometry, active_collector_geometry,
+                         row_index, xoff, yoff, n_rows, shading_geometries=None):
+    """Calculate the unshaded area for many rows of shading candidates at once.
+
+    Vectorized equivalent of calling :py:func:`_project_shading` for each
+    row (e.g., solar position). The shading candidates need to be sorted by
+    ``row_index``, and the shading geometries of each row are subtracted in
+    the same order as in :py:func:`_project_shading`. The translated shading
+    geometries can be passed as ``shading_geometries`` if already calculated.
+
+    Returns
+    -------
+    unshaded_geometries: array of geometries
+        The unshaded geometry of each row.
+    """
+    unshaded_geometries = np.full(n_rows, active_collector_geometry, dtype=object)
+    # Rank of each candidate within its row, i.e., the order of subtraction
+    rank = np.arange(len(row_index)) - np.searchsorted(row_index, row_index)
+    if shading_geometries is None:
+        shading_geometries = _translate_geometries(total_collector_geometry, xoff, yoff)
+    for k in range(rank.max(initial=-1) + 1):
+        rows = row_index[rank == k]
+        unshaded_geometries[rows] = shapely.difference(
+            unshaded_geometries[rows], shading_geometries[rank == k])
+    return unshaded_geometries
+
+
+def _project_shading(total_collector_geometry, active_collector_geometry, xoff, yoff):
+    """Calculate the unshaded area given the offsets of the shading collectors."""
+    # Initialize the unshaded area as the collector active collector area
+    unshaded_geometry = active_collector_geometry
+    shading_geometries = []
+    for x, y in zip(xoff, yoff):
+        # Project the geometry of the shading collector (total area) onto
+        # the plane of the reference collector
+        shading_geometry = affinity.translate(total_collector_geometry, x, y)
+        # Update the unshaded area based on overlapping shade
+        unshaded_geometry = unshaded_geometry.difference(shading_geometry)
+        shading_geometries.append(shading_geometry)
+    return unshaded_geometry, shading_geometries
+
+
+def _rasterize(cells, geometry):
+    """Area of each cell covered by the geometry."""
+    shapely.prepare(geometry)
+    # Only the cells along the boundary require the intersection to be calculated
+    covered_area = np.where(shapely.contains(geometry, cells), shapely.area(cells), 0)
+    boundary = shapely.intersects(geometry.boundary, cells)
+    covered_area[boundary] = shapely.area(shapely.intersection(cells[boundary], geometry))
+    return covered_area
+
+
+def _overlap_area_table(total_collector_geometry, active_collector_geometry,
+                        min_tracker_spacing, resolution=256):
+    """Tabulate the overlap area of the active area and a single shading collector.
+
+    The overlap area as a function of the offset of the shading collector is
+    the cross-correlation of the active and total collector areas, which is
+    calculated for all offsets at once using FFTs. The collector geometries
+    are rasterized on a grid with ``resolution`` cells across
+    ``min_tracker_spacing``, where the value of each cell is the area covered
+    by the geometry, which limits the discretization error to the cells
+    along the edges.
+
+    Returns
+    -------
+    overlap_areas: 2D array of floats
+        Overlap areas, where element [i, j] corresponds to the offsets
+        xoff = (i+1)*cell_size - min_tracker_spacing and
+        yoff = (j+1)*cell_size - min_tracker_spacing.
+    cell_size: float
+        Spacing of the tabulated offsets.
+    """
+    cell_size = min_tracker_spacing / resolution
+    edges = np.linspace(-min_tracker_spacing/2, min_tracker_spacing/2, resolution + 1)
+    x0, y0 = np.meshgrid(edges[:-1], edges[:-1], indexing='ij')
+    cells = shapely.box(x0, y0, x0 + cell_size, y0 + cell_size)
+    active_area = _rasterize(cells, active_collector_geometry)
+    total_coverage = _rasterize(cells, total_collector_geometry) / cell_size**2
+    # Convolution with the flipped total area equals the cross-correlation
+    shape = (2*resolution, 2*resolution)
+    overlap_areas = np.fft.irfft2(np.fft.rfft2(active_area, shape)
+                                  * np.fft.rfft2(total_coverage[::-1, ::-1], shape), shape)
+    overlap_areas = overlap_areas[:-1, :-1]
+    # Remove the round-off errors of the FFT where the geometries do not overlap
+    overlap_areas[overlap_areas < 1e-12 * active_collector_geometry.area] = 0
+    return overlap_areas, cell_size
+
+
+def _interpolate_overlap_area(overlap_areas, cell_size, min_tracker_spacing, xoff, yoff):
+    """Bilinear interpolation of the overlap area table at the specified offsets.
+
+    The overlap area is zero for offsets outside the table.
+    """
+    padded = np.pad(overlap_areas, 1)
+    # Fractional indices in the padded table
+    fx = np.clip((xoff + min_tracker_spacing) / cell_size, 0, padded.shape[0] - 1)
+    fy = np.clip((yoff + min_tracker_spacing) / cell_size, 0, padded.shape[1] - 1)
+    ix = np.minimum(fx.astype(int), padded.shape[0] - 2)
+    iy = np.minimum(fy.astype(int), padded.shape[1] - 2)
+    wx, wy = fx - ix, fy - iy
+    return ((1-wx)*(1-wy)*padded[ix, iy] + wx*(1-wy)*padded[ix+1, iy]
+            + (1-wx)*wy*padded[ix, iy+1] + wx*wy*padded[ix+1, iy+1])
+
+
+def _overlapping_shadows(row_index, xoff, yoff, min_tracker_spacing, n_rows):
+    """Determine the rows where the shadows of the candidates may overlap.
+
+    Shadows can only overlap if the distance between their offsets is less
+    than the minimum tracker spacing. The candidates need to be sorted by
+    ``row_index``.
+    """
+    overlapping = np.zeros(n_rows, dtype=bool)
+    max_candidates = np.bincount(row_index, minlength=1).max()
+    # Compare each candidate to the subsequent candidates in the same row
+    for lag in range(1, max_candidates):
+        same_row = row_index[lag:] == row_index[:-lag]
+        close = np.hypot(xoff[lag:] - xoff[:-lag], yoff[lag:] - yoff[:-lag]) \
+            < min_tracker_spacing
+        overlapping[row_index[lag:][same_row & close]] = True
+    return overlapping
+
+
+def _exact_engine(total_collector_geometry, active_collector_geometry, min_tracker_spacing,
+                  row_index, xoff, yoff, n_rows, state=None):
+    """Shading engine subtracting the shading geometries using shapely."""
+    unshaded_geometries = _unshaded_geometries(
+        total_collector_geometry, active_collector_geometry, row_index, xoff, yoff, n_rows)
+    return 1 - shapely.area(unshaded_geometries) / active_collector_geometry.area
+
+
+def _overlap_table_engine(total_collector_geometry, active_collector_geometry,
+                          min_tracker_spacing, row_index, xoff, yoff, n_rows, state):
+    """Shading engine interpolating the overlap area table (see
+    :py:func:`_overlap_area_table`) for rows where the shadows cannot overlap.
+
+    The remaining rows are calculated using the exact engine.
+    """
+    is_table = ~_overlapping_shadows(row_index, xoff, yoff, min_tracker_spacing, n_rows)
+    uses_table = is_table[row_index]
+    overlap_areas = np.bincount(
+        row_index[uses_table], minlength=n_rows,
+        weights=_interpolate_overlap_area(
+            *state, min_tracker_spacing, xoff[uses_table], yoff[uses_table]))
+    shaded_fractions = np.empty(n_rows)
+    shaded_fractions[is_table] = np.minimum(
+        overlap_areas[is_table] / active_collector_geometry.area, 1)
+    # Only rows with overlapping shadows remain
+    shaded_fractions[~is_table] = _exact_engine(
+        total_collector_geometry, active_collector_geometry, min_tracker_spacing,
+        (np.cumsum(~is_table) - 1)[row_index[~uses_table]], xoff[~uses_table],
+        yoff[~uses_table], np.count_nonzero(~is_table))
+    return shaded_fractions
+
+
+def _is_rectangle(polygon):
+    """Whether a geometry is a rectangle aligned with the coordinate axes."""
+    return (polygon.geom_type == 'Polygon') and shapely.equals(polygon, polygon.envelope)
+
+
+def _supports_rectangles(total_collector_geometry, active_collector_geometry):
+    """Whether the total area is a rectangle and the active area consists of
+    non-overlapping rectangles, all aligned with the coordinate axes."""
+    parts = shapely.get_parts(active_collector_geometry)
+    return (_is_rectangle(total_collector_geometry)
+            and all(_is_rectangle(part) for part in parts)
+            and np.isclose(shapely.area(parts).sum(), shapely.union_all(parts).area))
+
+
+def _rectangle_engine(total_collector_geometry, active_collector_geometry,
+                      min_tracker_spacing, row_index, xoff, yoff, n_rows, state=None,
+                      max_elements=2**24):
+    """Shading engine for rectangular collectors aligned with the coordinate axes.
+
+    The shadows are rectangles as well, and the shaded area of each active
+    rectangle is the area of the union of the clipped shadows, which is
+    calculated exactly on the grid of the shadow edges. The candidates of
+    each row are padded to the maximum number of candidates, and the rows
+    are processed in chunks of at most ``max_elements`` grid cells.
+    """
+    rank = np.arange(len(row_index)) - np.searchsorted(row_index, row_index)
+    n_candidates = rank.max(initial=0) + 1
+    x_min, y_min, x_max, y_max = total_collector_geometry.bounds
+    # Bounds of the shadows (rows, candidates), where padded shadows are empty
+    is_candidate = np.zeros((n_rows, n_candidates), dtype=bool)
+    is_candidate[row_index, rank] = True
+    shadows = np.zeros((4, n_rows, n_candidates))
+    shadows[:, row_index, rank] = [x_min + xoff, y_min + yoff, x_max + xoff, y_max + yoff]
+
+    shaded_areas = np.zeros(n_rows)
+    chunk_size = max(max_elements // (2*n_candidates + 1)**2, 1)
+    for part in shapely.get_parts(active_collector_geometry):
+        px_min, py_min, px_max, py_max = part.bounds
+        for start in range(0, n_rows, chunk_size):
+            rows = slice(start, start + chunk_size)
+            # Clip the shadows to the active rectangle (padded shadows collapse to a corner)
+            x0, x1 = np.where(is_candidate[rows], np.clip(shadows[[0, 2], rows], px_min, px_max),
+                              px_min)
+            y0, y1 = np.where(is_candidate[rows], np.clip(shadows[[1, 3], rows], py_min, py_max),
+                              py_min)
+            corners = np.full((len(x0), 2), [px_min, px_max])
+            xs = np.sort(np.concatenate([x0, x1, corners], axis=1), axis=1)
+            corners = np.full((len(y0), 2), [py_min, py_max])
+            ys = np.sort(np.concatenate([y0, y1, corners], axis=1), axis=1)
+            # A grid cell is shaded if its center is inside any of the shadows
+            cx = (xs[:, 1:, None] + xs[:, :-1, None]) / 2
+            cy = (ys[:, 1:, None] + ys[:, :-1, None]) / 2
+            inside_x = ((cx > x0[:, None]) & (cx < x1[:, None])).astype(np.uint8)
+            inside_y = ((cy > y0[:, None]) & (cy < y1[:, None])).astype(np.uint8)
+            shaded = np.einsum('ixk,iyk->ixy', inside_x, inside_y) > 0
+            shaded_areas[rows] += np.einsum(
+                'ix,iy,ixy->i', np.diff(xs, axis=1), np.diff(ys, axis=1), shaded)
+    return shaded_areas / active_collector_geometry.area
+
+
+ShadingEngine = collections.namedtuple(
+    'ShadingEngine',
+    ['shaded_fraction', 'supports', 'prepare', 'requires', 'exact', 'priority',
+     'min_solar_positions'])
+
+SHADING_ENGINES = {}
+
+
+def register_shading_engine(name, shaded_fraction, supports=None, prepare=None,
+                            requires=(), exact=True, priority=0, min_solar_positions=0):
+    """Register a shading engine.
+
+    All engines share the classification of the solar positions (e.g., below
+    the horizon or above the maximum shading elevation) and the screening of
+    the neighbors. The engine only calculates the shaded fraction of the
+    solar positions with at least one shading candidate.
+
+    Parameters
+    ----------
+    name : str
+        Name of the engine, e.g., for the ``engine`` parameter of
+        :py:meth:`twoaxistracking.TrackerField.get_shaded_fraction`.
+    shaded_fraction : function
+        Function with the signature ``shaded_fraction(total_collector_geometry,
+        active_collector_geometry, min_tracker_spacing, row_index, xoff, yoff,
+        n_rows, state)``, returning the shaded fraction of each of the
+        ``n_rows`` rows (solar positions). The offsets of the shading
+        candidates are sorted by ``row_index`` and each row has at least one
+        candidate.
+    supports : function, optional
+        Function with the signature ``supports(total_collector_geometry,
+        active_collector_geometry)`` returning whether the engine supports
+        the collector geometry. By default, all geometries are supported.
+    prepare : function, optional
+        Function with the signature ``prepare(total_collector_geometry,
+        active_collector_geometry, min_tracker_spacing)`` calculating the
+        ``state`` passed to the engine, e.g., a lookup table. The state is
+        cached by :py:class:`twoaxistracking.TrackerField`.
+    requires : tuple of str, optional
+        Names of the optional packages required by the engine.
+    exact : boolean, default: True
+        Whether the engine gives the same results as the exact engine (up to
+        round-off errors). Only exact engines are selected automatically.
+    priority : int, default: 0
+        The supported exact engine with the highest priority is selected
+        automatically.
+    min_solar_positions : int, default: 0
+        Minimum number of solar positions for which the engine is selected
+        automatically, e.g., if preparing the engine is expensive.
+    """
+    SHADING_ENGINES[name] = ShadingEngine(
+        shaded_fraction, supports, prepare, tuple(requires), exact, priority,
+        min_solar_positions)
+
+
+def _missing_requirements(engine):
+    return [module for module in SHADING_ENGINES[engine].requires
+            if importlib.util.find_spec(module) is None]
+
+
+def check_shading_engine(engine, total_collector_geometry, active_collector_geometry):
+    """Raise an error if a shading engine cannot be used for the collector geometry."""
+    if engine not in SHADING_ENGINES:
+        raise ValueError(f'engine must be one of {list(SHADING_ENGINES)}, got {engine!r}.')
+    missing = _missing_requirements(engine)
+    if missing:
+        raise ImportError(f'The {engine!r} engine requires {", ".join(missing)}.')
+    supports = SHADING_ENGINES[engine].supports
+    if (supports is not None) and not supports(total_collector_geometry,
+                                               active_collector_geometry):
+        raise ValueError(f'The {engine!r} engine does not support the collector geometry.')
+
+
+def select_shading_engine(total_collector_geometry, active_collector_geometry,
+                          n_solar_positions=None):
+    """Select the shading engine for a collector geometry.
+
+    The exact engine with the highest priority is selected among the engines
+    that support the collector geometry, whose optional dependencies are
+    installed, and whose minimum number of solar positions is met.
+
+    Parameters
+    ----------
+    total_collector_geometry : :py:class:`Shapely Polygon <Polygon>`
+        Polygon corresponding to the total collector area.
+    active_collector_geometry : :py:class:`Shapely Polygon <Polygon>` or :py:class:`MultiPolygon`
+        One or more polygons defining the active collector area.
+    n_solar_positions : int, optional
+        Number of solar positions. If not specified, the minimum number of
+        solar positions of the engines is ignored.
+
+    Returns
+    -------
+    engine : str
+        Name of the selected engine.
+    """
+    def is_available(name, engine):
+        return (engine.exact
+                and ((n_solar_positions is None)
+                     or (n_solar_positions >= engine.min_solar_positions))
+                and not _missing_requirements(name)
+                and ((engine.supports is None)
+                     or engine.supports(total_collector_geometry, active_collector_geometry)))
+
+    available = [name for name, engine in SHADING_ENGINES.items()
+                 if is_available(name, engine)]
+    # The first registered engine is selected in case of equal priority
+    return max(available, key=lambda name: SHADING_ENGINES[name].priority)
+
+
+register_shading_engine('exact', _exact_engine)
+register_shading_engine('overlap_table', _overlap_table_engine, prepare=_overlap_area_table,
+                        exact=False)
+register_shading_engine('rectangle', _rectangle_engine, supports=_supports_rectangles,
+                        priority=1)
+
+
+def _coherent_rows(row_index, neighbor_index, xoff, yoff, n_rows, offset_tolerance):
+    """Group consecutive rows whose shading candidates barely move.
+
+    Consecutive rows (e.g., ordered timesteps) belong to the same group if
+    they have the same shading candidates and the offsets of each candidate
+    moved by less than ``offset_tolerance`` since the first row of the group
+    (the anchor). The displacement from the anchor is bounded by the
+    cumulative displacement between consecutive rows, such that the groups
+    are determined without comparing each row to its anchor. Each row needs
+    to have at least one candidate and the candidates need to be sorted by
+    ``row_index`` and then by ``neighbor_index``.
+
+    Returns
+    -------
+    is_anchor : array of booleans
+        Whether each row is the first row of a group.
+    group_index : array of ints
+        Index of the group of each row.
+    """
+    counts = np.bincount(row_index, minlength=n_rows)
+    # The corresponding candidate in the previous row if the counts are equal
+    previous = np.arange(len(row_index)) - counts[row_index]
+    same_count = (np.diff(counts, prepend=-1) == 0)[row_index]
+    previous = np.where(same_count, previous, 0)
+    matches = same_count & (neighbor_index == neighbor_index[previous])
+    displacement = np.hypot(xoff - xoff[previous], yoff - yoff[previous])
+    row_displacement = np.zeros(n_rows)
+    np.maximum.at(row_displacement, row_index, displacement)
+    # A new segment starts where the candidates differ from the previous row
+    new_segment = np.bincount(row_index, weights=matches, minlength=n_rows) < counts
+    # Cumulative displacement since the start of each segment
+    row_displacement[new_segment] = 0
+    cumulative = np.cumsum(row_displacement)
+    segment_start = np.flatnonzero(new_segment)[np.cumsum(new_segment) - 1]
+    path_length = cumulative - cumulative[segment_start]
+    # Start a new group each time the path length exceeds a multiple of the tolerance
+    block = np.floor(path_length / offset_tolerance)
+    is_anchor = new_segment | (np.diff(block, prepend=np.nan) != 0)
+    return is_anchor, np.cumsum(is_anchor) - 1
+
+
+def _classify_solar_positions(solar_elevation, solar_azimuth, slope_azimuth,
+                              slope_tilt, max_shading_elevation, horizon_table=None,
+                              out=None):
+    """Determine the shaded fraction of solar positions without geometry calculations.
+
+    Vectorized equivalent of the checks at the beginning of
+    :py:func:`shaded_fraction`. If a ``horizon_table`` is specified (see
+    :py:func:`_horizon_table`), it replaces the horizon of the slope and takes
+    precedence over ``max_shading_elevation``. If ``out`` is specified, the
+    shaded fractions are written into it and ``out`` is returned.
+
+    Returns
+    -------
+    shaded_fractions: array of floats
+        Shaded fraction for solar positions that do not require geometry
+        calculations; nan for the remaining solar positions.
+    requires_geometry: array of bools
+        Whether the shaded fraction needs to be calculated using geometry.
+    """
+    below_horizon = solar_elevation < 0
+    above_max_shading_elevation = solar_elevation > max_shading_elevation
+    if horizon_table is None:
+        horizon = horizon_elevation_angle(solar_azimuth, slope_azimuth, slope_tilt)
+    else:
+        horizon = _lookup_horizon(horizon_table, solar_azimuth)
+    below_slope_horizon = solar_elevation <= horizon
+    if horizon_table is not None:
+        above_max_shading_elevation = above_max_shading_elevation & ~below_slope_horizon
+    if out is None:
+        shaded_fractions = np.select(
+            [below_horizon, above_max_shading_elevation, below_slope_horizon],
+            [np.nan, 0, 1], default=np.nan)
+    else:
+        # Assigned in reverse order of precedence, equivalent to np.select
+        shaded_fractions = out
+        shaded_fractions[...] = np.nan
+        shaded_fractions[below_slope_horizon] = 1
+        shaded_fractions[above_max_shading_elevation] = 0
+        shaded_fractions[below_horizon] = np.nan
+    requires_geometry = \
+        ~(below_horizon | above_max_shading_elevation | below_slope_horizon)
+    return shaded_fractions, requires_geometry
+
+
+def _shaded_fraction_timeseries(solar_elevation, solar_azimuth,
+                                total_collector_geometry, active_collector_geometry,
+                                min_tracker_spacing, tracker_distance, relative_azimuth,
+                                relative_slope, slope_azimuth=0, slope_tilt=0,
+                                max_shading_elevation=90, plot=False, horizon_table=None,
+                                engine='exact', engine_state=None, offset_tolerance=0,
+                                out=None):
+    """Calculate the shaded fraction for arrays of solar positions.
+
+    Gives the same results as calling :py:func:`shaded_fraction` for each
+    solar position, but the classification of the solar positions and the
+    screening of neighboring collectors are vectorized, and geometry
+    calculations are only carried out for the solar positions with shading
+    candidates.
+
+    The shaded fraction of the solar positions with shading candidates is
+    calculated by the registered shading ``engine`` (see
+    :py:func:`register_shading_engine`), whereas the classification,
+    screening, and the solar positions without candidates are shared by all
+    engines. The ``engine_state`` is calculated using the ``prepare``
+    function of the engine if not specified.
+
+    If ``offset_tolerance`` is greater than zero, consecutive solar positions
+    where the same neighbors are shading candidates and their offsets moved
+    by less than ``offset_tolerance`` reuse the shaded fraction of the first
+    of these solar positions (see :py:func:`_coherent_rows`).
+
+    If ``out`` is specified, the shaded fractions are written directly into
+    it (e.g., a memory-mapped array) and ``out`` is returned.
+    """
+    solar_elevation = np.asarray(solar_elevation, dtype=float)
+    solar_azimuth = np.asarray(solar_azimuth, dtype=float)
+    shaded_fractions, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation, horizon_table, out=out)
+
+    geometry_index = np.flatnonzero(requires_geometry)
+    # Neighbors specified per solar position, shape (n_solar_positions, n_neighbors)
+    tracker_distance, relative_azimuth, relative_slope = [
+        np.asarray(values)[geometry_index] if np.ndim(values) == 2 else values
+        for values in (tracker_distance, relative_azimuth, relative_slope)]
+    time_index, neighbor_index, xoff, yoff = screen_neighbors(
+        solar_elevation[geometry_index], solar_azimuth[geometry_index],
+        min_tracker_spacing, tracker_distance, relative_azimuth, relative_slope)
+
+    if plot:
+        # Split the candidates into groups belonging to each solar position
+        splits = np.searchsorted(time_index, np.arange(1, len(geometry_index)))
+        for i, x, y in zip(geometry_index, np.split(xoff, splits), np.split(yoff, splits)):
+            unshaded_geometry, shading_geometries = _project_shading(
+                total_collector_geometry, active_collector_geometry, x, y)
+            plotting._plot_shading(active_collector_geometry, unshaded_geometry,
+                                   shading_geometries, min_tracker_spacing)
+            shaded_fractions[i] = 1 - unshaded_geometry.area / active_collector_geometry.area
+    else:
+        # Solar positions without any shading candidates are unshaded
+        n_rows = len(geometry_index)
+        has_candidates = np.bincount(time_index, minlength=n_rows) > 0
+        shaded_fractions[geometry_index[~has_candidates]] = 0
+        shading_engine = SHADING_ENGINES[engine]
+        if engine_state is None and shading_engine.prepare is not None:
+            engine_state = shading_engine.prepare(
+                total_collector_geometry, active_collector_geometry, min_tracker_spacing)
+        row_index = (np.cumsum(has_candidates) - 1)[time_index]
+        n_rows = np.count_nonzero(has_candidates)
+        if offset_tolerance > 0:
+            # Only the anchors of the groups of coherent rows are calculated
+            is_anchor, group_index = _coherent_rows(
+                row_index, neighbor_index, xoff, yoff, n_rows, offset_tolerance)
+            uses_anchor = is_anchor[row_index]
+            row_index, xoff, yoff = \
+                group_index[row_index[uses_anchor]], xoff[uses_anchor], yoff[uses_anchor]
+            n_rows = np.count_nonzero(is_anchor)
+        else:
+            group_index = np.arange(n_rows)
+        shaded_fractions[geometry_index[has_candidates]] = shading_engine.shaded_fraction(
+            total_collector_geometry, active_collector_geometry, min_tracker_spacing,
+            row_index, xoff, yoff, n_rows, engine_state)[group_index]
+
+    return shaded_fractions
+
+
+def _collector_edges(total_collector_geometry):
+    """Calculate the edges of the collector geometry and their outward normals.
+
+    Returns the start and end points of the edges and the outward unit normal
+    vectors as arrays with the shape (n_edges, 2).
+    """
+    coordinates = []
+    for polygon in shapely.get_parts(total_collector_geometry):
+        # Oriented such that the collector is on the left side of all edges
+        polygon = geometry.polygon.orient(polygon)
+        coordinates += [np.asarray(ring.coords) for ring in [polygon.exterior,
+                                                             *polygon.interiors]]
+    starts = np.concatenate([c[:-1] for c in coordinates])
+    ends = np.concatenate([c[1:] for c in coordinates])
+    direction = ends - starts
+    normals = np.column_stack([direction[:, 1], -direction[:, 0]])
+    return starts, ends, normals / np.linalg.norm(normals, axis=1, keepdims=True)
+
+
+def _offset_jacobian(solar_elevation, solar_azimuth, X, Y, slope_azimuth, slope_tilt):
+    """Calculate the derivatives of the shadow offsets with respect to the
+    neighbor positions.
+
+    The offsets are those of :py:func:`_shadow_offsets`, where the relative
+    slope is that of the sloped field, i.e., the relative height of the
+    neighbor is a linear function of X and Y. Returns the derivatives
+    d(xoff)/dX, d(xoff)/dY, d(yoff)/dX, and d(yoff)/dY.
+    """
+    e, a = np.deg2rad(solar_elevation), np.deg2rad(solar_azimuth)
+    sa, tan_tilt = np.deg2rad(slope_azimuth), np.tan(np.deg2rad(slope_tilt))
+    distance = np.sqrt(X**2 + Y**2)
+    # Distance towards the sun and relative height of the neighbor, where
+    # yoff = -along_sun*(sin(e) - cos(e)*height/distance)
+    along_sun = X*np.sin(a) + Y*np.cos(a)
+    height = -(X*np.sin(sa) + Y*np.cos(sa)) * tan_tilt
+    jacobian = []
+    for position, sun_component, slope_component in [
+            (X, np.sin(a), np.sin(sa)), (Y, np.cos(a), np.cos(sa))]:
+        d_height = -slope_component * tan_tilt
+        d_yoff = -sun_component*(np.sin(e) - np.cos(e)*height/distance) \
+            + along_sun*np.cos(e)*(d_height/distance - height*position/distance**3)
+        jacobian.append(d_yoff)
+    return -np.cos(a), np.sin(a), jacobian[0], jacobian[1]
+
+
+def _shaded_fraction_gradient(solar_elevation, solar_azimuth, total_collector_geometry,
+                              active_collector_geometry, min_tracker_spacing,
+                              tracker_distance, relative_azimuth, relative_slope,
+                              X, Y, dX, dY, slope_azimuth=0, slope_tilt=0,
+                              max_shading_elevation=90, horizon_table=None):
+    """Calculate the shaded fraction and its derivatives with respect to the layout.
+
+    The shaded area changes when a shadow is translated by the length of the
+    exposed edges of the shadow, i.e., the parts of the edges bordering the
+    unshaded area, times their outward normal vectors. The derivatives with
+    respect to the layout parameters follow from the chain rule using the
+    derivatives of the shadow offsets with respect to the neighbor positions
+    (:py:func:`_offset_jacobian`) and the derivatives of the neighbor
+    positions ``dX`` and ``dY`` with the shape (n_parameters, n_neighbors).
+
+    The exposed edges are found by shifting the edges of each shadow
+    slightly outwards and intersecting them with the unshaded geometry.
+
+    Returns
+    -------
+    shaded_fractions: array of floats
+    gradients: array of floats
+        Array with the shape (n_solar_positions, n_parameters).
+    """
+    solar_elevation = np.atleast_1d(np.asarray(solar_elevation, dtype=float))
+    solar_azimuth = np.atleast_1d(np.asarray(solar_azimuth, dtype=float))
+    shaded_fractions, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation, horizon_table)
+    gradients = np.zeros((len(solar_elevation), len(dX)))
+
+    geometry_index = np.flatnonzero(requires_geometry)
+    # Neighbors specified per solar position, shape (n_solar_positions, n_neighbors)
+    tracker_distance, relative_azimuth, relative_slope = [
+        np.asarray(values)[geometry_index] if np.ndim(values) == 2 else values
+        for values in (tracker_distance, relative_azimuth, relative_slope)]
+    time_index, neighbor_index, xoff, yoff = screen_neighbors(
+        solar_elevation[geometry_index], solar_azimuth[geometry_index],
+        min_tracker_spacing, tracker_distance, relative_azimuth, relative_slope)
+    unshaded_geometries = _unshaded_geometries(
+        total_collector_geometry, active_collector_geometry, time_index, xoff, yoff,
+        n_rows=len(geometry_index))
+    shaded_fractions[geometry_index] = \
+        1 - shapely.area(unshaded_geometries) / active_collector_geometry.area
+
+    # Exposed length of each edge of each shadow with the shape (n_candidates, n_edges)
+    starts, ends, normals = _collector_edges(total_collector_geometry)
+    shift = normals * 1e-9 * min_tracker_spacing
+    offsets = np.column_stack([xoff, yoff])[:, np.newaxis, :]
+    edges = shapely.linestrings(np.stack([starts + shift + offsets, ends + shift + offsets],
+                                         axis=-2))
+    exposed_length = shapely.length(shapely.intersection(
+        edges, unshaded_geometries[time_index, np.newaxis]))
+    # Derivative of the shaded fraction with respect to the offsets of each shadow
+    d_xoff, d_yoff = (exposed_length @ normals).T / active_collector_geometry.area
+
+    e, a = solar_elevation[geometry_index][time_index], solar_azimuth[geometry_index][time_index]
+    dxoff_dX, dxoff_dY, dyoff_dX, dyoff_dY = _offset_jacobian(
+        e, a, X[neighbor_index], Y[neighbor_index], slope_azimuth, slope_tilt)
+    dX, dY = dX[:, neighbor_index], dY[:, neighbor_index]
+    candidate_gradients = d_xoff*(dxoff_dX*dX + dxoff_dY*dY) \
+        + d_yoff*(dyoff_dX*dX + dyoff_dY*dY)
+    np.add.at(gradients, geometry_index[time_index], candidate_gradients.T)
+    gradients[np.isnan(shaded_fractions)] = np.nan
+    return shaded_fractions, gradients
+
+
+def _iter_shading_geometries(solar_elevation, solar_azimuth, total_collector_geometry,
+                             active_collector_geometry, min_tracker_spacing,
+                             tracker_distance, relative_azimuth, relative_slope,
+                             slope_azimuth=0, slope_tilt=0, max_shading_elevation=90,
+                             horizon_table=None):
+    """Generate the shaded fraction and geometries for each solar position.
+
+    Yields the same results as :py:func:`shaded_fraction` with
+    ``return_geometries=True``, i.e., tuples of (shaded_fraction,
+    unshaded_geometry, shading_geometries). The classification and screening
+    are vectorized, whereas the geometries are created one solar position at
+    a time.
+    """
+    solar_elevation = np.asarray(solar_elevation, dtype=float)
+    solar_azimuth = np.asarray(solar_azimuth, dtype=float)
+    shaded_fractions, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation, horizon_table)
+
+    geometry_index = np.flatnonzero(requires_geometry)
+    time_index, _, xoff, yoff = screen_neighbors(
+        solar_elevation[geometry_index], solar_azimuth[geometry_index],
+        min_tracker_spacing, tracker_distance, relative_azimuth, relative_slope)
+    splits = np.searchsorted(time_index, np.arange(1, len(geometry_index)))
+    offsets = dict(zip(geometry_index, zip(np.split(xoff, splits), np.split(yoff, splits))))
+
+    for i, shaded_fraction in enumerate(shaded_fractions):
+        if i in offsets:
+            unshaded_geometry, shading_geometries = _project_shading(
+                total_collector_geometry, active_collector_geometry, *offsets[i])
+            shaded_fraction = 1 - unshaded_geometry.area / active_collector_geometry.area
+        elif shaded_fraction == 0:
+            unshaded_geometry, shading_geometries = active_collector_geometry, []
+        else:  # Below the horizon or fully shaded
+            unshaded_geometry, shading_geometries = geometry.Polygon(), []
+        yield shaded_fraction, unshaded_geometry, shading_geometries
+
+
+def _shading_geometry_arrays(solar_elevation, solar_azimuth, total_collector_geometry,
+                             active_collector_geometry, min_tracker_spacing,
+                             tracker_distance, relative_azimuth, relative_slope,
+                             slope_azimuth=0, slope_tilt=0, max_shading_elevation=90,
+                             horizon_table=None):
+    """Calculate the shaded fraction and geometries for arrays of solar positions.
+
+    Vectorized equivalent of calling :py:func:`shaded_fraction` with
+    ``return_geometries=True`` for each solar position, except that the
+    shading geometries of each solar position are combined into a
+    MultiPolygon.
+
+    Returns
+    -------
+    shaded_fractions: array of floats
+    unshaded_geometries: array of geometries
+        The unshaded geometry of each solar position.
+    shading_geometries: array of geometries
+        MultiPolygon of the shading geometries of each solar position.
+    """
+    solar_elevation = np.atleast_1d(np.asarray(solar_elevation, dtype=float))
+    solar_azimuth = np.atleast_1d(np.asarray(solar_azimuth, dtype=float))
+    shaded_fractions, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation, horizon_table)
+    # Solar positions above the max_shading_elevation are unshaded, whereas
+    # positions below the horizon or fully shaded have no unshaded area
+    unshaded_geometries = np.where(shaded_fractions == 0, active_collector_geometry,
+                                   geometry.Polygon())
+    shading_geometries = np.full(len(solar_elevation), geometry.MultiPolygon())
+
+    geometry_index = np.flatnonzero(requires_geometry)
+    time_index, _, xoff, yoff = screen_neighbors(
+        solar_elevation[geometry_index], solar_azimuth[geometry_index],
+        min_tracker_spacing, tracker_distance, relative_azimuth, relative_slope)
+    translated_geometries = _translate_geometries(total_collector_geometry, xoff, yoff)
+    unshaded_geometries[geometry_index] = _unshaded_geometries(
+        total_collector_geometry, active_collector_geometry, time_index, xoff, yoff,
+        n_rows=len(geometry_index), shading_geometries=translated_geometries)
+    shapely.multipolygons(translated_geometries, indices=geometry_index[time_index],
+                          out=shading_geometries)
+    shaded_fractions[geometry_index] = \
+        1 - shapely.area(unshaded_geometries[geometry_index]) / active_collector_geometry.area
+    return shaded_fractions, unshaded_geometries, shading_geometries
+
+
+def _check_output_format(output_format):
+    """Check that the output format of geometries is supported."""
+    if output_format not in ('shapely', 'wkb', 'geoarrow'):
+        raise ValueError("output_format must be one of 'shapely', 'wkb', or 'geoarrow'.")
+
+
+def _encode_geometries(geometries, output_format):
+    """Encode an array of geometries as 'shapely', 'wkb', or 'geoarrow'.
+
+    The 'wkb' format is a tuple of a contiguous uint8 buffer and an array of
+    offsets, where the WKB of geometry i is ``buffer[offsets[i]:offsets[i+1]]``.
+    The 'geoarrow' format is the tuple (geometry_type, coordinates, offsets)
+    returned by :py:func:`shapely.to_ragged_array`.
+    """
+    _check_output_format(output_format)
+    if output_format == 'shapely':
+        return geometries
+    elif output_format == 'wkb':
+        wkb = shapely.to_wkb(geometries)
+        offsets = np.zeros(len(wkb) + 1, dtype=np.int64)
+        np.cumsum([len(w) for w in wkb], out=offsets[1:])
+        return np.frombuffer(b''.join(wkb), dtype=np.uint8), offsets
+    # Empty polygons are replaced by empty MultiPolygons, as they are not
+    # encoded correctly when mixed with MultiPolygons
+    geometries = np.where(shapely.is_empty(geometries), geometry.MultiPolygon(), geometries)
+    return shapely.to_ragged_array(geometries)
+
+
+def _sample(distribution, size, rng):
+    """Draw samples from a distribution specified as a standard deviation or
+    an object with an ``rvs`` method (e.g., a frozen scipy.stats distribution)."""
+    if hasattr(distribution, 'rvs'):
+        return distribution.rvs(size=size, random_state=rng)
+    return rng.normal(0, distribution, size=size)
+
+
+def _neighbor_positions(tracker_distance, relative_azimuth, relative_slope):
+    """Positions (east, north, up) of the neighbors relative to the reference
+    collector with the shape (3, ...)."""
+    ra = np.deg2rad(relative_azimuth)
+    return np.stack([tracker_distance*np.sin(ra), tracker_distance*np.cos(ra),
+                     tracker_distance*np.tan(np.deg2rad(relative_slope))])
+
+
+def _sun_pointing_axes(solar_elevation, solar_azimuth):
+    """Sun vector and axes of the sun-pointing collector plane (east, north,
+    up) with the shape (3, ...)."""
+    e, a = np.deg2rad(solar_elevation), np.deg2rad(solar_azimuth)
+    sun = np.stack(np.broadcast_arrays(np.cos(e)*np.sin(a), np.cos(e)*np.cos(a), np.sin(e)))
+    u_sun = np.stack(np.broadcast_arrays(-np.cos(a), np.sin(a), 0))
+    v_sun = np.stack(np.broadcast_arrays(-np.sin(e)*np.sin(a), -np.sin(e)*np.cos(a), np.cos(e)))
+    return sun, u_sun, v_sun
+
+
+def _reoriented_offsets(sun, u_sun, v_sun, normal, u, position):
+    """Calculate the change in shadow offsets caused by reorienting the collectors.
+
+    The collectors are rotated from facing the sun to facing ``normal``, with
+    ``u`` being the x-axis of the rotated collector plane. The collectors are
+    assumed to remain parallel, i.e., the shadows are translations, and the
+    change in offsets is the difference between projecting the neighbor
+    positions onto the rotated and the sun-pointing collector plane.
+
+    Returns
+    -------
+    dx, dy: arrays of floats
+        Change in the offsets in the x- and y-direction of the collector plane.
+    distance: array of floats
+        Distance along the sun vector from the collector plane to the
+        neighbors, which is positive if the neighbor is between the collector
+        and the sun.
+    """
+    v = np.cross(normal, u, axis=0)
+    distance = (position*normal).sum(axis=0) / (sun*normal).sum(axis=0)
+    # Project the positions along the sun vector onto the collector planes
+    projected = position - distance * sun
+    dx = (projected*u).sum(axis=0) - (position*u_sun).sum(axis=0)
+    dy = (projected*v).sum(axis=0) - (position*v_sun).sum(axis=0)
+    return dx, dy, distance
+
+
+def _misaligned_axes(sun, u_sun, v_sun, error_x, error_y):
+    """Normal vector and axes of collectors with a pointing error.
+
+    The collectors are rotated by ``error_x`` and ``error_y`` [degrees] around
+    the y- and x-axis of the sun-pointing collector plane, respectively, and
+    the x-axis of the misaligned collector plane remains horizontal.
+    """
+    normal = sun + np.tan(np.deg2rad(error_x))*u_sun + np.tan(np.deg2rad(error_y))*v_sun
+    normal = normal / np.linalg.norm(normal, axis=0)
+    normal_azimuth = np.arctan2(normal[0], normal[1])
+    u = np.stack(np.broadcast_arrays(-np.cos(normal_azimuth), np.sin(normal_azimuth), 0))
+    return normal, u, np.cross(normal, u, axis=0)
+
+
+def _pointing_error_projection(solar_elevation, solar_azimuth, tracker_distance,
+                               relative_azimuth, relative_slope, reference_error,
+                               neighbor_error):
+    """Calculate the shadows of neighbors with independent pointing errors.
+
+    The reference collector and each neighbor have their own pointing error
+    (see :py:func:`_misaligned_axes`), given as tuples of ``(error_x,
+    error_y)`` [degrees]. As the collectors are not parallel, the shadow of
+    a neighbor is the projection of the neighbor along the sun vector onto
+    the plane of the reference collector, which is an affine map of the
+    collector coordinates of the neighbor.
+
+    The solar angles and the errors of the reference collector need to have
+    the shape (n_solar_positions, 1), and the errors of the neighbors and the
+    returned arrays have the shape (n_solar_positions, n_neighbors).
+
+    Returns
+    -------
+    dx, dy: arrays of floats
+        Change in the offsets in the x- and y-direction of the plane of the
+        reference collector compared to :py:func:`_shadow_offsets`.
+    matrix: array of floats
+        Linear part of the affine map with the shape (2, 2,
+        n_solar_positions, n_neighbors), which is the identity matrix if the
+        neighbor is parallel to the reference collector.
+    """
+    sun, u_sun, v_sun = _sun_pointing_axes(solar_elevation, solar_azimuth)
+    normal, u, v = _misaligned_axes(sun, u_sun, v_sun, *reference_error)
+    neighbor_normal, neighbor_u, neighbor_v = _misaligned_axes(
+        sun, u_sun, v_sun, *neighbor_error)
+    # Linear functions giving the x- and y-coordinates in the reference plane
+    # of a point projected along the sun vector
+    sun_normal = (sun*normal).sum(axis=0)
+    w_u = u - normal * (sun*u).sum(axis=0) / sun_normal
+    w_v = v - normal * (sun*v).sum(axis=0) / sun_normal
+    position = _neighbor_positions(np.atleast_2d(tracker_distance),
+                                   np.atleast_2d(relative_azimuth), relative_slope)
+    dx = (position*w_u).sum(axis=0) - (position*u_sun).sum(axis=0)
+    dy = (position*w_v).sum(axis=0) - (position*v_sun).sum(axis=0)
+    matrix = np.array([[(neighbor_u*w_u).sum(axis=0), (neighbor_v*w_u).sum(axis=0)],
+                       [(neighbor_u*w_v).sum(axis=0), (neighbor_v*w_v).sum(axis=0)]])
+    return dx, dy, matrix
+
+
+def _shaded_fraction_tracker_angles(solar_elevation, solar_azimuth, tracker_elevation,
+                                    tracker_azimuth, total_collector_geometry,
+                                    active_collector_geometry, min_tracker_spacing,
+                                    tracker_distance, relative_azimuth, relative_slope,
+                                    slope_azimuth=0, slope_tilt=0, horizon_table=None):
+    """Calculate the shaded fraction of collectors with arbitrary orientations.
+
+    All collectors in the field have the same orientation, where the normal
+    of the collectors points towards ``tracker_elevation`` and
+    ``tracker_azimuth`` [degrees] and the x-axis of the collector plane is
+    horizontal. As the collectors are parallel, the shadows are translations
+    of the total collector geometry in the collector plane, and the offsets
+    of all (solar position, neighbor) pairs are calculated at once (see
+    :py:func:`_reoriented_offsets`).
+
+    The maximum shading elevation is not used to skip calculations, as it
+    only applies to sun-pointing collectors. The shaded fraction is one when
+    the sun is behind the collector plane.
+
+    Returns
+    -------
+    shaded_fractions: array of floats
+    cos_incidence: array of floats
+        Cosine of the angle of incidence of the sun on the collectors.
+    """
+    solar_elevation, solar_azimuth, tracker_elevation, tracker_azimuth = [
+        np.atleast_1d(np.asarray(x, dtype=float)) for x in np.broadcast_arrays(
+            solar_elevation, solar_azimuth, tracker_elevation, tracker_azimuth)]
+    sun, u_sun, v_sun = _sun_pointing_axes(solar_elevation, solar_azimuth)
+    te, ta = np.deg2rad(tracker_elevation), np.deg2rad(tracker_azimuth)
+    normal = np.stack([np.cos(te)*np.sin(ta), np.cos(te)*np.cos(ta), np.sin(te)])
+    u = np.stack(np.broadcast_arrays(-np.cos(ta), np.sin(ta), 0))
+    cos_incidence = (sun*normal).sum(axis=0)
+
+    shaded_fractions, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation=90, horizon_table=horizon_table)
+    shaded_fractions[requires_geometry & (cos_incidence <= 0)] = 1
+    geometry_index = np.flatnonzero(requires_geometry & (cos_incidence > 0))
+
+    in_view, xoff, yoff = _shadow_offsets(
+        solar_elevation[geometry_index], solar_azimuth[geometry_index],
+        tracker_distance, relative_azimuth, relative_slope)
+    dx, dy, distance = _reoriented_offsets(
+        *[x[:, geometry_index, np.newaxis] for x in (sun, u_sun, v_sun, normal, u)],
+        _neighbor_positions(tracker_distance, relative_azimuth, relative_slope)[:, np.newaxis])
+    xoff, yoff = xoff + dx, yoff + dy
+    candidates = in_view & (distance > 0) & (np.sqrt(xoff**2+yoff**2) < min_tracker_spacing)
+    time_index, _ = np.nonzero(candidates)
+    unshaded_geometries = _unshaded_geometries(
+        total_collector_geometry, active_collector_geometry, time_index,
+        xoff[candidates], yoff[candidates], n_rows=len(geometry_index))
+    shaded_fractions[geometry_index] = \
+        1 - shapely.area(unshaded_geometries) / active_collector_geometry.area
+    return shaded_fractions, cos_incidence
+
+
+def _optimize_pointing(solar_elevation, solar_azimuth, max_deviation, n_iterations,
+                       **kwargs):
+    """Search the tracker orientations that maximize the unshaded direct irradiance.
+
+    The objective is the cosine of the angle of incidence times the unshaded
+    fraction. For each solar position that is shaded when pointing at the
+    sun, the deviations of the tracker elevation and azimuth from the solar
+    position are first searched on a 5x5 grid within +/- ``max_deviation``,
+    after which the grid around the best deviation is refined ``n_iterations``
+    times, halving the grid spacing each time. All candidate orientations of
+    all solar positions are evaluated at once using
+    :py:func:`_shaded_fraction_tracker_angles`, to which ``kwargs`` are passed.
+
+    Returns
+    -------
+    tracker_elevation, tracker_azimuth, shaded_fractions, objective: arrays of floats
+    """
+    solar_elevation = np.atleast_1d(np.asarray(solar_elevation, dtype=float))
+    solar_azimuth = np.atleast_1d(np.asarray(solar_azimuth, dtype=float))
+
+    def evaluate(index, elevation_deviation, azimuth_deviation):
+        e, a = solar_elevation[index], solar_azimuth[index]
+        tracker_elevation = np.clip(e + elevation_deviation, 0, 90)
+        tracker_azimuth = np.mod(a + azimuth_deviation, 360)
+        shaded_fractions, cos_incidence = _shaded_fraction_tracker_angles(
+            e, a, tracker_elevation, tracker_azimuth, **kwargs)
+        return (tracker_elevation, tracker_azimuth, shaded_fractions,
+                cos_incidence * (1 - shaded_fractions))
+
+    results = evaluate(np.arange(len(solar_elevation)), 0, 0)
+    search_index = np.flatnonzero(results[2] > 0)
+    # The deviations that are searched, starting with the current best
+    # deviation, such that it is kept in case of ties
+    steps = np.array([0, -1, 1, -2, 2])
+    step_size = max_deviation / 2
+    best = np.zeros((len(search_index), 2))
+    for _ in range(n_iterations + 1):
+        de, da = [x.ravel() for x in np.meshgrid(steps, steps, indexing='ij')]
+        deviations = best[:, np.newaxis, :] + step_size * np.column_stack([de, da])
+        deviations = np.clip(deviations, -max_deviation, max_deviation)
+        candidates = evaluate(np.repeat(search_index, len(de)),
+                              deviations[..., 0].ravel(), deviations[..., 1].ravel())
+        optimum = np.argmax(candidates[3].reshape(len(search_index), len(de)), axis=1)
+        best = deviations[np.arange(len(search_index)), optimum]
+        steps = np.array([0, -1, 1])
+        step_size /= 2
+
+    selected = np.arange(len(search_index)) * len(de) + optimum
+    for result, candidate in zip(results, candidates):
+        result[search_index] = candidate[selected]
+    return results
+
+
+def _shaded_fraction_monte_carlo(solar_elevation, solar_azimuth,
+                                 total_collector_geometry, active_collector_geometry,
+                                 min_tracker_spacing, tracker_distance, relative_azimuth,
+                                 relative_slope, pointing_error=None, position_error=None,
+                                 n_realizations=1000, quantiles=(0.05, 0.5, 0.95),
+                                 slope_azimuth=0, slope_tilt=0, horizon_table=None, rng=None,
+                                 chunk_size=2**20):
+    """Calculate quantiles of the shaded fraction for perturbed field layouts.
+
+    Each realization perturbs the positions of the collectors (constant over
+    time) and the pointing of each collector (independent for each
+    collector and solar position). With pointing errors, the shadows are
+    affine maps of the total collector geometry (see
+    :py:func:`_pointing_error_projection`) instead of translations. All
+    realizations of a chunk of solar positions are evaluated at once, and
+    only the quantiles are kept. ``chunk_size`` limits the number of (solar
+    position, realization, neighbor) combinations in each chunk.
+
+    Returns
+    -------
+    shaded_fraction_quantiles: array of floats
+        Array with the shape (n_solar_positions, n_quantiles).
+    """
+    rng = np.random.default_rng(rng)
+    solar_elevation = np.atleast_1d(np.asarray(solar_elevation, dtype=float))
+    solar_azimuth = np.atleast_1d(np.asarray(solar_azimuth, dtype=float))
+    tracker_distance = np.asarray(tracker_distance, dtype=float)
+    n_neighbors = len(tracker_distance)
+
+    # Perturb the position of each neighbor relative to the reference collector
+    ra = np.deg2rad(relative_azimuth)
+    position = np.stack([tracker_distance*np.sin(ra), tracker_distance*np.cos(ra),
+                         tracker_distance*np.tan(np.deg2rad(relative_slope))])
+    position = np.broadcast_to(position[:, np.newaxis], (3, n_realizations, n_neighbors))
+    if position_error is not None:
+        position = position \
+            + _sample(position_error, (3, n_realizations, n_neighbors), rng) \
+            - _sample(position_error, (3, n_realizations, 1), rng)
+    tracker_distances = np.sqrt(position[0]**2 + position[1]**2)
+    relative_azimuths = np.mod(450-np.rad2deg(np.arctan2(position[1], position[0])), 360)
+    relative_slopes = np.rad2deg(np.arctan(position[2] / tracker_distances))
+
+    # The horizon and the sun being below it do not depend on the realization
+    results, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation=90, horizon_table=horizon_table)
+    results = np.repeat(results[:, np.newaxis], len(quantiles), axis=1)
+
+    geometry_index = np.flatnonzero(requires_geometry)
+    chunk_length = max(1, chunk_size // (n_realizations * n_neighbors))
+    for chunk in np.array_split(geometry_index, np.arange(
+            chunk_length, len(geometry_index), chunk_length)):
+        n_rows = len(chunk) * n_realizations
+        elevation = np.repeat(solar_elevation[chunk], n_realizations)
+        azimuth = np.repeat(solar_azimuth[chunk], n_realizations)
+        layout = [np.tile(a, (len(chunk), 1)) for a in (
+            tracker_distances, relative_azimuths, relative_slopes)]
+        in_view, xoff, yoff = _shadow_offsets(elevation, azimuth, *layout)
+        if pointing_error is None:
+            candidates = in_view & (np.sqrt(xoff**2+yoff**2) < min_tracker_spacing)
+            shading_geometries = None
+        else:
+            dx, dy, matrix = _pointing_error_projection(
+                elevation[:, np.newaxis], azimuth[:, np.newaxis], *layout,
+                reference_error=_sample(pointing_error, (2, n_rows, 1), rng),
+                neighbor_error=_sample(pointing_error, (2, n_rows, n_neighbors), rng))
+            xoff, yoff = xoff + dx, yoff + dy
+            # The shadow is within the largest singular value of the matrix
+            # times the radius of the collector from the offset
+            squared_norm = (matrix**2).sum(axis=(0, 1))
+            determinant = matrix[0, 0]*matrix[1, 1] - matrix[0, 1]*matrix[1, 0]
+            max_stretch = np.sqrt(
+                (squared_norm + np.sqrt(np.maximum(squared_norm**2 - 4*determinant**2, 0)))
+                / 2)
+            candidates = in_view & (np.sqrt(xoff**2+yoff**2)
+                                    < min_tracker_spacing / 2 * (1 + max_stretch))
+            shading_geometries = _transform_geometries(
+                total_collector_geometry, matrix[:, :, candidates], xoff[candidates],
+                yoff[candidates])
+        row_index, _ = np.nonzero(candidates)
+        unshaded_geometries = _unshaded_geometries(
+            total_collector_geometry, active_collector_geometry, row_index,
+            xoff[candidates], yoff[candidates], n_rows, shading_geometries)
+        shaded_fractions = 1 - shapely.area(unshaded_geometries) / active_collector_geometry.area
+        results[chunk] = np.quantile(
+            shaded_fractions.reshape(len(chunk), n_realizations), quantiles, axis=1).T
+    return results
+
+
+def _ground_shading(solar_elevation, solar_azimuth, total_collector_geometry,
+                    min_tracker_spacing, pivot_height, lattice_vectors, X, Y, x, y,
+                    slope_azimuth=0, slope_tilt=0, horizon_table=None,
+                    chunk_size=2**22):
+    """Determine which ground points are shaded by the collectors.
+
+    The ground is the plane defined by ``slope_azimuth`` and ``slope_tilt``
+    and the collectors are located at ``pivot_height`` above the ground at
+    the reference position (0, 0) and the neighbor positions (X, Y). A ground
+    point is shaded if the ray from the point towards the sun intersects the
+    total collector geometry of any collector.
+
+    As the field layout is periodic, each ground point is first translated by
+    a lattice vector such that the ray passes the pivot height above the
+    reference collector's unit cell. Thus, long shadows at low solar
+    elevation angles are accounted for without additional neighbors. Ground
+    points are considered shaded when the sun is below the horizon of the
+    slope or the ``horizon_table``, if specified. The
+    calculation is vectorized over solar positions and ground points, and
+    ``chunk_size`` limits the number of (solar position, point, collector)
+    combinations in each chunk.
+
+    Returns
+    -------
+    shaded: array of floats
+        Array with the shape (n_solar_positions, n_points), which is 1 for
+        shaded points, 0 for unshaded points, and nan when the sun is below
+        the horizon.
+    """
+    solar_elevation = np.atleast_1d(np.asarray(solar_elevation, dtype=float))
+    solar_azimuth = np.atleast_1d(np.asarray(solar_azimuth, dtype=float))
+    slope_x = np.sin(np.deg2rad(slope_azimuth)) * np.tan(np.deg2rad(slope_tilt))
+    slope_y = np.cos(np.deg2rad(slope_azimuth)) * np.tan(np.deg2rad(slope_tilt))
+    points = np.column_stack([x, y])
+    pivots = np.column_stack([np.append(0, X), np.append(0, Y)])
+    # Points are only shaded if within the bounding circle of a collector
+    radius = min_tracker_spacing / 2
+
+    shaded, requires_geometry = _classify_solar_positions(
+        solar_elevation, solar_azimuth, slope_azimuth, slope_tilt,
+        max_shading_elevation=90, horizon_table=horizon_table)
+    shaded = np.repeat(shaded[:, np.newaxis], len(points), axis=1)
+    geometry_index = np.flatnonzero(requires_geometry)
+    chunk_length = max(1, chunk_size // (len(points) * len(pivots)))
+    for chunk in np.array_split(geometry_index, np.arange(
+            chunk_length, len(geometry_index), chunk_length)):
+        e, a = np.deg2rad(solar_elevation[chunk]), np.deg2rad(solar_azimuth[chunk])
+        # Sun vector and axes of the sun-pointing collectors (solar positions, 3)
+        sun = np.column_stack([np.cos(e)*np.sin(a), np.cos(e)*np.cos(a), np.sin(e)])
+        u = np.column_stack([-np.cos(a), np.sin(a), np.zeros_like(a)])
+        v = np.column_stack([-np.sin(e)*np.sin(a), -np.sin(e)*np.cos(a), np.cos(e)])
+        # Horizontal distance at which the ray reaches the pivot height above ground
+        rise = sun[:, 2] + slope_x*sun[:, 0] + slope_y*sun[:, 1]
+        run = (pivot_height / rise)[:, np.newaxis, np.newaxis] * sun[:, np.newaxis, :2]
+        # Translate the points by lattice vectors (solar positions, points, 2)
+        lattice_index = np.round(np.linalg.solve(
+            lattice_vectors, (points + run)[..., np.newaxis])[..., 0])
+        translated = points - lattice_index @ lattice_vectors.T
+        # Vectors from the collector pivots to the translated points
+        relative_xy = translated[:, :, np.newaxis, :] - pivots
+        relative_z = -relative_xy[..., 0]*slope_x - relative_xy[..., 1]*slope_y \
+            - pivot_height
+        relative = np.concatenate([relative_xy, relative_z[..., np.newaxis]], axis=-1)
+        # Project the points along the sun vector onto the collector planes
+        towards_sun = np.einsum('tpcd,td->tpc', relative, sun) < 0
+        xp = np.einsum('tpcd,td->tpc', relative, u)
+        yp = np.einsum('tpcd,td->tpc', relative, v)
+        candidates = towards_sun & (xp**2 + yp**2 <= radius**2)
+        inside = np.zeros(candidates.shape, dtype=bool)
+        inside[candidates] = shapely.contains_xy(
+            total_collector_geometry, xp[candidates], yp[candidates])
+        shaded[chunk] = inside.any(axis=2)
+    return shaded
+
+
 def shaded_fraction(solar_elevation, solar_azimuth,
                     total_collector_geometry, active_collector_geometry,
                     min_tracker_spacing, tracker_distance, relative_azimuth,
                     relative_slope, slope_azimuth=0, slope_tilt=0,
                     max_shading_elevation=90, plot=False,
-                    return_geometries=False):
+                    return_geometries=False, horizon_profile=None):
     """Calculate the shaded fraction for any layout of two-axis tracking collectors.
 
     Parameters
@@ -75,6 +1321,13 @@ def shaded_fraction(solar_elevation, solar_azimuth,
     return_geometries: bool, default: False
         Whether to return the geometries of the unshaded area and the shading
         areas.
+    horizon_profile: pandas.Series, optional
+        Horizon elevation angles in degrees indexed by azimuth angles in
+        degrees, e.g., caused by mountains or buildings. The horizon is
+        interpolated linearly between the azimuth angles of the profile. The
+        collector is fully shaded when the sun is below the horizon profile
+        or the horizon caused by the slope, also when the solar elevation
+        angle is higher than ``max_shading_elevation``.
 
     Returns
     -------
@@ -89,6 +1342,11 @@ def shaded_fraction(solar_elevation, solar_azimuth,
         shaded collector's field of view. Only returned if
         ``return_geometries`` is True.
     """
+    # The horizon profile shades the collector regardless of the neighbors
+    below_horizon_profile = horizon_profile is not None and solar_elevation <= max(
+        horizon_elevation_angle(solar_azimuth, slope_azimuth, slope_tilt),
+        _far_horizon_elevation_angle(solar_azimuth, horizon_profile))
+
     # If the sun is below the horizon, set the shaded fraction to nan
     if solar_elevation < 0:
         shaded_fraction = np.nan
@@ -101,7 +1359,7 @@ def shaded_fraction(solar_elevation, solar_azimuth,
 
     # Set shaded fraction to 0 (unshaded) if solar elevation is higher than
     # max_shading_elevation
-    elif solar_elevation > max_shading_elevation:
+    elif solar_elevation > max_shading_elevation and not below_horizon_profile:
         shaded_fraction = 0  # no shading
         if return_geometries:
             # Unshaded area is equal to the active area, shading geometries
@@ -112,8 +1370,9 @@ def shaded_fraction(solar_elevation, solar_azimuth,
             return shaded_fraction
 
     # Set shaded fraction to 1 (fully shaded) if the solar elevation is below
-    # the horizon line caused by the tilted ground
-    elif solar_elevation <= horizon_elevation_angle(solar_azimuth, slope_azimuth, slope_tilt):
+    # the horizon line caused by the tilted ground or the horizon profile
+    elif below_horizon_profile or \
+            solar_elevation <= horizon_elevation_angle(solar_azimuth, slope_azimuth, slope_tilt):
         shaded_fraction = 1  # completely shaded
         if return_geometries:
             # Both geometries are set as empty
@@ -122,29 +1381,12 @@ def shaded_fraction(solar_elevation, solar_azimuth,
         else:
             return shaded_fraction
 
-    azimuth_difference = solar_azimuth - relative_azimuth
-
-    # Create mask to only calculate shading for collectors within +/-90° view
-    mask = np.where(np.cos(np.deg2rad(azimuth_difference)) > 0)
-
-    xoff = tracker_distance[mask]*np.sin(np.deg2rad(azimuth_difference[mask]))
-    yoff = - tracker_distance[mask] *\
-        np.cos(np.deg2rad(azimuth_difference[mask])) * \
-        np.sin(np.deg2rad(solar_elevation-relative_slope[mask])) / \
-        np.cos(np.deg2rad(relative_slope[mask]))
+    _, _, xoff, yoff = screen_neighbors(
+        solar_elevation, solar_azimuth, min_tracker_spacing, tracker_distance,
+        relative_azimuth, relative_slope)
 
-    # Initialize the unshaded area as the collector active collector area
-    unshaded_geometry = active_collector_geometry
-    shading_geometries = []
-    for i, (x, y) in enumerate(zip(xoff, yoff)):
-        if np.sqrt(x**2+y**2) < min_tracker_spacing:
-            # Project the geometry of the shading collector (total area) onto
-            # the plane of the reference collector
-            shading_geometry = affinity.translate(total_collector_geometry, x, y)  # noqa: E501
-            # Update the unshaded area based on overlapping shade
-            unshaded_geometry = unshaded_geometry.difference(shading_geometry)
-            if plot or return_geometries:
-                shading_geometries.append(shading_geometry)
+    unshaded_geometry, shading_geometries = _project_shading(
+        total_collector_geometry, active_collector_geometry, xoff, yoff)
 
     if plot:
         plotting._plot_shading(active_collector_geometry, unshaded_geometry,
@@ -0,0 +1,103 @@
+"""
+The `solarposition` module contains a compact, vectorized algorithm for
+calculating the solar position, which is sufficiently accurate for shading
+calculations. For other purposes, the solar position algorithms in pvlib are
+recommended.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def _atmospheric_refraction(elevation):
+    """Approximate atmospheric refraction [degrees] as a function of the
+    true solar elevation angle [degrees]."""
+    tan_elevation = np.tan(np.deg2rad(elevation))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        refraction = np.select(
+            [elevation > 85, elevation > 5, elevation > -0.575],
+            [0,
+             58.1/tan_elevation - 0.07/tan_elevation**3 + 0.000086/tan_elevation**5,
+             1735 + elevation*(-518.2 + elevation*(103.4 + elevation*(
+                 -12.79 + elevation*0.711)))],
+            default=-20.772/tan_elevation)
+    return refraction / 3600
+
+
+def solar_position(times, latitude, longitude):
+    """Calculate the apparent solar elevation and azimuth angles.
+
+    The solar position is calculated using the NOAA solar position algorithm,
+    which is based on the equations in [1]_. For the years 1950-2050, the
+    angular distance between the calculated solar position and the solar
+    position from the NREL solar position algorithm is less than 0.02
+    degrees when the sun is above the horizon. The atmospheric refraction is
+    approximated assuming standard atmospheric conditions.
+
+    Parameters
+    ----------
+    times : pandas.DatetimeIndex
+        Timestamps. Timezone-naive timestamps are assumed to be in UTC.
+    latitude : float
+        Latitude in degrees. North is positive.
+    longitude : float
+        Longitude in degrees. East is positive.
+
+    Returns
+    -------
+    solar_position : pandas.DataFrame
+        DataFrame with the columns 'solar_elevation' (apparent solar
+        elevation angle corrected for atmospheric refraction) and
+        'solar_azimuth' (clockwise from north) in degrees and the same index
+        as ``times``.
+
+    References
+    ----------
+    .. [1] J. Meeus, "Astronomical Algorithms", 2nd ed., Willmann-Bell, 1998.
+    """
+    utc_times = times.tz_convert('UTC') if times.tz is not None else times
+    julian_day = utc_times.to_julian_date().to_numpy()
+    # Julian centuries since J2000.0
+    T = (julian_day - 2451545) / 36525
+
+    # Geometric mean longitude, mean anomaly, and orbit eccentricity
+    mean_longitude = np.mod(280.46646 + T*(36000.76983 + T*0.0003032), 360)
+    mean_anomaly = np.deg2rad(357.52911 + T*(35999.05029 - 0.0001537*T))
+    eccentricity = 0.016708634 - T*(0.000042037 + 0.0000001267*T)
+    equation_of_center = (
+        np.sin(mean_anomaly)*(1.914602 - T*(0.004817 + 0.000014*T))
+        + np.sin(2*mean_anomaly)*(0.019993 - 0.000101*T)
+        + np.sin(3*mean_anomaly)*0.000289)
+    # Apparent longitude corrected for nutation and aberration
+    omega = np.deg2rad(125.04 - 1934.136*T)
+    apparent_longitude = np.deg2rad(
+        mean_longitude + equation_of_center - 0.00569 - 0.00478*np.sin(omega))
+    # Obliquity of the ecliptic corrected for nutation
+    obliquity = np.deg2rad(
+        23 + (26 + (21.448 - T*(46.815 + T*(0.00059 - T*0.001813)))/60)/60
+        + 0.00256*np.cos(omega))
+    declination = np.arcsin(np.sin(obliquity) * np.sin(apparent_longitude))
+
+    # Equation of time [minutes]
+    y = np.tan(obliquity/2)**2
+    L0 = np.deg2rad(mean_longitude)
+    equation_of_time = 4 * np.rad2deg(
+        y*np.sin(2*L0) - 2*eccentricity*np.sin(mean_anomaly)
+        + 4*eccentricity*y*np.sin(mean_anomaly)*np.cos(2*L0)
+        - 0.5*y**2*np.sin(4*L0) - 1.25*eccentricity**2*np.sin(2*mean_anomaly))
+
+    # Hour angle from the true solar time [minutes]
+    minutes = (utc_times - utc_times.normalize()).total_seconds().to_numpy() / 60
+    true_solar_time = minutes + equation_of_time + 4*longitude
+    hour_angle = np.deg2rad(true_solar_time/4 - 180)
+
+    lat = np.deg2rad(latitude)
+    elevation = np.rad2deg(np.arcsin(
+        np.sin(lat)*np.sin(declination)
+        + np.cos(lat)*np.cos(declination)*np.cos(hour_angle)))
+    azimuth = np.mod(np.rad2deg(np.arctan2(
+        np.sin(hour_angle),
+        np.cos(hour_angle)*np.sin(lat) - np.tan(declination)*np.cos(lat))) + 180, 360)
+    elevation = elevation + _atmospheric_refraction(elevation)
+    return pd.DataFrame({'solar_elevation': elevation, 'solar_azimuth': azimuth},
+                        index=times)
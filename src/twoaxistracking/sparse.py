@@ -0,0 +1,290 @@
+"""
+The `sparse` module contains a compact representation of shaded fraction
+time series, which are zero for most daylight time steps and nan at night.
+Only the runs of nonzero values and the runs of nan values are stored.
+"""
+
+import operator
+
+import numpy as np
+import pandas as pd
+
+
+def _runs(mask):
+    """Start and stop positions of the runs of True values in a boolean array."""
+    edges = np.diff(np.concatenate([[0], np.asarray(mask, dtype=np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _runs_from_positions(positions):
+    """Start and stop positions of the runs of consecutive sorted positions."""
+    if len(positions) == 0:
+        return positions, positions
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = positions[np.concatenate([[0], breaks])]
+    stops = positions[np.concatenate([breaks, [len(positions)]]) - 1] + 1
+    return starts, stops
+
+
+def _expand(starts, stops):
+    """Positions covered by runs, i.e., the concatenation of the ranges."""
+    lengths = stops - starts
+    # Offset of each position from the start of its run
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    return np.repeat(starts, lengths) + offsets
+
+
+def _union_runs(starts, stops):
+    """Merge overlapping and adjacent runs."""
+    if len(starts) == 0:
+        return starts, stops
+    order = np.argsort(starts, kind='stable')
+    starts, stops = starts[order], stops[order]
+    # A new run begins where the start is beyond all previous stops
+    previous_stop = np.maximum.accumulate(stops)
+    new_run = np.concatenate([[True], starts[1:] > previous_stop[:-1]])
+    run_index = np.cumsum(new_run) - 1
+    merged_stops = np.zeros(new_run.sum(), dtype=np.int64)
+    np.maximum.at(merged_stops, run_index, stops)
+    return starts[new_run], merged_stops
+
+
+class SparseShadedFraction:
+    """Run-length encoded time series of shaded fractions.
+
+    Only the runs of nonzero values (with their values) and the runs of nan
+    values are stored; all other values are zero. Arithmetic with scalars and
+    other sparse series only operates on the stored values, and the sum,
+    mean, and resampled mean are calculated without creating the dense
+    series.
+
+    Use :py:meth:`from_dense` or
+    :py:meth:`twoaxistracking.TrackerField.get_shaded_fraction_sparse` to
+    create a sparse series.
+
+    Parameters
+    ----------
+    length : int
+        Length of the series.
+    run_starts, run_stops : array of ints
+        Start and stop (exclusive) positions of the runs of nonzero values.
+    values : array of floats
+        The nonzero values of all runs.
+    nan_starts, nan_stops : array of ints
+        Start and stop (exclusive) positions of the runs of nan values.
+    index : pandas.Index, optional
+        Index of the series, e.g., a DatetimeIndex.
+    """
+
+    def __init__(self, length, run_starts, run_stops, values, nan_starts, nan_stops,
+                 index=None):
+        self.length = int(length)
+        self.run_starts = np.asarray(run_starts, dtype=np.int64)
+        self.run_stops = np.asarray(run_stops, dtype=np.int64)
+        self.values = np.asarray(values, dtype=float)
+        self.nan_starts = np.asarray(nan_starts, dtype=np.int64)
+        self.nan_stops = np.asarray(nan_stops, dtype=np.int64)
+        self.index = index
+
+    @property
+    def index(self):
+        """Index of the series, e.g., a DatetimeIndex, or None."""
+        return self._index
+
+    @index.setter
+    def index(self, index):
+        if index is not None and len(index) != self.length:
+            raise ValueError('The length of the index does not match the length.')
+        self._index = index
+
+    @classmethod
+    def from_dense(cls, values, index=None):
+        """Create a sparse series from a dense array or pandas Series.
+
+        The index of a Series is used unless ``index`` is specified.
+        """
+        if index is None and isinstance(values, pd.Series):
+            index = values.index
+        values = np.asarray(values, dtype=float)
+        is_nan = np.isnan(values)
+        run_starts, run_stops = _runs((values != 0) & ~is_nan)
+        nan_starts, nan_stops = _runs(is_nan)
+        return cls(len(values), run_starts, run_stops,
+                   values[_expand(run_starts, run_stops)], nan_starts, nan_stops, index)
+
+    @classmethod
+    def _from_positions(cls, length, positions, values, nan_starts, nan_stops, index):
+        """Create a sparse series from sorted positions and values, where the
+        positions within nan runs and the zero values are discarded."""
+        nan_positions = positions[np.isnan(values)]
+        if len(nan_positions):
+            nan_starts, nan_stops = _union_runs(
+                np.concatenate([nan_starts, nan_positions]),
+                np.concatenate([nan_stops, nan_positions + 1]))
+        # The last nan run starting at or before each position
+        run = np.searchsorted(nan_starts, positions, side='right')
+        in_nan_run = positions < np.concatenate([[0], nan_stops])[run]
+        keep = ~in_nan_run & (values != 0) & ~np.isnan(values)
+        run_starts, run_stops = _runs_from_positions(positions[keep])
+        return cls(length, run_starts, run_stops, values[keep], nan_starts, nan_stops,
+                   index)
+
+    @classmethod
+    def concat(cls, series):
+        """Concatenate sparse series, e.g., the results of consecutive batches.
+
+        The indexes are concatenated if all series have an index.
+        """
+        shifts = np.cumsum([0] + [len(s) for s in series])
+        runs = [np.concatenate([getattr(s, name) + shift for s, shift in zip(series, shifts)])
+                for name in ('run_starts', 'run_stops', 'nan_starts', 'nan_stops')]
+        # Runs at the boundaries between the series are merged
+        run_starts, run_stops = _union_runs(runs[0], runs[1])
+        nan_starts, nan_stops = _union_runs(runs[2], runs[3])
+        index = None
+        if all(s.index is not None for s in series):
+            index = series[0].index.append([s.index for s in series[1:]])
+        return cls(shifts[-1], run_starts, run_stops,
+                   np.concatenate([s.values for s in series]), nan_starts, nan_stops, index)
+
+    def __len__(self):
+        return self.length
+
+    def __repr__(self):
+        return (f'SparseShadedFraction(length={self.length}, nonzero={len(self.values)}, '
+                f'nan={self.count_nan()})')
+
+    @property
+    def positions(self):
+        """Positions of the nonzero values."""
+        return _expand(self.run_starts, self.run_stops)
+
+    @property
+    def nbytes(self):
+        """Number of bytes used by the stored runs and values."""
+        return sum(a.nbytes for a in (self.run_starts, self.run_stops, self.values,
+                                      self.nan_starts, self.nan_stops))
+
+    def to_numpy(self):
+        """Convert to a dense numpy array."""
+        values = np.zeros(self.length)
+        values[self.positions] = self.values
+        values[_expand(self.nan_starts, self.nan_stops)] = np.nan
+        return values
+
+    def to_series(self):
+        """Convert to a dense pandas Series."""
+        return pd.Series(self.to_numpy(), index=self.index)
+
+    def count_nan(self):
+        """Number of nan values."""
+        return int((self.nan_stops - self.nan_starts).sum())
+
+    def sum(self):
+        """Sum of the values, ignoring nan values."""
+        return self.values.sum()
+
+    def mean(self):
+        """Mean of the values, ignoring nan values."""
+        count = self.length - self.count_nan()
+        return self.values.sum() / count if count > 0 else np.nan
+
+    def resample(self, freq):
+        """Calculate the mean of each period, ignoring nan values.
+
+        Equivalent to ``to_series().resample(freq).mean()``, but without
+        creating the dense series of shaded fractions. Requires a sorted
+        DatetimeIndex.
+
+        Returns
+        -------
+        resampled : pandas.Series
+        """
+        if not isinstance(self.index, pd.DatetimeIndex):
+            raise ValueError('Resampling requires a DatetimeIndex.')
+        if not self.index.is_monotonic_increasing:
+            raise ValueError('Resampling requires a sorted index.')
+        # As the index is sorted, each period is a range of positions
+        periods = pd.Series(np.arange(self.length), index=self.index).resample(freq)
+        starts = periods.min().to_numpy()
+        counts = periods.count()
+        stops = starts + counts.to_numpy()
+        starts, stops = [np.nan_to_num(x).astype(np.int64) for x in (starts, stops)]
+        # Differences of cumulative sums evaluated at the period boundaries
+        positions = self.positions
+        cumulative_values = np.concatenate([[0], np.cumsum(self.values)])
+        value_sums = cumulative_values[np.searchsorted(positions, stops)] \
+            - cumulative_values[np.searchsorted(positions, starts)]
+        nan_counts = self._count_nan_before(stops) - self._count_nan_before(starts)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = value_sums / (counts.to_numpy() - nan_counts)
+        return pd.Series(means, index=counts.index)
+
+    def _count_nan_before(self, positions):
+        """Number of nan values before each position."""
+        # Number of nan values in all runs starting before each position, minus
+        # the part of the last of these runs at or after the position
+        n_runs = np.searchsorted(self.nan_starts, positions, side='right')
+        cumulative = np.concatenate([[0], np.cumsum(self.nan_stops - self.nan_starts)])
+        stops = np.concatenate([[0], self.nan_stops])
+        return cumulative[n_runs] - np.maximum(stops[n_runs] - positions, 0)
+
+    def _values_at(self, positions):
+        """Stored values at the specified positions (zero if not stored)."""
+        values = np.zeros(len(positions))
+        found = np.isin(positions, self.positions)
+        values[found] = self.values[np.searchsorted(self.positions, positions[found])]
+        return values
+
+    def _binary_op(self, other, op):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._apply_binary_op(other, op)
+
+    def _apply_binary_op(self, other, op):
+        if isinstance(other, SparseShadedFraction):
+            if len(other) != self.length:
+                raise ValueError('The sparse series need to have the same length.')
+            if not op(np.float64(0), 0) == 0:
+                # The result is not sparse, e.g., for division
+                return SparseShadedFraction.from_dense(
+                    op(self.to_numpy(), other.to_numpy()), self.index)
+            positions = np.union1d(self.positions, other.positions)
+            nan_starts, nan_stops = _union_runs(
+                np.concatenate([self.nan_starts, other.nan_starts]),
+                np.concatenate([self.nan_stops, other.nan_stops]))
+            values = op(self._values_at(positions), other._values_at(positions))
+        elif np.isscalar(other) and op(np.float64(0), other) == 0:
+            positions, nan_starts, nan_stops = self.positions, self.nan_starts, self.nan_stops
+            values = op(self.values, other)
+        else:
+            # Arrays and scalars that change the zero values
+            return SparseShadedFraction.from_dense(op(self.to_numpy(), other), self.index)
+        return SparseShadedFraction._from_positions(
+            self.length, positions, values, nan_starts, nan_stops, self.index)
+
+    def __add__(self, other):
+        return self._binary_op(other, operator.add)
+
+    def __sub__(self, other):
+        return self._binary_op(other, operator.sub)
+
+    def __mul__(self, other):
+        return self._binary_op(other, operator.mul)
+
+    def __truediv__(self, other):
+        return self._binary_op(other, operator.truediv)
+
+    def __radd__(self, other):
+        return self._binary_op(other, lambda a, b: b + a)
+
+    def __rsub__(self, other):
+        return self._binary_op(other, lambda a, b: b - a)
+
+    def __rmul__(self, other):
+        return self._binary_op(other, lambda a, b: b * a)
+
+    def __rtruediv__(self, other):
+        return self._binary_op(other, lambda a, b: b / a)
+
+    def __neg__(self):
+        return self * -1
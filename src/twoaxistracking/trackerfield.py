@@ -6,9 +6,13 @@ get started with the package and keeps track of the variables that are
 passed from one function to the next.
 """
 
-from twoaxistracking import layout, shading, plotting
+from twoaxistracking import layout, shading, plotting, solarposition, sparse
+import collections
+import sys
+
 import numpy as np
 import pandas as pd
+import shapely
 
 
 STANDARD_FIELD_LAYOUT_PARAMETERS = {
@@ -22,6 +26,51 @@ STANDARD_FIELD_LAYOUT_PARAMETERS = {
 }
 
 
+def _standard_layout_parameters(layout_type):
+    """Return the aspect ratio, offset, and rotation of a standard layout."""
+    if layout_type not in list(STANDARD_FIELD_LAYOUT_PARAMETERS):
+        raise ValueError('Layout type must be one of: '
+                         f'{list(STANDARD_FIELD_LAYOUT_PARAMETERS)}')
+    layout_params = STANDARD_FIELD_LAYOUT_PARAMETERS[layout_type]
+    return (layout_params['aspect_ratio'], layout_params['offset'],
+            layout_params['rotation'])
+
+
+# Layout parameters that can be modified after a TrackerField has been created
+LAYOUT_PARAMETERS = ['neighbor_order', 'gcr', 'aspect_ratio', 'offset',
+                     'rotation', 'slope_azimuth', 'slope_tilt']
+
+# Layout parameters that each of the cached quantities depend on. When a layout
+# parameter is modified, only the cached quantities that depend on it are
+# invalidated and recalculated the next time they are accessed.
+_UNIT_LAYOUT_PARAMETERS = {'neighbor_order', 'aspect_ratio', 'offset', 'rotation'}
+_CACHE_DEPENDENCIES = {
+    'unit_layout': _UNIT_LAYOUT_PARAMETERS,
+    'scaled_layout': _UNIT_LAYOUT_PARAMETERS | {'gcr'},
+    'slope_layout': _UNIT_LAYOUT_PARAMETERS | {'slope_azimuth', 'slope_tilt'},
+    'max_shading_elevation': set(LAYOUT_PARAMETERS),
+    'tracker_groups': _UNIT_LAYOUT_PARAMETERS | {'gcr', 'terrain'},
+    'horizon_table': {'slope_azimuth', 'slope_tilt', 'horizon_profile'},
+    # Only depends on the collector geometry
+    'engine_states': set(),
+}
+
+# Maximum number of locations and time ranges for which the solar positions
+# are cached by TrackerField.get_shaded_fraction_at_location
+_SOLAR_POSITION_CACHE_SIZE = 8
+
+
+def _layout_parameter(name):
+    """Create a property that invalidates dependent quantities when set."""
+    def getter(self):
+        return self._layout_parameters[name]
+
+    def setter(self, value):
+        self.update_layout(**{name: value})
+
+    return property(getter, setter, doc=f'Field layout parameter ``{name}``.')
+
+
 class TrackerField:
     """
     TrackerField is a convenient container for the collector geometry
@@ -51,6 +100,11 @@ class TrackerField:
         Direction of normal to slope on horizontal [degrees]
     slope_tilt : float, default : 0
         Tilt of slope relative to horizontal [degrees]
+    horizon_profile : pandas.Series, optional
+        Horizon elevation angles in degrees indexed by azimuth angles in
+        degrees, e.g., caused by mountains or buildings. The collectors are
+        fully shaded when the sun is below the horizon profile or the horizon
+        caused by the slope.
 
     Notes
     -----
@@ -58,11 +112,140 @@ class TrackerField:
     using the ``layout_type`` argument or by specifying the individual layout
     parameters ``aspect_ratio``, ``offset``, and ``rotation``. For both cases
     the ground cover ratio (``gcr``) needs to be specified.
+
+    The field layout parameters can be modified after the TrackerField has
+    been created, either by setting the attributes directly or using
+    :py:meth:`update_layout`. The field layout (e.g., ``X``, ``Y``, and
+    ``max_shading_elevation``) is calculated on demand, and only the
+    quantities that depend on the modified parameters are recalculated.
+    For example, changing ``gcr`` only rescales the neighbor positions,
+    whereas changing ``slope_tilt`` does not affect the neighbor positions.
+
+    The horizon profile is combined with the horizon of the slope and stored
+    as an interpolation table, such that the solar positions below the
+    horizon are identified with a single vectorized lookup.
     """
 
+    neighbor_order = _layout_parameter('neighbor_order')
+    gcr = _layout_parameter('gcr')
+    aspect_ratio = _layout_parameter('aspect_ratio')
+    offset = _layout_parameter('offset')
+    rotation = _layout_parameter('rotation')
+    slope_azimuth = _layout_parameter('slope_azimuth')
+    slope_tilt = _layout_parameter('slope_tilt')
+
     def __init__(self, total_collector_geometry, active_collector_geometry,
                  neighbor_order, gcr, layout_type=None, aspect_ratio=None,
-                 offset=None, rotation=None, slope_azimuth=0, slope_tilt=0):
+                 offset=None, rotation=None, slope_azimuth=0, slope_tilt=0,
+                 horizon_profile=None):
+
+        self._initialize(total_collector_geometry, active_collector_geometry,
+                         horizon_profile)
+
+        # Standard layout parameters
+        if layout_type is not None:
+            aspect_ratio, offset, rotation = _standard_layout_parameters(layout_type)
+        elif ((aspect_ratio is None) or (offset is None) or (rotation is None)):
+            raise ValueError('Aspect ratio, offset, and rotation needs to be '
+                             'specified when no layout type has been selected')
+
+        # Field layout parameters
+        self.layout_type = layout_type
+        self.update_layout(
+            neighbor_order=neighbor_order, gcr=gcr, aspect_ratio=aspect_ratio,
+            offset=offset, rotation=rotation, slope_azimuth=slope_azimuth,
+            slope_tilt=slope_tilt, layout_type=layout_type)
+
+    @classmethod
+    def from_coordinates(cls, total_collector_geometry, active_collector_geometry,
+                         x, y, z=0, slope_azimuth=0, slope_tilt=0,
+                         min_solar_elevation=5, tolerance=1e-3, horizon_profile=None):
+        """Create a TrackerField from the positions of the collectors.
+
+        Allows for modeling fields that are not regularly-spaced, e.g., due to
+        roads, irregular boundaries, or as-built positions. The neighbors of
+        each collector are determined using
+        :py:func:`twoaxistracking.layout.generate_coordinate_layout`, and
+        collectors with identical neighbor offsets are grouped such that the
+        shading only needs to be calculated once per group. The shaded
+        fraction of the collectors is calculated using
+        :py:meth:`get_tracker_shaded_fraction`.
+
+        Parameters
+        ----------
+        total_collector_geometry: :py:class:`Shapely Polygon <Polygon>`
+            Polygon corresponding to the total collector area.
+        active_collector_geometry: :py:class:`Polygon` or :py:class:`MultiPolygon`
+            One or more polygons defining the active collector area.
+        x: array-like
+            East-west positions of the collectors. East is positive.
+        y: array-like
+            North-south positions of the collectors. North is positive.
+        z: array-like, default: 0
+            Heights of the collectors.
+        slope_azimuth : float, default : 0
+            Direction of normal to slope on horizontal [degrees]. Used to
+            determine horizon shading.
+        slope_tilt : float, default : 0
+            Tilt of slope relative to horizontal [degrees]. Used to determine
+            horizon shading.
+        min_solar_elevation: float, default: 5
+            Solar elevation angle below which shading by distant collectors
+            may be neglected [degrees]. Neighbors are considered within a
+            radius of ``min_tracker_spacing / sin(min_solar_elevation)``.
+        tolerance: float, default: 1e-3
+            Tolerance for considering neighbor offsets identical when grouping
+            collectors. Needs to have the same unit as the positions. The
+            neighbor offsets are rounded to multiples of ``tolerance``, which
+            shifts the shadows by at most ``tolerance``. For as-built
+            positions with random deviations (e.g., surveyed with a few
+            centimeters of jitter), almost every collector forms its own
+            group at the default tolerance. A tolerance of about ten times
+            the jitter (e.g., 0.2 m) reduces the number of groups by orders
+            of magnitude, although all groups are calculated in one
+            vectorized pass regardless.
+        horizon_profile : pandas.Series, optional
+            Horizon elevation angles in degrees indexed by azimuth angles in
+            degrees.
+
+        Returns
+        -------
+        field : TrackerField
+            The field layout parameters (e.g., ``gcr``) of the returned field
+            are None, and the attributes describing a regular field layout
+            (e.g., ``X`` and ``max_shading_elevation``) are not available.
+
+        Notes
+        -----
+        Requires scipy.
+        """
+        field = cls.__new__(cls)
+        field._initialize(total_collector_geometry, active_collector_geometry,
+                          horizon_profile)
+        field.layout_type = None
+        field._layout_parameters.update(slope_azimuth=slope_azimuth, slope_tilt=slope_tilt)
+        field._coordinates = {
+            'x': x, 'y': y, 'z': z, 'tolerance': tolerance,
+            'max_distance': field.min_tracker_spacing / np.sin(np.deg2rad(min_solar_elevation))}
+        return field
+
+    def _initialize(self, total_collector_geometry, active_collector_geometry,
+                    horizon_profile):
+        """Initialization shared by the constructor and :py:meth:`from_coordinates`."""
+        self._set_collector_geometry(total_collector_geometry, active_collector_geometry)
+        self._layout_parameters = dict.fromkeys(LAYOUT_PARAMETERS)
+        self._cache = {}
+        self._terrain = None
+        self._coordinates = None
+        self._horizon_profile = horizon_profile
+        self._solar_positions = collections.OrderedDict()
+        self.last_shading_engine = None
+
+    def _set_collector_geometry(self, total_collector_geometry, active_collector_geometry):
+        # Ensure that the total collector area contains the active areas
+        if total_collector_geometry.contains(active_collector_geometry) is False:
+            raise ValueError('The total collector geometry does not completely'
+                             ' enclose the active collector geometry.')
 
         # Collector geometry
         self.total_collector_geometry = total_collector_geometry
@@ -73,39 +256,590 @@ class TrackerField:
         self.min_tracker_spacing = \
             layout._calculate_min_tracker_spacing(self.total_collector_geometry)
 
-        # Ensure that the total collector area contains the active areas
-        if self.total_collector_geometry.contains(self.active_collector_geometry) is False:
-            raise ValueError('The total collector geometry does not completely'
-                             ' enclose the active collector geometry.')
+    def update_layout(self, **kwargs):
+        """Modify one or more field layout parameters.
 
-        # Standard layout parameters
+        All parameters are updated simultaneously, which makes it possible to
+        change several parameters that are only feasible in combination. Only
+        the quantities that depend on the modified parameters are
+        recalculated.
+
+        Parameters
+        ----------
+        **kwargs
+            Field layout parameters to modify. Valid parameters are
+            ``neighbor_order``, ``gcr``, ``aspect_ratio``, ``offset``,
+            ``rotation``, ``slope_azimuth``, ``slope_tilt``, and
+            ``layout_type``.
+
+        Raises
+        ------
+        ValueError
+            If the resulting field layout is not feasible. In this case, none
+            of the parameters are modified.
+        """
+        layout_type = kwargs.pop('layout_type', None)
+        invalid_parameters = set(kwargs) - set(LAYOUT_PARAMETERS)
+        if invalid_parameters:
+            raise TypeError(f'Invalid layout parameters: {sorted(invalid_parameters)}')
         if layout_type is not None:
-            if layout_type not in list(STANDARD_FIELD_LAYOUT_PARAMETERS):
-                raise ValueError('Layout type must be one of: '
-                                 f'{list(STANDARD_FIELD_LAYOUT_PARAMETERS)}')
-            else:
-                layout_params = STANDARD_FIELD_LAYOUT_PARAMETERS[layout_type]
-                aspect_ratio = layout_params['aspect_ratio']
-                offset = layout_params['offset']
-                rotation = layout_params['rotation']
-        elif ((aspect_ratio is None) or (offset is None) or (rotation is None)):
-            raise ValueError('Aspect ratio, offset, and rotation needs to be '
-                             'specified when no layout type has been selected')
+            aspect_ratio, offset, rotation = _standard_layout_parameters(layout_type)
+            kwargs.update(aspect_ratio=aspect_ratio, offset=offset, rotation=rotation)
 
-        # Field layout parameters
-        self.neighbor_order = neighbor_order
-        self.gcr = gcr
-        self.layout_type = layout_type
-        self.aspect_ratio = aspect_ratio
-        self.offset = offset
-        self.rotation = rotation
-        self.slope_azimuth = slope_azimuth
-        self.slope_tilt = slope_tilt
-
-        # Calculate position of neighboring collectors based on field layout
-        (self.X, self.Y, self.Z, self.tracker_distance, self.relative_azimuth,
-         self.relative_slope) = \
-            layout.generate_field_layout(
+        parameters = {**self._layout_parameters, **kwargs}
+        modified = {k for k in kwargs if k not in self._layout_parameters
+                    or self._layout_parameters[k] != kwargs[k]}
+        # The slope does not affect the feasibility of the layout
+        if modified - {'slope_azimuth', 'slope_tilt'}:
+            self._check_regular_layout()
+            layout._check_layout_parameters(
+                gcr=parameters['gcr'],
+                total_collector_area=self.total_collector_area,
+                min_tracker_spacing=self.min_tracker_spacing,
+                aspect_ratio=parameters['aspect_ratio'],
+                offset=parameters['offset'],
+                rotation=parameters['rotation'])
+
+        self._layout_parameters = parameters
+        # A modified layout is no longer one of the standard layout types
+        if layout_type is not None:
+            self.layout_type = layout_type
+        elif modified & {'aspect_ratio', 'offset', 'rotation'}:
+            self.layout_type = None
+        self._invalidate(modified)
+
+    def simplify_collector_geometry(self, tolerance=0, grid_size=None, merge_distance=None,
+                                    dry_run=False):
+        """Simplify the collector geometries to speed up the shading calculations.
+
+        The computational cost of the shading calculations scales with the
+        number of vertices of the collector geometries. Geometries with many
+        cells or curved edges can be simplified at the cost of a bounded
+        change in the collector areas, which is reported. Use
+        ``dry_run=True`` to inspect the change in the collector areas before
+        modifying the field.
+
+        Parameters
+        ----------
+        tolerance : float, default: 0
+            Maximum distance between the original and the simplified
+            geometries (see :py:func:`shapely.simplify`).
+        grid_size : float, optional
+            Size of the precision grid that the vertices are snapped to (see
+            :py:func:`shapely.set_precision`).
+        merge_distance : float, optional
+            Merge cells of the active collector geometry that are separated
+            by less than ``merge_distance``, i.e., the gaps between the cells
+            are considered active area.
+        dry_run : boolean, default: False
+            If True, the simplified geometries and the change in the collector
+            areas are only returned, and the field is not modified.
+
+        Returns
+        -------
+        simplification : dict
+            Dictionary with the keys 'total_area_error' and
+            'active_area_error' containing the relative change of the
+            collector areas, 'num_coordinates' containing the number of
+            coordinates of the active collector geometry before and after the
+            simplification, and 'total_collector_geometry' and
+            'active_collector_geometry' containing the simplified geometries.
+
+        Raises
+        ------
+        ValueError
+            If the field layout is not feasible with the simplified geometry.
+            In this case, the geometries are not modified.
+        """
+        total = shapely.simplify(self.total_collector_geometry, tolerance)
+        active = shapely.simplify(self.active_collector_geometry, tolerance)
+        if merge_distance is not None:
+            active = shapely.buffer(shapely.buffer(
+                active, merge_distance / 2, join_style='mitre'),
+                -merge_distance / 2, join_style='mitre')
+        if grid_size is not None:
+            total = shapely.set_precision(total, grid_size)
+        # The active area is clipped to ensure it is enclosed by the total area
+        active = shapely.intersection(active, total, grid_size=grid_size)
+
+        if self._coordinates is None:
+            layout._check_layout_parameters(
+                gcr=self.gcr,
+                total_collector_area=total.area,
+                min_tracker_spacing=layout._calculate_min_tracker_spacing(total),
+                aspect_ratio=self.aspect_ratio,
+                offset=self.offset,
+                rotation=self.rotation)
+
+        simplification = {
+            'total_area_error': total.area / self.total_collector_area - 1,
+            'active_area_error': active.area / self.active_collector_area - 1,
+            'num_coordinates': (shapely.get_num_coordinates(self.active_collector_geometry),
+                                shapely.get_num_coordinates(active)),
+            'total_collector_geometry': total,
+            'active_collector_geometry': active}
+        if dry_run:
+            return simplification
+        self._set_collector_geometry(total, active)
+        # All cached quantities depend on the collector geometry
+        self._cache.clear()
+        return simplification
+
+    def _invalidate(self, modified):
+        """Invalidate cached quantities that depend on the modified parameters."""
+        for key in list(self._cache):
+            if _CACHE_DEPENDENCIES[key] & modified:
+                del self._cache[key]
+
+    def _cached(self, key, func):
+        """Return a cached quantity, calculating it if it is not cached."""
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @property
+    def horizon_profile(self):
+        """Horizon elevation angles in degrees indexed by azimuth angles in
+        degrees (pandas Series), or None if only the slope causes a horizon."""
+        return self._horizon_profile
+
+    @horizon_profile.setter
+    def horizon_profile(self, value):
+        self._horizon_profile = value
+        self._invalidate({'horizon_profile'})
+
+    def _horizon_table(self):
+        # Without a horizon profile, the horizon of the slope is calculated exactly
+        if self._horizon_profile is None:
+            return None
+        return self._cached('horizon_table', lambda: shading._horizon_table(
+            self.slope_azimuth, self.slope_tilt, self._horizon_profile))
+
+    def _shading_engine(self, engine, n_solar_positions):
+        """Resolve the shading engine and calculate its state (e.g., a table)."""
+        geometries = (self.total_collector_geometry, self.active_collector_geometry)
+        if engine == 'auto':
+            engine = shading.select_shading_engine(*geometries, n_solar_positions)
+        else:
+            shading.check_shading_engine(engine, *geometries)
+        prepare = shading.SHADING_ENGINES[engine].prepare
+        if prepare is None:
+            return engine, None
+        states = self._cache.setdefault('engine_states', {})
+        # Recalculate the state if the collector geometry has been replaced
+        if states.get(engine, (None,))[0] != geometries:
+            states[engine] = (geometries, prepare(*geometries, self.min_tracker_spacing))
+        return engine, states[engine][1]
+
+    def _check_regular_layout(self):
+        if self._coordinates is not None:
+            raise ValueError('Not available for fields created from collector '
+                             'coordinates, as the field layout is not regular.')
+
+    def _unit_layout(self):
+        self._check_regular_layout()
+
+        def calculate():
+            X, Y = layout._unit_field_layout(
+                self.neighbor_order, self.aspect_ratio, self.offset, self.rotation)
+            relative_azimuth = np.mod(450-np.rad2deg(np.arctan2(Y, X)), 360)
+            return X, Y, relative_azimuth
+        return self._cached('unit_layout', calculate)
+
+    def _scaled_layout(self):
+        def calculate():
+            X, Y, _ = self._unit_layout()
+            scaling = layout._layout_scaling(
+                self.gcr, self.total_collector_area, self.aspect_ratio)
+            X, Y = X*scaling, Y*scaling
+            return X, Y, np.sqrt(X**2 + Y**2)
+        return self._cached('scaled_layout', calculate)
+
+    def _slope_layout(self):
+        def calculate():
+            X, Y, relative_azimuth = self._unit_layout()
+            return layout._slope_field_layout(
+                X, Y, relative_azimuth, self.slope_azimuth, self.slope_tilt)
+        return self._cached('slope_layout', calculate)
+
+    @property
+    def X(self):
+        """Distance of neighboring trackers to the reference tracker in the
+        east-west direction. East is positive."""
+        return self._scaled_layout()[0]
+
+    @property
+    def Y(self):
+        """Distance of neighboring trackers to the reference tracker in the
+        north-south direction. North is positive."""
+        return self._scaled_layout()[1]
+
+    @property
+    def Z(self):
+        """Relative heights of neighboring trackers."""
+        return self._slope_layout()[0]
+
+    @property
+    def tracker_distance(self):
+        """Distances between neighboring trackers and the reference tracker."""
+        return self._scaled_layout()[2]
+
+    @property
+    def relative_azimuth(self):
+        """Relative azimuth of neighboring trackers [degrees]."""
+        return self._unit_layout()[2]
+
+    @property
+    def relative_slope(self):
+        """Slope between neighboring trackers and reference tracker [degrees]."""
+        return self._slope_layout()[1]
+
+    @property
+    def max_shading_elevation(self):
+        """The maximum elevation angle for which shading can occur [degrees]."""
+        return self._cached('max_shading_elevation', lambda: layout.max_shading_elevation(
+            self.total_collector_geometry, self.tracker_distance, self.relative_slope))
+
+    def get_shaded_fraction_gradient(self, solar_elevation, solar_azimuth):
+        """Calculate the shaded fraction and its derivatives with respect to the layout.
+
+        The derivatives with respect to ``gcr``, ``aspect_ratio``, ``offset``,
+        and ``rotation`` are calculated analytically in the same pass as the
+        shaded fraction, from the length of the shadow edges bordering the
+        unshaded part of the active area. This makes it possible to use
+        gradient-based layout optimization without finite differences.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+
+        Returns
+        -------
+        gradient : pandas.DataFrame
+            DataFrame with one row per solar position and the columns
+            'shaded_fraction', 'gcr', 'aspect_ratio', 'offset', and
+            'rotation', where the latter contain the derivatives of the shaded
+            fraction with respect to each parameter (per degree for
+            ``rotation``).
+
+        Notes
+        -----
+        The shaded fraction is piecewise smooth in the layout parameters,
+        i.e., the derivatives are not defined where a shadow edge coincides
+        with an edge of the active area. The derivatives are zero when the
+        solar position is above the maximum shading elevation or below the
+        horizon.
+        """
+        self._check_regular_layout()
+        dX, dY = layout._field_layout_derivatives(
+            self.neighbor_order, self.gcr, self.total_collector_area, self.aspect_ratio,
+            self.offset, self.rotation)
+        shaded_fractions, gradients = shading._shaded_fraction_gradient(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            total_collector_geometry=self.total_collector_geometry,
+            active_collector_geometry=self.active_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            tracker_distance=self.tracker_distance,
+            relative_azimuth=self.relative_azimuth,
+            relative_slope=self.relative_slope,
+            X=self.X,
+            Y=self.Y,
+            dX=dX,
+            dY=dY,
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            max_shading_elevation=self.max_shading_elevation,
+            horizon_table=self._horizon_table())
+        index = solar_elevation.index if isinstance(solar_elevation, pd.Series) else None
+        gradient = pd.DataFrame(gradients, index=index,
+                                columns=['gcr', 'aspect_ratio', 'offset', 'rotation'])
+        gradient.insert(0, 'shaded_fraction', shaded_fractions)
+        return gradient
+
+    def get_shaded_fraction_uncertainty(self, solar_elevation, solar_azimuth,
+                                        pointing_error=None, position_error=None,
+                                        n_realizations=1000, quantiles=(0.05, 0.5, 0.95),
+                                        seed=None):
+        """Calculate quantiles of the shaded fraction using Monte Carlo simulation.
+
+        The shaded fraction is calculated for a number of realizations with
+        perturbed collector positions and pointing. All realizations are
+        evaluated in a vectorized manner, and only the quantiles of the
+        shaded fraction are returned in order to limit memory usage.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        pointing_error : float or distribution, optional
+            Distribution of the pointing error of each collector around each
+            of the two collector axes [degrees]. Either the standard deviation
+            of a normal distribution or an object with an ``rvs`` method,
+            e.g., a frozen scipy.stats distribution. An independent pointing
+            error is drawn for the reference collector and for each of its
+            neighbors for each solar position and realization, i.e., the
+            collectors are misaligned relative to each other.
+        position_error : float or distribution, optional
+            Distribution of the error in the position of each collector in
+            the x-, y-, and z-directions. Either the standard deviation of a
+            normal distribution or an object with an ``rvs`` method. The
+            positions are drawn once for each realization.
+        n_realizations : int, default: 1000
+            Number of realizations.
+        quantiles : array-like, default: (0.05, 0.5, 0.95)
+            Quantiles of the shaded fraction to return.
+        seed : int or numpy.random.Generator, optional
+            Seed for the random number generator.
+
+        Returns
+        -------
+        shaded_fraction_quantiles : pandas.DataFrame
+            The quantiles of the shaded fraction with one row per solar
+            position and one column per quantile.
+
+        Notes
+        -----
+        Without pointing errors, the collectors are parallel and the shadows
+        are translations of the total collector geometry. With pointing
+        errors, the shadows are the projections of the misaligned neighbors
+        onto the plane of the reference collector, i.e., affine maps of the
+        total collector geometry. The maximum shading elevation is not used
+        to skip calculations, as shading may occur at higher solar elevation
+        angles when the collectors are misaligned.
+        """
+        shaded_fraction_quantiles = shading._shaded_fraction_monte_carlo(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            total_collector_geometry=self.total_collector_geometry,
+            active_collector_geometry=self.active_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            tracker_distance=self.tracker_distance,
+            relative_azimuth=self.relative_azimuth,
+            relative_slope=self.relative_slope,
+            pointing_error=pointing_error,
+            position_error=position_error,
+            n_realizations=n_realizations,
+            quantiles=quantiles,
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            horizon_table=self._horizon_table(),
+            rng=seed)
+        index = solar_elevation.index if isinstance(solar_elevation, pd.Series) else None
+        return pd.DataFrame(shaded_fraction_quantiles, index=index, columns=list(quantiles))
+
+    def get_shaded_fraction_tracker_angles(self, solar_elevation, solar_azimuth,
+                                           tracker_elevation=None, tracker_azimuth=None,
+                                           elevation_limits=(0, 90), azimuth_limits=None,
+                                           stow=None, stow_elevation=90, stow_azimuth=180):
+        """Calculate the shaded fraction for the specified tracker orientations.
+
+        In contrast to :py:meth:`get_shaded_fraction`, the collectors do not
+        need to point at the sun, e.g., when the trackers reach their
+        rotation limits at low solar elevation angles or are stowed in high
+        wind. All collectors are assumed to have the same orientation, such
+        that the shadows are translations of the total collector geometry in
+        the collector plane, which are calculated for all (solar position,
+        neighbor) pairs at once.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        tracker_elevation : array-like, optional
+            Elevation angle of the collector normal for each solar position
+            [degrees]. Defaults to the solar elevation.
+        tracker_azimuth : array-like, optional
+            Azimuth angle of the collector normal for each solar position
+            [degrees]. Defaults to the solar azimuth.
+        elevation_limits : tuple, default: (0, 90)
+            Minimum and maximum elevation angle of the collector normal
+            [degrees].
+        azimuth_limits : tuple, optional
+            Minimum and maximum azimuth angle of the collector normal, e.g.,
+            (60, 300) [degrees]. The allowed range extends clockwise from the
+            minimum to the maximum, such that ranges including north can be
+            specified as, e.g., (300, 60). Azimuth angles outside of the
+            range are set to the nearest limit. By default, the azimuth is
+            not limited.
+        stow : array-like of bools, optional
+            Whether the trackers are stowed at each solar position.
+        stow_elevation : float, default: 90
+            Elevation angle of the collector normal in the stow position,
+            e.g., 90 for horizontal collectors [degrees].
+        stow_azimuth : float, default: 180
+            Azimuth angle of the collector normal in the stow position
+            [degrees].
+
+        Returns
+        -------
+        orientation : pandas.DataFrame
+            DataFrame with one row per solar position and the columns
+            'tracker_elevation' and 'tracker_azimuth' (after applying the
+            limits and stow), 'shaded_fraction', and 'cos_incidence' (the
+            cosine of the angle of incidence). The shaded fraction is one when
+            the sun is behind the collectors.
+
+        Notes
+        -----
+        The x-axis of the collector plane is assumed to remain horizontal,
+        as for trackers with a vertical primary axis.
+        """
+        if tracker_elevation is None:
+            tracker_elevation = solar_elevation
+        if tracker_azimuth is None:
+            tracker_azimuth = solar_azimuth
+        tracker_elevation = np.clip(tracker_elevation, *elevation_limits)
+        tracker_azimuth = np.mod(tracker_azimuth, 360)
+        if azimuth_limits is not None:
+            tracker_azimuth = _limit_azimuth(tracker_azimuth, *azimuth_limits)
+        if stow is not None:
+            tracker_elevation = np.where(stow, stow_elevation, tracker_elevation)
+            tracker_azimuth = np.where(stow, stow_azimuth, tracker_azimuth)
+
+        shaded_fractions, cos_incidence = shading._shaded_fraction_tracker_angles(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            tracker_elevation=tracker_elevation,
+            tracker_azimuth=tracker_azimuth,
+            total_collector_geometry=self.total_collector_geometry,
+            active_collector_geometry=self.active_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            tracker_distance=self.tracker_distance,
+            relative_azimuth=self.relative_azimuth,
+            relative_slope=self.relative_slope,
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            horizon_table=self._horizon_table())
+        index = solar_elevation.index if isinstance(solar_elevation, pd.Series) else None
+        return pd.DataFrame({
+            'tracker_elevation': np.broadcast_to(tracker_elevation, shaded_fractions.shape),
+            'tracker_azimuth': np.broadcast_to(tracker_azimuth, shaded_fractions.shape),
+            'shaded_fraction': shaded_fractions,
+            'cos_incidence': cos_incidence}, index=index)
+
+    def get_shade_avoidance_pointing(self, solar_elevation, solar_azimuth,
+                                     max_deviation=15, n_iterations=4):
+        """Find the tracker orientations that maximize the unshaded direct irradiance.
+
+        When the sun is low, pointing the collectors slightly away from the
+        sun can reduce the shading by the neighboring collectors by more than
+        the increase in the angle of incidence. For each solar position that
+        is shaded when pointing at the sun, the deviations of the tracker
+        elevation and azimuth angles from the solar position are searched on
+        a grid that is successively refined. The candidate orientations of all
+        solar positions are evaluated at once.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        max_deviation : float, default: 15
+            Maximum deviation of the tracker elevation and azimuth angles from
+            the solar position [degrees].
+        n_iterations : int, default: 4
+            Number of grid refinements. The resolution of the deviations is
+            ``max_deviation / 2**(n_iterations + 1)``.
+
+        Returns
+        -------
+        pointing : pandas.DataFrame
+            DataFrame with one row per solar position and the columns
+            'tracker_elevation' and 'tracker_azimuth' (the direction of the
+            collector normal in degrees), 'shaded_fraction', and
+            'relative_irradiance' (the cosine of the angle of incidence times
+            the unshaded fraction, i.e., the direct irradiance on the active
+            area relative to an unshaded sun-pointing collector).
+
+        Notes
+        -----
+        The x-axis of the collector plane is assumed to remain horizontal,
+        as for trackers with a vertical primary axis. The maximum shading
+        elevation is not used to skip calculations for the candidate
+        orientations.
+        """
+        results = shading._optimize_pointing(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            max_deviation=max_deviation,
+            n_iterations=n_iterations,
+            total_collector_geometry=self.total_collector_geometry,
+            active_collector_geometry=self.active_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            tracker_distance=self.tracker_distance,
+            relative_azimuth=self.relative_azimuth,
+            relative_slope=self.relative_slope,
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            horizon_table=self._horizon_table())
+        index = solar_elevation.index if isinstance(solar_elevation, pd.Series) else None
+        return pd.DataFrame(dict(zip(
+            ['tracker_elevation', 'tracker_azimuth', 'shaded_fraction', 'relative_irradiance'],
+            results)), index=index)
+
+    def set_terrain(self, elevation, cell_size, origin=(0, 0), slope_tolerance=0.01):
+        """Specify an elevation raster that the collector heights follow.
+
+        The collectors are placed according to the field layout within the
+        extent of the raster (see
+        :py:func:`twoaxistracking.layout.generate_terrain_layout`), and
+        collectors with near-identical relative slopes to their neighbors are
+        grouped, such that the shading only needs to be calculated once per
+        group. The collectors are available as :py:attr:`trackers`.
+
+        Parameters
+        ----------
+        elevation: 2D array-like
+            Elevation raster (digital elevation model) of the site, where the
+            first row corresponds to the northern edge. Large rasters can be
+            provided as memory-mapped arrays, e.g., using
+            ``numpy.load(filename, mmap_mode='r')``.
+        cell_size: float
+            Side length of the raster cells. Needs to have the same unit as
+            the collector geometry.
+        origin: tuple of floats, default: (0, 0)
+            Coordinates (x, y) of the north-west corner of the raster.
+        slope_tolerance: float, default: 0.01
+            Tolerance for considering relative slopes identical when grouping
+            collectors [degrees].
+
+        Notes
+        -----
+        The horizon caused by the terrain beyond the neighboring collectors
+        is described by ``slope_azimuth`` and ``slope_tilt``, which should
+        generally be set to zero when specifying the terrain.
+        """
+        self._check_regular_layout()
+        self._terrain = {'elevation': elevation, 'cell_size': cell_size,
+                         'origin': origin, 'slope_tolerance': slope_tolerance}
+        self._invalidate({'terrain'})
+
+    def _tracker_groups(self):
+        def calculate():
+            if self._coordinates is not None:
+                x, y, z = np.broadcast_arrays(
+                    np.asarray(self._coordinates['x'], dtype=float),
+                    self._coordinates['y'], self._coordinates['z'])
+                group, group_layouts = layout.generate_coordinate_layout(
+                    x, y, z, min_tracker_spacing=self.min_tracker_spacing,
+                    max_distance=self._coordinates['max_distance'],
+                    tolerance=self._coordinates['tolerance'])
+                trackers = pd.DataFrame({'x': x, 'y': y, 'z': z, 'group': group})
+                return trackers, group_layouts
+            if self._terrain is None:
+                raise ValueError('The terrain needs to be specified using set_terrain.')
+            x, y, z, _, _, _, _, relative_slope = layout.generate_terrain_layout(
+                elevation=self._terrain['elevation'],
+                cell_size=self._terrain['cell_size'],
                 gcr=self.gcr,
                 total_collector_area=self.total_collector_area,
                 min_tracker_spacing=self.min_tracker_spacing,
@@ -113,12 +847,100 @@ class TrackerField:
                 aspect_ratio=self.aspect_ratio,
                 offset=self.offset,
                 rotation=self.rotation,
+                origin=self._terrain['origin'])
+            group, group_relative_slope = layout.group_neighbor_profiles(
+                relative_slope, self._terrain['slope_tolerance'])
+            trackers = pd.DataFrame({'x': x, 'y': y, 'z': z, 'group': group})
+            # Neighbors outside the raster extent are excluded from each group
+            group_layouts = []
+            for slopes in group_relative_slope:
+                exists = ~np.isnan(slopes)
+                group_layouts.append((self.tracker_distance[exists],
+                                      self.relative_azimuth[exists], slopes[exists]))
+            return trackers, group_layouts
+        return self._cached('tracker_groups', calculate)
+
+    @property
+    def trackers(self):
+        """DataFrame with the position (x, y, z) and shading group of each
+        collector in the field. Requires that the terrain has been specified
+        using :py:meth:`set_terrain` or that the field has been created using
+        :py:meth:`from_coordinates`."""
+        return self._tracker_groups()[0]
+
+    def get_tracker_shaded_fraction(self, solar_elevation, solar_azimuth,
+                                    per_tracker=False, max_elements=2**24):
+        """Calculate the shaded fraction of each collector in the field.
+
+        The shaded fraction is calculated once for each group of collectors
+        with (near-)identical neighbors. The neighbors of all groups are
+        padded to the same number, such that all groups and solar positions
+        are screened and calculated in one vectorized pass. Requires that the
+        terrain has been specified using :py:meth:`set_terrain` or that the
+        field has been created using :py:meth:`from_coordinates`.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        per_tracker : boolean, default: False
+            Whether to return one column per collector instead of one column
+            per group.
+        max_elements : int, default: 2**24
+            Maximum number of (group, solar position, neighbor) combinations
+            screened at once, which limits the memory usage.
+
+        Returns
+        -------
+        shaded_fractions : pandas.DataFrame
+            The shaded fractions with one row per solar position and one
+            column per group (or collector). The group of each collector is
+            given by ``trackers['group']``.
+        """
+        trackers, group_layouts = self._tracker_groups()
+        tracker_distance, relative_azimuth, relative_slope = _pad_group_layouts(group_layouts)
+        # Padded neighbors do not affect the maximum shading elevation, and
+        # collectors without neighbors are never shaded by neighbors
+        max_shading_elevation = layout.max_shading_elevation(
+            self.total_collector_geometry,
+            np.where(np.isnan(tracker_distance), np.inf, tracker_distance),
+            np.nan_to_num(relative_slope))
+        solar_elevation_values = np.asarray(solar_elevation, dtype=float)
+        solar_azimuth_values = np.asarray(solar_azimuth, dtype=float)
+        n_groups, n_times = len(group_layouts), len(solar_elevation_values)
+        engine, engine_state = self._shading_engine('auto', n_groups*n_times)
+
+        # All (group, solar position) pairs are calculated at once, in chunks
+        # of groups limiting the size of the screening arrays
+        shaded_fractions = np.empty((n_groups, n_times))
+        chunk_size = max(max_elements // max(n_times * tracker_distance.shape[1], 1), 1)
+        for start in range(0, n_groups, chunk_size):
+            groups = slice(start, start + chunk_size)
+            n_chunk = len(range(n_groups)[groups])
+            shaded_fractions[groups] = shading._shaded_fraction_timeseries(
+                solar_elevation=np.tile(solar_elevation_values, n_chunk),
+                solar_azimuth=np.tile(solar_azimuth_values, n_chunk),
+                total_collector_geometry=self.total_collector_geometry,
+                active_collector_geometry=self.active_collector_geometry,
+                min_tracker_spacing=self.min_tracker_spacing,
+                tracker_distance=np.repeat(tracker_distance[groups], n_times, axis=0),
+                relative_azimuth=np.repeat(relative_azimuth[groups], n_times, axis=0),
+                relative_slope=np.repeat(relative_slope[groups], n_times, axis=0),
                 slope_azimuth=self.slope_azimuth,
-                slope_tilt=self.slope_tilt)
+                slope_tilt=self.slope_tilt,
+                max_shading_elevation=np.repeat(max_shading_elevation[groups], n_times),
+                horizon_table=self._horizon_table(),
+                engine=engine,
+                engine_state=engine_state).reshape(n_chunk, n_times)
 
-        # Calculate the maximum elevation angle for which shading can occcur
-        self.max_shading_elevation = layout.max_shading_elevation(
-            self.total_collector_geometry, self.tracker_distance, self.relative_slope)
+        index = solar_elevation.index if isinstance(solar_elevation, pd.Series) else None
+        shaded_fractions = pd.DataFrame(shaded_fractions.T, index=index)
+        if per_tracker:
+            shaded_fractions = shaded_fractions[trackers['group']]
+            shaded_fractions.columns = trackers.index
+        return shaded_fractions
 
     def plot_field_layout(self):
         """Create a plot of the field layout.
@@ -132,7 +954,8 @@ class TrackerField:
             X=self.X, Y=self.Y, Z=self.Z, min_tracker_spacing=self.min_tracker_spacing)
 
     def get_shaded_fraction(self, solar_elevation,  solar_azimuth,
-                            plot=False):
+                            plot=False, engine='auto', out=None, dtype=None,
+                            offset_tolerance=0):
         """Calculate the shaded fraction for the specified solar positions.
 
         Uses the :py:func:`twoaxistracking.shaded_fraction` function to
@@ -141,20 +964,105 @@ class TrackerField:
 
         Parameters
         ----------
-        solar_elevation : array-like
+        solar_elevation : array-like or xarray.DataArray
             Solar elevation angles in degrees.
-        solar_azimuth : array-like
+        solar_azimuth : array-like or xarray.DataArray
             Solar azimuth angles in degrees.
         plot : boolean, default: False
             Whether to plot the unshaded and shading geometries for each solar
-            position.
+            position. A new figure is created for each solar position; use
+            :py:meth:`animate_shading` for many solar positions.
+        engine : str, default: 'auto'
+            Name of a registered shading engine (see
+            :py:func:`twoaxistracking.shading.register_shading_engine`). With
+            'auto', the engine is selected using
+            :py:func:`twoaxistracking.shading.select_shading_engine`. The
+            built-in engines are:
+
+            * 'exact': subtracts the shadows from the active area using
+              shapely. Supports all collector geometries.
+            * 'rectangle': calculates the area of the union of the shadows
+              on a grid of the shadow edges, which is exact and several
+              times faster for rectangular collectors and active areas
+              consisting of rectangles aligned with the coordinate axes.
+            * 'overlap_table': interpolates the shaded fraction of solar
+              positions where the shadows of the neighbors cannot overlap
+              (e.g., a single shadow) from a table of overlap areas, which is
+              calculated once for the collector geometry using FFTs. The
+              absolute error of the shaded fraction is typically less than
+              0.005. Solar positions with overlapping shadows are calculated
+              exactly. Only used if specified explicitly.
+
+            Plotting requires the 'exact' engine. The name of the engine
+            used is stored in the ``last_shading_engine`` attribute.
+        out : numpy.ndarray, optional
+            Preallocated array (e.g., a memory-mapped array) with the same
+            length as the solar positions, into which the results are written
+            directly, i.e., without allocating an intermediate array of
+            shaded fractions. If specified, ``out`` is returned.
+        dtype : {numpy.float64, numpy.float32}, optional
+            Data type of the returned shaded fractions. Defaults to the data
+            type of ``out`` or to float64.
+        offset_tolerance : float, default: 0
+            Tolerance for reusing the shaded fraction of the previous solar
+            positions, e.g., for dense, ordered time series. Consecutive solar
+            positions where the same neighbors are shading candidates and
+            their projected geometries moved by less than ``offset_tolerance``
+            (in the units of the collector geometry) are not recalculated.
+            The absolute error of the shaded fraction is less than the number
+            of shading candidates times ``offset_tolerance`` times the maximum
+            extent of the total collector geometry divided by the active
+            area. By default, all solar positions are calculated.
 
         Returns
         -------
-        shaded_fractions : array-like
+        shaded_fractions : array-like or xarray.DataArray
             The shaded fractions for the specified collector geometry,
-            field layout, and solar angles.
+            field layout, and solar angles. For DataArray inputs (e.g., with
+            the dimensions time, lat, and lon), a DataArray with the
+            coordinates of the broadcasted inputs is returned. If the inputs
+            are backed by dask arrays, the result is evaluated lazily with the
+            same chunks, such that each chunk is processed by the vectorized
+            shading calculation, e.g., in parallel and out-of-core.
+
+        Notes
+        -----
+        Inputs supporting the array interface or the buffer protocol (e.g.,
+        pandas, pyarrow, and memory-mapped arrays) are not copied if their
+        data type is float64. Lists and tuples return lists, pandas Series
+        return Series, and all other array-likes return numpy arrays.
         """
+        if plot:
+            if engine not in ('auto', 'exact'):
+                raise ValueError("Plotting requires engine='exact'.")
+            engine = 'exact'
+        dtype = _output_dtype(dtype, out)
+        engine, engine_state = self._shading_engine(engine, np.size(solar_elevation))
+        self.last_shading_engine = engine
+
+        # The tables are calculated before the solar positions are processed,
+        # as the chunks of xarray inputs may be processed in parallel
+        kwargs = dict(
+            total_collector_geometry=self.total_collector_geometry,
+            active_collector_geometry=self.active_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            tracker_distance=self.tracker_distance,
+            relative_azimuth=self.relative_azimuth,
+            relative_slope=self.relative_slope,
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            max_shading_elevation=self.max_shading_elevation,
+            plot=plot,
+            horizon_table=self._horizon_table(),
+            engine=engine,
+            engine_state=engine_state,
+            offset_tolerance=offset_tolerance)
+
+        if _is_dataarray(solar_elevation) or _is_dataarray(solar_azimuth):
+            if plot or out is not None:
+                raise ValueError('Plotting and out are not supported for xarray inputs.')
+            return _apply_to_dataarrays(solar_elevation, solar_azimuth, kwargs, dtype)
+
         is_scalar = False
         # Wrap scalars in a list
         if np.isscalar(solar_elevation):
@@ -162,12 +1070,328 @@ class TrackerField:
             solar_azimuth = [solar_azimuth]
             is_scalar = True
 
-        # Calculate the shaded fraction for each solar position
-        shaded_fractions = []
-        for (elevation, azimuth) in zip(solar_elevation, solar_azimuth):
-            shaded_fraction = shading.shaded_fraction(
-                solar_elevation=elevation,
-                solar_azimuth=azimuth,
+        if out is not None:
+            shape = np.broadcast_shapes(np.shape(solar_elevation), np.shape(solar_azimuth))
+            if out.shape != shape:
+                raise ValueError(f'out must have the shape {shape}, got {out.shape}.')
+            # The shaded fractions are written directly into out
+            return shading._shaded_fraction_timeseries(
+                solar_elevation=solar_elevation, solar_azimuth=solar_azimuth, out=out,
+                **kwargs)
+
+        # Calculate the shaded fraction for all solar positions
+        shaded_fractions = shading._shaded_fraction_timeseries(
+            solar_elevation=solar_elevation, solar_azimuth=solar_azimuth, **kwargs)
+        # Return the shaded_fractions as the same type as the input
+        return _format_output(shaded_fractions.astype(dtype, copy=False),
+                              solar_elevation, is_scalar)
+
+    def get_shaded_fraction_sparse(self, solar_elevation, solar_azimuth, engine='auto',
+                                   batch_size=100_000):
+        """Calculate the shaded fraction as a run-length encoded sparse series.
+
+        The solar positions are processed in batches. The shaded fraction is
+        only calculated by the shading engine for the solar positions that
+        require geometry calculations, and each batch is built directly from
+        the positions of the nonzero and nan values as a
+        :py:class:`twoaxistracking.sparse.SparseShadedFraction`, such that the
+        dense series of shaded fractions is never created. This is useful for
+        long time series, where the shaded fraction is zero for most daylight
+        time steps and nan at night.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        engine : str, default: 'auto'
+            Shading engine (see :py:meth:`get_shaded_fraction`).
+        batch_size : int, default: 100000
+            Number of solar positions per batch.
+
+        Returns
+        -------
+        shaded_fractions : twoaxistracking.sparse.SparseShadedFraction
+            The shaded fractions, with the index of ``solar_elevation`` if it
+            is a pandas Series.
+        """
+        index = solar_elevation.index if isinstance(solar_elevation, pd.Series) else None
+        solar_elevation = np.asarray(solar_elevation, dtype=float)
+        solar_azimuth = np.asarray(solar_azimuth, dtype=float)
+        batches = [self._sparse_batch(solar_elevation[start:start+batch_size],
+                                      solar_azimuth[start:start+batch_size], engine)
+                   for start in range(0, len(solar_elevation), batch_size)]
+        if len(batches) == 0:
+            batches = [sparse.SparseShadedFraction.from_dense([])]
+        shaded_fractions = sparse.SparseShadedFraction.concat(batches)
+        shaded_fractions.index = index
+        return shaded_fractions
+
+    def _sparse_batch(self, solar_elevation, solar_azimuth, engine):
+        """Calculate the shaded fraction of a batch as a sparse series."""
+        classified, requires_geometry = shading._classify_solar_positions(
+            solar_elevation, solar_azimuth, self.slope_azimuth, self.slope_tilt,
+            self.max_shading_elevation, self._horizon_table())
+        # Nonzero (including nan) positions that do not require geometry
+        classified_positions = np.flatnonzero(~requires_geometry & (classified != 0))
+        geometry_positions = np.flatnonzero(requires_geometry)
+        geometry_values = self.get_shaded_fraction(
+            solar_elevation[geometry_positions], solar_azimuth[geometry_positions],
+            engine=engine)
+        positions = np.concatenate([classified_positions, geometry_positions])
+        values = np.concatenate([classified[classified_positions], geometry_values])
+        order = np.argsort(positions, kind='stable')
+        empty = np.empty(0, dtype=np.int64)
+        return sparse.SparseShadedFraction._from_positions(
+            len(solar_elevation), positions[order], values[order], empty, empty, None)
+
+    def get_shaded_fraction_at_location(self, latitude, longitude, times, cache=True):
+        """Calculate the shaded fraction at a location for a range of times.
+
+        The solar position is calculated using
+        :py:func:`twoaxistracking.solarposition.solar_position`, such that
+        no additional packages are required.
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees. North is positive.
+        longitude : float
+            Longitude in degrees. East is positive.
+        times : pandas.DatetimeIndex
+            Timestamps, e.g., ``pandas.date_range('2023-01-01', '2024-01-01',
+            freq='1min', tz='UTC', inclusive='left')``. Timezone-naive
+            timestamps are assumed to be in UTC.
+        cache : boolean, default: True
+            Whether to store the solar positions, such that they are not
+            recalculated when the method is called again with the same
+            location and times, e.g., after modifying the field layout.
+            The solar positions of the most recently used locations and times
+            are kept, and the cache can be emptied using
+            :py:meth:`clear_solar_position_cache`.
+
+        Returns
+        -------
+        shaded_fractions : pandas.Series
+            The shaded fractions with ``times`` as the index.
+        """
+        key = (latitude, longitude, str(times.tz), times.asi8.tobytes())
+        if key in self._solar_positions:
+            solar_position = self._solar_positions[key]
+            self._solar_positions.move_to_end(key)
+        else:
+            solar_position = solarposition.solar_position(times, latitude, longitude)
+            if cache:
+                self._solar_positions[key] = solar_position
+                if len(self._solar_positions) > _SOLAR_POSITION_CACHE_SIZE:
+                    # Discard the least recently used solar positions
+                    self._solar_positions.popitem(last=False)
+        return self.get_shaded_fraction(solar_position['solar_elevation'],
+                                        solar_position['solar_azimuth'])
+
+    def clear_solar_position_cache(self):
+        """Remove the solar positions cached by
+        :py:meth:`get_shaded_fraction_at_location`."""
+        self._solar_positions.clear()
+
+    def get_shaded_fraction_interval(self, latitude, longitude, times, interval_length=None,
+                                     label='left', tolerance=0.001, max_subintervals=64,
+                                     engine='auto'):
+        """Calculate the time-averaged shaded fraction of each time interval.
+
+        For interval-averaged irradiance data (e.g., hourly means), the
+        shaded fraction at the labeled timestamp or the midpoint of the
+        interval is biased around sunrise and sunset, when the shading changes
+        quickly. Instead, the shaded fraction is averaged over each interval
+        using the trapezoidal rule.
+
+        The shaded fraction is first evaluated at the start, midpoint, and end
+        of each interval. Intervals where these are equal (e.g., unshaded
+        or at night) are not sub-sampled. The remaining intervals straddle
+        a shading transition and are sub-sampled adaptively, doubling the
+        number of subintervals until the average changes by less than
+        ``tolerance`` or ``max_subintervals`` is reached. Intervals including
+        sunrise or sunset are always sub-sampled with ``max_subintervals``.
+        The solar position is calculated using
+        :py:func:`twoaxistracking.solarposition.solar_position`.
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude in degrees. North is positive.
+        longitude : float
+            Longitude in degrees. East is positive.
+        times : pandas.DatetimeIndex
+            Timestamps labeling the intervals. Timezone-naive timestamps are
+            assumed to be in UTC.
+        interval_length : str or pandas.Timedelta, optional
+            Length of the intervals, e.g., '1h'. Inferred from the frequency
+            of ``times`` if not specified.
+        label : {'left', 'right', 'center'}, default: 'left'
+            Whether the timestamps label the start, the end, or the midpoint
+            of the intervals.
+        tolerance : float, default: 0.001
+            Maximum change of the average shaded fraction when doubling the
+            number of subintervals.
+        max_subintervals : int, default: 64
+            Maximum number of subintervals of each interval.
+        engine : str, default: 'auto'
+            Shading engine (see :py:meth:`get_shaded_fraction`).
+
+        Returns
+        -------
+        shaded_fractions : pandas.Series
+            The average shaded fractions with ``times`` as the index. The
+            average only includes the part of the interval where the sun is
+            above the horizon, and is nan if the sun is below the horizon
+            for the whole interval.
+
+        Notes
+        -----
+        Shading that only occurs between the initial samples, e.g., for less
+        than half of an interval without shading at the start, midpoint, and
+        end, is not detected.
+        """
+        if interval_length is None:
+            interval_length = times.freq or pd.infer_freq(times)
+            if interval_length is None:
+                raise ValueError('The interval length could not be inferred from times.')
+        interval_length = pd.Timedelta(pd.tseries.frequencies.to_offset(interval_length))
+        offsets = {'left': 0, 'right': 1, 'center': 0.5}
+        if label not in offsets:
+            raise ValueError(f'label must be one of {list(offsets)}, got {label!r}.')
+        starts = times - offsets[label]*interval_length
+
+        def evaluate(index, fractions):
+            solar_position = solarposition.solar_position(
+                starts[index] + interval_length*fractions, latitude, longitude)
+            return self.get_shaded_fraction(solar_position['solar_elevation'].to_numpy(),
+                                            solar_position['solar_azimuth'].to_numpy(),
+                                            engine=engine)
+
+        n_intervals = len(times)
+        index = np.repeat(np.arange(n_intervals), 3)
+        samples = evaluate(index, np.tile([0, 0.5, 1], n_intervals)).reshape(-1, 3)
+        averages = _trapezoidal_average(samples)
+        # Only intervals straddling a shading transition are sub-sampled
+        is_nan = np.isnan(samples)
+        refine = np.flatnonzero(~(np.all(samples == samples[:, :1], axis=1)
+                                  | np.all(is_nan, axis=1)))
+        samples = samples[refine]
+        n_subintervals = 2
+        while (len(refine) > 0) and (n_subintervals < max_subintervals):
+            # Evaluate the midpoints of the subintervals and interleave the samples
+            fractions = (np.arange(n_subintervals) + 0.5) / n_subintervals
+            midpoints = evaluate(np.repeat(refine, n_subintervals),
+                                 np.tile(fractions, len(refine)))
+            refined_samples = np.empty((len(refine), 2*n_subintervals + 1))
+            refined_samples[:, ::2] = samples
+            refined_samples[:, 1::2] = midpoints.reshape(len(refine), n_subintervals)
+            refined_averages = _trapezoidal_average(refined_samples)
+            change = np.abs(refined_averages - averages[refine])
+            averages[refine] = refined_averages
+            n_subintervals *= 2
+            # Intervals where the average changes or the sun rises or sets are
+            # refined further
+            is_nan = np.isnan(refined_samples)
+            not_converged = (change > tolerance) | (np.any(is_nan, axis=1)
+                                                    & ~np.all(is_nan, axis=1))
+            refine, samples = refine[not_converged], refined_samples[not_converged]
+        return pd.Series(averages, index=times)
+
+    def get_shaded_fraction_multi_site(self, solar_positions, decimals=None):
+        """Calculate the shaded fraction for the solar positions of many sites.
+
+        Identical solar positions are only evaluated once, e.g., when sites
+        share the same solar position data or when the solar positions are
+        rounded, and the results are scattered back to all sites.
+
+        Parameters
+        ----------
+        solar_positions : pandas.DataFrame or dict
+            Either a DataFrame with the columns 'solar_elevation' and
+            'solar_azimuth' in degrees and any index, e.g., a MultiIndex of
+            (site, time), or a dictionary with the sites as keys and such
+            DataFrames as values.
+        decimals : int, optional
+            Number of decimals the solar positions are rounded to before
+            identifying identical solar positions. By default, the solar
+            positions are not rounded.
+
+        Returns
+        -------
+        shaded_fractions : pandas.Series or dict
+            The shaded fractions with the same index as ``solar_positions``,
+            or a dictionary of Series if ``solar_positions`` is a dictionary.
+            Sites without any solar positions result in empty Series, and an
+            empty dictionary results in an empty dictionary.
+        """
+        if isinstance(solar_positions, pd.DataFrame):
+            frames = {None: solar_positions}
+        else:
+            frames = solar_positions
+        if len(frames) == 0:
+            return {}
+        positions = np.concatenate([
+            frame[['solar_elevation', 'solar_azimuth']].to_numpy(dtype=float)
+            for frame in frames.values()])
+        if decimals is not None:
+            positions = np.round(positions, decimals)
+        if len(positions) == 0:
+            shaded_fractions = np.empty(0)
+        else:
+            unique_positions, inverse = np.unique(positions, axis=0, return_inverse=True)
+            unique_shaded_fractions = self.get_shaded_fraction(
+                unique_positions[:, 0], unique_positions[:, 1])
+            shaded_fractions = unique_shaded_fractions[inverse.ravel()]
+
+        splits = np.cumsum([len(frame) for frame in frames.values()])[:-1]
+        results = {site: pd.Series(values, index=frame.index) for (site, frame), values
+                   in zip(frames.items(), np.split(shaded_fractions, splits))}
+        if isinstance(solar_positions, pd.DataFrame):
+            return results[None]
+        return results
+
+    def get_shading_geometries(self, solar_elevation, solar_azimuth, output_format='shapely'):
+        """Calculate the unshaded and shading geometries for many solar positions.
+
+        Batch equivalent of :py:func:`twoaxistracking.shaded_fraction` with
+        ``return_geometries=True``. The geometries of all solar positions are
+        calculated in a vectorized manner and returned as arrays or as
+        contiguous buffers, which can be passed on to GIS tools without
+        creating Python objects for each solar position.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        output_format : {'shapely', 'wkb', 'geoarrow'}, default: 'shapely'
+            Format of the returned geometries. 'shapely' returns arrays of
+            Shapely geometries. 'wkb' returns a tuple (buffer, offsets), where
+            the well-known binary of geometry i is
+            ``buffer[offsets[i]:offsets[i+1]]``. 'geoarrow' returns the tuple
+            (geometry_type, coordinates, offsets) from
+            :py:func:`shapely.to_ragged_array`, which corresponds to the
+            GeoArrow memory layout.
+
+        Returns
+        -------
+        shading_geometries : dict
+            Dictionary with the keys 'shaded_fraction' (array of floats),
+            'unshaded_geometry' (the unshaded subset of the active collector
+            geometry for each solar position), and 'shading_geometry' (a
+            MultiPolygon of the shading collector geometries for each solar
+            position).
+        """
+        # Checked before the geometries of all solar positions are calculated
+        shading._check_output_format(output_format)
+        shaded_fractions, unshaded_geometries, shading_geometries = \
+            shading._shading_geometry_arrays(
+                solar_elevation=solar_elevation,
+                solar_azimuth=solar_azimuth,
                 total_collector_geometry=self.total_collector_geometry,
                 active_collector_geometry=self.active_collector_geometry,
                 min_tracker_spacing=self.min_tracker_spacing,
@@ -177,16 +1401,308 @@ class TrackerField:
                 slope_azimuth=self.slope_azimuth,
                 slope_tilt=self.slope_tilt,
                 max_shading_elevation=self.max_shading_elevation,
-                plot=plot)
-            shaded_fractions.append(shaded_fraction)
+                horizon_table=self._horizon_table())
+        return {
+            'shaded_fraction': shaded_fractions,
+            'unshaded_geometry': shading._encode_geometries(
+                unshaded_geometries, output_format),
+            'shading_geometry': shading._encode_geometries(
+                shading_geometries, output_format)}
 
-        # Return the shaded_fractions as the same type as the input
-        if isinstance(solar_elevation, pd.Series):
-            shaded_fractions = pd.Series(shaded_fractions,
-                                         index=solar_elevation.index)
-        elif isinstance(solar_elevation, np.ndarray):
-            shaded_fractions = np.array(shaded_fractions)
-        elif is_scalar:
-            shaded_fractions = shaded_fractions[0]
+    def animate_shading(self, solar_elevation, solar_azimuth, filename, fps=10, dpi=100,
+                        writer=None):
+        """Write an animation of the shading for a sequence of solar positions.
 
-        return shaded_fractions
+        The figure is created once and only the unshaded and shading areas are
+        updated for each solar position. The frames are written directly to
+        the file, such that the memory usage does not depend on the number of
+        solar positions.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        filename : str
+            Name of the output file, e.g., a gif or mp4 file.
+        fps : float, default: 10
+            Frames per second.
+        dpi : float, default: 100
+            Resolution of the frames in dots per inch.
+        writer : str or matplotlib.animation.AbstractMovieWriter, optional
+            Animation writer or name of a registered matplotlib animation
+            writer. By default, gif files are written using 'imagemagick' or
+            'ffmpeg' if installed, which stream the frames to the file, and
+            otherwise using 'pillow', which keeps all frames in memory until
+            the animation is finished. 'ffmpeg' is used for all other files.
+
+        Returns
+        -------
+        shaded_fractions : array-like
+            The shaded fractions for the specified solar positions.
+        """
+        is_scalar = False
+        if np.isscalar(solar_elevation):
+            solar_elevation = [solar_elevation]
+            solar_azimuth = [solar_azimuth]
+            is_scalar = True
+        elevation = np.asarray(solar_elevation, dtype=float)
+        azimuth = np.asarray(solar_azimuth, dtype=float)
+        labels = solar_elevation.index if isinstance(solar_elevation, pd.Series) else \
+            [None] * len(elevation)
+
+        shaded_fractions = np.full(len(elevation), np.nan)
+        results = shading._iter_shading_geometries(
+            solar_elevation=elevation,
+            solar_azimuth=azimuth,
+            total_collector_geometry=self.total_collector_geometry,
+            active_collector_geometry=self.active_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            tracker_distance=self.tracker_distance,
+            relative_azimuth=self.relative_azimuth,
+            relative_slope=self.relative_slope,
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            max_shading_elevation=self.max_shading_elevation,
+            horizon_table=self._horizon_table())
+
+        def frames():
+            for i, (shaded_fraction, unshaded_geometry, shading_geometries) in \
+                    enumerate(results):
+                shaded_fractions[i] = shaded_fraction
+                title = (f'Elevation: {elevation[i]:.1f}°, azimuth: {azimuth[i]:.1f}°, '
+                         f'shaded fraction: {shaded_fraction:.3f}')
+                if labels[i] is not None:
+                    title = f'{labels[i]}\n{title}'
+                yield title, unshaded_geometry, shading_geometries
+
+        plotting._animate_shading(
+            frames(), self.active_collector_geometry, self.min_tracker_spacing,
+            filename, writer=writer, fps=fps, dpi=dpi)
+        return _format_output(shaded_fractions, solar_elevation, is_scalar)
+
+    def get_ground_sample_points(self, resolution=20):
+        """Get the ground sample points used for ground shading calculations.
+
+        The sample points form a regular grid in the unit cell of the field
+        layout, i.e., the parallelogram spanned by the primary and secondary
+        lattice vectors centered on the reference collector. As the layout is
+        periodic, the unit cell is representative of the entire field.
+
+        Parameters
+        ----------
+        resolution : int, default: 20
+            Number of sample points along each of the lattice vectors.
+
+        Returns
+        -------
+        x, y : array of floats
+            Coordinates of the sample points with the shape
+            (resolution, resolution). The first axis corresponds to the
+            primary direction.
+        """
+        self._check_regular_layout()
+        lattice_vectors = layout._lattice_vectors(
+            self.gcr, self.total_collector_area, self.aspect_ratio, self.offset,
+            self.rotation)
+        return layout._unit_cell_points(lattice_vectors, resolution)
+
+    def _ground_shading(self, solar_elevation, solar_azimuth, pivot_height, resolution):
+        self._check_regular_layout()
+        lattice_vectors = layout._lattice_vectors(
+            self.gcr, self.total_collector_area, self.aspect_ratio, self.offset,
+            self.rotation)
+        x, y = layout._unit_cell_points(lattice_vectors, resolution)
+        return shading._ground_shading(
+            solar_elevation=solar_elevation,
+            solar_azimuth=solar_azimuth,
+            total_collector_geometry=self.total_collector_geometry,
+            min_tracker_spacing=self.min_tracker_spacing,
+            pivot_height=pivot_height,
+            lattice_vectors=lattice_vectors,
+            X=self.X, Y=self.Y, x=x.ravel(), y=y.ravel(),
+            slope_azimuth=self.slope_azimuth,
+            slope_tilt=self.slope_tilt,
+            horizon_table=self._horizon_table())
+
+    def get_ground_shaded_fraction(self, solar_elevation, solar_azimuth, pivot_height,
+                                   resolution=20):
+        """Calculate the fraction of the ground that is shaded by the collectors.
+
+        The ground is sampled on a regular grid in the unit cell of the field
+        layout (see :py:meth:`get_ground_sample_points`) and each sample point
+        is projected towards the sun onto the collector planes of the
+        reference collector and its neighbors. Ground points are considered
+        shaded when the sun is below the horizon.
+
+        Parameters
+        ----------
+        solar_elevation : array-like
+            Solar elevation angles in degrees.
+        solar_azimuth : array-like
+            Solar azimuth angles in degrees.
+        pivot_height : float
+            Height of the collector pivot points above the ground. Same unit as
+            the collector geometry.
+        resolution : int, default: 20
+            Number of sample points along each of the lattice vectors.
+
+        Returns
+        -------
+        ground_shaded_fractions : array-like
+            Fraction of the ground that is shaded. The value is nan when the sun
+            is below the horizon.
+
+        """
+        is_scalar = False
+        if np.isscalar(solar_elevation):
+            solar_elevation = [solar_elevation]
+            solar_azimuth = [solar_azimuth]
+            is_scalar = True
+
+        shaded = self._ground_shading(solar_elevation, solar_azimuth, pivot_height,
+                                      resolution)
+        ground_shaded_fractions = shaded.mean(axis=1)
+        return _format_output(ground_shaded_fractions, solar_elevation, is_scalar)
+
+    def iter_ground_shade_maps(self, solar_elevation, solar_azimuth, pivot_height,
+                               resolution=20, weights=None):
+        """Generate daily ground shade maps for the unit cell of the field.
+
+        The ground shading is calculated one day at a time, such that long
+        time series can be processed without holding the shading of every
+        timestep and sample point in memory.
+
+        Parameters
+        ----------
+        solar_elevation : pandas.Series
+            Solar elevation angles in degrees with a DatetimeIndex.
+        solar_azimuth : pandas.Series
+            Solar azimuth angles in degrees with the same index as
+            ``solar_elevation``.
+        pivot_height : float
+            Height of the collector pivot points above the ground. Same unit as
+            the collector geometry.
+        resolution : int, default: 20
+            Number of sample points along each of the lattice vectors.
+        weights : pandas.Series, optional
+            Weights of the timesteps, e.g., the direct normal irradiance or the
+            duration of each timestep. By default all timesteps with the sun
+            above the horizon are weighted equally.
+
+        Yields
+        ------
+        date : pandas.Timestamp
+            Start of the day.
+        shade_map : array of float32
+            Weighted average of the shading of each ground sample point over
+            the timesteps of the day where the sun is above the horizon, with
+            the shape (resolution, resolution). The sample point coordinates
+            are given by :py:meth:`get_ground_sample_points`. The values are
+            nan if the sun is not above the horizon during the day.
+        """
+        if not isinstance(solar_elevation, pd.Series) or \
+                not isinstance(solar_elevation.index, pd.DatetimeIndex):
+            raise ValueError('solar_elevation needs to be a pandas Series with a '
+                             'DatetimeIndex.')
+        if weights is None:
+            weights = pd.Series(1.0, index=solar_elevation.index)
+        solar_azimuth = pd.Series(np.asarray(solar_azimuth), index=solar_elevation.index)
+        weights = pd.Series(np.asarray(weights, dtype=float), index=solar_elevation.index)
+
+        for date, index in solar_elevation.groupby(
+                solar_elevation.index.normalize()).groups.items():
+            shaded = self._ground_shading(
+                solar_elevation[index].values, solar_azimuth[index].values,
+                pivot_height, resolution)
+            daylight = ~np.isnan(shaded[:, 0])
+            day_weights = weights[index].values[daylight]
+            if day_weights.sum() > 0:
+                shade_map = np.average(shaded[daylight], axis=0, weights=day_weights)
+            else:
+                shade_map = np.full(shaded.shape[1], np.nan)
+            yield date, shade_map.astype(np.float32).reshape(resolution, resolution)
+
+
+def _is_dataarray(values):
+    """Check whether the values are an xarray DataArray without importing xarray."""
+    xarray = sys.modules.get('xarray')
+    return xarray is not None and isinstance(values, xarray.DataArray)
+
+
+def _output_dtype(dtype, out):
+    """Determine the data type of the shaded fractions (float32 or float64)."""
+    if dtype is None:
+        dtype = np.float64 if out is None else out.dtype
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f'dtype must be float32 or float64, got {dtype}.')
+    if out is not None and out.dtype != dtype:
+        raise ValueError(f'The data type of out ({out.dtype}) does not match dtype '
+                         f'({dtype}).')
+    return dtype
+
+
+def _apply_to_dataarrays(solar_elevation, solar_azimuth, kwargs, dtype=np.float64):
+    """Calculate the shaded fraction of DataArrays of solar positions.
+
+    Dask-backed DataArrays are processed lazily one chunk at a time using the
+    vectorized shading calculation, and the result has the same coordinates
+    and chunks as the (broadcasted) inputs.
+    """
+    import xarray
+
+    def func(solar_elevation, solar_azimuth):
+        solar_elevation, solar_azimuth = np.broadcast_arrays(solar_elevation, solar_azimuth)
+        shaded_fractions = shading._shaded_fraction_timeseries(
+            solar_elevation.ravel(), solar_azimuth.ravel(), **kwargs)
+        return shaded_fractions.reshape(solar_elevation.shape).astype(dtype, copy=False)
+
+    shaded_fractions = xarray.apply_ufunc(
+        func, solar_elevation, solar_azimuth, dask='parallelized', output_dtypes=[dtype])
+    return shaded_fractions.rename('shaded_fraction')
+
+
+def _limit_azimuth(azimuth, min_azimuth, max_azimuth):
+    """Set the azimuth angles outside of the range extending clockwise from
+    ``min_azimuth`` to ``max_azimuth`` to the nearest limit (in degrees)."""
+    if max_azimuth - min_azimuth >= 360:
+        return azimuth
+    width = np.mod(max_azimuth - min_azimuth, 360)
+    # Clockwise angle from the minimum and the angles to the two limits
+    clockwise = np.mod(azimuth - min_azimuth, 360)
+    limited = np.where(360 - clockwise < clockwise - width, min_azimuth, max_azimuth)
+    return np.mod(np.where(clockwise <= width, azimuth, limited), 360)
+
+
+def _pad_group_layouts(group_layouts):
+    """Stack the neighbors of the groups as arrays with the shape (n_groups,
+    max_neighbors), where groups with fewer neighbors are padded with nan."""
+    n_neighbors = max([len(distance) for distance, _, _ in group_layouts] + [1])
+    padded = np.full((3, len(group_layouts), n_neighbors), np.nan)
+    for group, group_layout in enumerate(group_layouts):
+        for values, neighbor_values in zip(padded, group_layout):
+            values[group, :len(neighbor_values)] = neighbor_values
+    return padded
+
+
+def _trapezoidal_average(samples):
+    """Average of equally spaced samples (rows) using the trapezoidal rule,
+    ignoring nan values."""
+    weights = np.ones(samples.shape[1])
+    weights[[0, -1]] = 0.5
+    is_valid = ~np.isnan(samples)
+    with np.errstate(invalid='ignore'):
+        return (np.where(is_valid, samples, 0) @ weights) / (is_valid @ weights)
+
+
+def _format_output(values, solar_elevation, is_scalar):
+    """Convert an array of results to the same type as the solar positions."""
+    if isinstance(solar_elevation, pd.Series):
+        return pd.Series(values, index=solar_elevation.index)
+    elif is_scalar:
+        return values[0]
+    elif isinstance(solar_elevation, (list, tuple)):
+        return values.tolist()
+    return values
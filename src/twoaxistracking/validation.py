@@ -0,0 +1,179 @@
+"""
+The `validation` module contains functions for validating fast or approximate
+shading engines against the exact shaded fraction calculated using
+:py:func:`twoaxistracking.shaded_fraction`, both in terms of accuracy and
+speed.
+"""
+
+import time
+
+import numpy as np
+import pandas as pd
+from shapely import geometry
+
+from twoaxistracking import layout, shading, trackerfield
+
+
+def _collector_geometries():
+    """Rectangular collector with a single active area and with four cells."""
+    total_collector_geometry = geometry.box(-2, -1, 2, 1)
+    cells = geometry.MultiPolygon([
+        geometry.box(-1.9, -0.9, -0.1, -0.1),
+        geometry.box(0.1, -0.9, 1.9, -0.1),
+        geometry.box(-1.9, 0.1, -0.1, 0.9),
+        geometry.box(0.1, 0.1, 1.9, 0.9)])
+    return total_collector_geometry, total_collector_geometry, cells
+
+
+def sample_fields(n_random=3, seed=None):
+    """Sample tracker fields for validating shading engines.
+
+    The sample contains the standard layout types (including a sloped
+    hexagonal field, a field with a multi-cell active area, and a field with
+    a horizon profile) and ``n_random`` fields with random, feasible layout parameters and slopes.
+
+    Parameters
+    ----------
+    n_random : int, default: 3
+        Number of fields with random layout parameters.
+    seed : int or numpy.random.Generator, optional
+        Seed for the random number generator.
+
+    Returns
+    -------
+    fields : dict
+        Dictionary of :py:class:`twoaxistracking.TrackerField` with a
+        description of each field as keys.
+    """
+    rng = np.random.default_rng(seed)
+    total, active, cells = _collector_geometries()
+    fields = {
+        'square': trackerfield.TrackerField(
+            total, active, neighbor_order=2, gcr=0.25, layout_type='square'),
+        'hexagonal_e_w, sloped': trackerfield.TrackerField(
+            total, active, neighbor_order=2, gcr=0.3, layout_type='hexagonal_e_w',
+            slope_azimuth=160, slope_tilt=5),
+        'diagonal, multi-cell': trackerfield.TrackerField(
+            total, cells, neighbor_order=2, gcr=0.2, layout_type='diagonal'),
+        'hexagonal_n_s, horizon profile': trackerfield.TrackerField(
+            total, active, neighbor_order=2, gcr=0.3, layout_type='hexagonal_n_s',
+            horizon_profile=pd.Series([5, 15, 2, 10], index=[0, 90, 180, 270])),
+    }
+    min_tracker_spacing = layout._calculate_min_tracker_spacing(total)
+    n_standard = len(fields)
+    while len(fields) < n_standard + n_random:
+        gcr = rng.uniform(0.1, 0.4)
+        aspect_ratio = rng.uniform(0.6, 3)
+        offset = rng.uniform(-0.5, 0.5)
+        rotation = rng.uniform(0, 180)
+        violations = layout._layout_feasibility(
+            gcr, total.area, min_tracker_spacing, aspect_ratio, offset, rotation)
+        if any(np.any(mask) for mask, _ in violations):
+            continue
+        fields[f'random {len(fields) - n_standard + 1}'] = trackerfield.TrackerField(
+            total, cells if rng.uniform() < 0.5 else active, neighbor_order=2, gcr=gcr,
+            aspect_ratio=aspect_ratio, offset=offset, rotation=rotation,
+            slope_azimuth=rng.uniform(0, 360), slope_tilt=rng.uniform(0, 10))
+    return fields
+
+
+def sample_solar_positions(field, n_solar_positions=200, seed=None):
+    """Sample solar positions where shading by the neighbors may occur.
+
+    The solar elevation angles are sampled uniformly between zero and
+    slightly above the maximum shading elevation of the field, and the solar
+    azimuth angles are sampled uniformly.
+
+    Returns
+    -------
+    solar_elevation, solar_azimuth : array of floats
+    """
+    rng = np.random.default_rng(seed)
+    max_elevation = min(90, 1.1 * field.max_shading_elevation)
+    solar_elevation = rng.uniform(0, max_elevation, n_solar_positions)
+    solar_azimuth = rng.uniform(0, 360, n_solar_positions)
+    return solar_elevation, solar_azimuth
+
+
+def _exact_shaded_fraction(field, solar_elevation, solar_azimuth):
+    """Calculate the shaded fraction using shaded_fraction for each solar position."""
+    return np.array([shading.shaded_fraction(
+        solar_elevation=e,
+        solar_azimuth=a,
+        total_collector_geometry=field.total_collector_geometry,
+        active_collector_geometry=field.active_collector_geometry,
+        min_tracker_spacing=field.min_tracker_spacing,
+        tracker_distance=field.tracker_distance,
+        relative_azimuth=field.relative_azimuth,
+        relative_slope=field.relative_slope,
+        slope_azimuth=field.slope_azimuth,
+        slope_tilt=field.slope_tilt,
+        max_shading_elevation=field.max_shading_elevation,
+        horizon_profile=field.horizon_profile)
+        for e, a in zip(solar_elevation, solar_azimuth)], dtype=float)
+
+
+def _absolute_error(result, expected):
+    """Absolute error, which is zero if both are nan and infinite if only one is nan."""
+    error = np.abs(np.asarray(result, dtype=float) - expected)
+    both_nan = np.isnan(result) & np.isnan(expected)
+    return np.where(both_nan, 0, np.where(np.isnan(error), np.inf, error))
+
+
+def validate_engines(engines, fields=None, n_solar_positions=200, seed=None):
+    """Compare shading engines to the exact shaded fraction.
+
+    For each field, solar positions are sampled using
+    :py:func:`sample_solar_positions` and the shaded fraction is calculated
+    using each engine and using :py:func:`twoaxistracking.shaded_fraction`
+    for each solar position (the reference).
+
+    Parameters
+    ----------
+    engines : dict
+        Dictionary of engines with the engine names as keys. An engine is a
+        function with the signature ``engine(field, solar_elevation,
+        solar_azimuth)`` returning an array of shaded fractions.
+    fields : dict, optional
+        Dictionary of :py:class:`twoaxistracking.TrackerField`. By default,
+        the fields from :py:func:`sample_fields` are used.
+    n_solar_positions : int, default: 200
+        Number of solar positions sampled for each field.
+    seed : int or numpy.random.Generator, optional
+        Seed for the random number generator.
+
+    Returns
+    -------
+    report : pandas.DataFrame
+        DataFrame with one row per engine and the columns 'max_error',
+        'mean_error' (the maximum and mean absolute error of the shaded
+        fraction across all fields and solar positions), 'time', and
+        'speed_up' (the calculation time of the reference divided by that
+        of the engine).
+    """
+    rng = np.random.default_rng(seed)
+    if fields is None:
+        fields = sample_fields(seed=rng)
+    errors = {name: [] for name in engines}
+    times = dict.fromkeys(engines, 0)
+    reference_time = 0
+    for field in fields.values():
+        solar_elevation, solar_azimuth = sample_solar_positions(
+            field, n_solar_positions, seed=rng)
+        start = time.perf_counter()
+        expected = _exact_shaded_fraction(field, solar_elevation, solar_azimuth)
+        reference_time += time.perf_counter() - start
+        for name, engine in engines.items():
+            start = time.perf_counter()
+            result = engine(field, solar_elevation, solar_azimuth)
+            times[name] += time.perf_counter() - start
+            errors[name].append(_absolute_error(result, expected))
+
+    errors = {name: np.concatenate(e) for name, e in errors.items()}
+    report = pd.DataFrame({
+        'max_error': {name: e.max() for name, e in errors.items()},
+        'mean_error': {name: e.mean() for name, e in errors.items()},
+        'time': times,
+    })
+    report['speed_up'] = reference_time / report['time']
+    return report
@@ -0,0 +1,124 @@
+from twoaxistracking import cli, trackerfield
+import numpy as np
+import pandas as pd
+import pytest
+import runpy
+import sys
+from shapely import geometry
+import shapely
+
+
+@pytest.fixture
+def solar_positions(tmp_path):
+    rng = np.random.default_rng(42)
+    solar_positions = pd.DataFrame({'solar_elevation': rng.uniform(-5, 60, 250),
+                                    'solar_azimuth': rng.uniform(0, 360, 250)})
+    filename = tmp_path / 'solar_positions.csv'
+    solar_positions.to_csv(filename, index=False)
+    return solar_positions, str(filename)
+
+
+@pytest.fixture
+def expected_shaded_fraction(solar_positions, rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=2,
+        gcr=0.25,
+        layout_type='square',
+        slope_tilt=5)
+    return field.get_shaded_fraction(solar_positions[0]['solar_elevation'].values,
+                                     solar_positions[0]['solar_azimuth'].values)
+
+
+def test_run_csv_to_npy(solar_positions, expected_shaded_fraction, tmp_path, capsys):
+    output = str(tmp_path / 'shaded_fraction.npy')
+    cli.main(['run', solar_positions[1], output, '--geometry', 'POLYGON ((-2 -1, 2 -1, 2 1, '
+              '-2 1, -2 -1))', '--gcr', '0.25', '--layout-type', 'square', '--slope-tilt',
+              '5', '--batch-size', '100'])
+    np.testing.assert_allclose(np.load(output), expected_shaded_fraction, atol=1e-12)
+    # Progress is reported for each batch
+    progress = capsys.readouterr().err.splitlines()
+    assert [line.split()[0] for line in progress] == ['100/250', '200/250', '250/250']
+
+
+def test_run_parquet(solar_positions, expected_shaded_fraction, tmp_path, capsys,
+                     monkeypatch):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    filename = str(tmp_path / 'solar_positions.parquet')
+    solar_positions[0].rename(columns={'solar_elevation': 'elevation'}).to_parquet(filename)
+    geometry_file = tmp_path / 'collector.geojson'
+    geometry_file.write_text(shapely.to_geojson(geometry.box(-2, -1, 2, 1)))
+    output = str(tmp_path / 'shaded_fraction.parquet')
+    # The rows are not counted in advance for Parquet output
+    monkeypatch.setattr(cli, '_count_rows', None)
+    cli.main(['run', filename, output, '--geometry', str(geometry_file),
+              '--active-geometry', 'POLYGON ((-2 -1, 2 -1, 2 1, -2 1, -2 -1))',
+              '--gcr', '0.25', '--aspect-ratio', '1', '--offset', '0', '--rotation', '0',
+              '--slope-tilt', '5', '--batch-size', '100', '--elevation-column', 'elevation',
+              '--quiet'])
+    result = pd.read_parquet(output)
+    np.testing.assert_allclose(result['shaded_fraction'], expected_shaded_fraction,
+                               atol=1e-12)
+    assert parquet.ParquetFile(output).num_row_groups == 3
+    assert capsys.readouterr().err == ''
+    # The rows of the Parquet file are counted for .npy output
+    monkeypatch.undo()
+    output = str(tmp_path / 'shaded_fraction.npy')
+    cli.main(['run', filename, output, '--geometry', str(geometry_file), '--gcr', '0.25',
+              '--layout-type', 'square', '--slope-tilt', '5', '--elevation-column',
+              'elevation', '--quiet'])
+    np.testing.assert_allclose(np.load(output), expected_shaded_fraction, atol=1e-12)
+
+
+GEOMETRY = 'POLYGON ((-2 -1, 2 -1, 2 1, -2 1, -2 -1))'
+
+
+@pytest.mark.parametrize('output, options, message', [
+    ('output.csv', ['--gcr', '0.25', '--layout-type', 'square'],
+     'needs to be a .parquet or .npy file'),
+    ('output.npy', ['--gcr', '0.25', '--layout-type', 'square', '--batch-size', '0'],
+     'batch size needs to be positive'),
+    ('output.npy', ['--gcr', '0.25', '--layout-type', 'square', '--azimuth-column', 'azimuth'],
+     'does not contain the columns'),
+    ('output.npy', ['--gcr', '0.9', '--layout-type', 'square'],
+     'Maximum ground cover ratio exceeded'),
+    ('output.npy', ['--gcr', '0.25'], 'Aspect ratio, offset, and rotation'),
+    ('output.npy', ['--gcr', '0.25', '--layout-type', 'square', '--geometry', 'POLYGON ((0'],
+     'Invalid collector geometry'),
+])
+def test_run_invalid_arguments(solar_positions, tmp_path, capsys, monkeypatch,
+                               output, options, message):
+    # Invalid arguments are reported before the input file is processed
+    monkeypatch.setattr(cli, '_count_rows', None)
+    with pytest.raises(SystemExit):
+        cli.main(['run', solar_positions[1], str(tmp_path / output), '--geometry', GEOMETRY,
+                  *options])
+    assert message in capsys.readouterr().err
+    assert not (tmp_path / output).exists()
+
+
+def test_run_missing_input(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        cli.main(['run', str(tmp_path / 'missing.csv'), str(tmp_path / 'output.npy'),
+                  '--geometry', GEOMETRY, '--gcr', '0.25', '--layout-type', 'square'])
+    assert 'does not exist' in capsys.readouterr().err
+
+
+def test_run_missing_pyarrow(solar_positions, tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, 'pyarrow', None)
+    with pytest.raises(SystemExit):
+        cli.main(['run', solar_positions[1], str(tmp_path / 'output.parquet'),
+                  '--geometry', GEOMETRY, '--gcr', '0.25', '--layout-type', 'square'])
+    assert 'pyarrow is required' in capsys.readouterr().err
+
+
+def test_run_module(solar_positions, expected_shaded_fraction, tmp_path, monkeypatch):
+    output = str(tmp_path / 'shaded_fraction.npy')
+    monkeypatch.setattr(sys, 'argv', [
+        'twoaxistracking', 'run', solar_positions[1], output, '--geometry', GEOMETRY,
+        '--gcr', '0.25', '--layout-type', 'square', '--slope-tilt', '5', '--quiet'])
+    monkeypatch.delitem(sys.modules, 'twoaxistracking.cli')
+    runpy.run_module('twoaxistracking.cli', run_name='__main__')
+    np.testing.assert_allclose(np.load(output), expected_shaded_fraction, atol=1e-12)
@@ -1,3 +1,4 @@
+import sys
 from twoaxistracking import layout
 from shapely import geometry
 import numpy as np
@@ -175,3 +176,201 @@ def test_calculation_of_max_shading_elevation_circle(circular_geometry):
     max_shading_elevation = layout.max_shading_elevation(
         collector_geometry, tracker_distance, relative_slope)
     np.testing.assert_allclose(max_shading_elevation, 52.989564)
+
+
+def test_vectorized_layout_generation(rectangular_geometry):
+    # Test that layouts generated for arrays of parameters are identical to
+    # layouts generated one at a time
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    gcr = np.array([0.1, 0.2, 0.25])
+    aspect_ratio = np.array([1, 1.5, 1.1])
+    offset = np.array([0, -0.3, 0.2])
+    rotation = np.array([0, 45, 170])
+    slope_azimuth = np.array([0, 90, 200])
+    slope_tilt = np.array([0, 5, 10])
+    result = layout.generate_field_layout(
+        gcr=gcr,
+        total_collector_area=collector_geometry.area,
+        min_tracker_spacing=min_tracker_spacing,
+        neighbor_order=2,
+        aspect_ratio=aspect_ratio,
+        offset=offset,
+        rotation=rotation,
+        slope_azimuth=slope_azimuth,
+        slope_tilt=slope_tilt)
+    for i in range(len(gcr)):
+        expected = layout.generate_field_layout(
+            gcr=gcr[i],
+            total_collector_area=collector_geometry.area,
+            min_tracker_spacing=min_tracker_spacing,
+            neighbor_order=2,
+            aspect_ratio=aspect_ratio[i],
+            offset=offset[i],
+            rotation=rotation[i],
+            slope_azimuth=slope_azimuth[i],
+            slope_tilt=slope_tilt[i])
+        for r, e in zip(result, expected):
+            assert r.shape == (3, 24)
+            np.testing.assert_allclose(r[i], e)
+
+
+def test_vectorized_layout_generation_feasibility(rectangular_geometry):
+    # Test that infeasible layouts are masked instead of raising an error
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    gcr = np.array([0.1, 0.5, 0.2, -0.1])
+    offset = np.array([0, 0, 0.7, 0])
+    with pytest.raises(ValueError, match="offset is outside the valid range"):
+        layout.generate_field_layout(
+            gcr=gcr, total_collector_area=collector_geometry.area,
+            min_tracker_spacing=min_tracker_spacing, neighbor_order=1,
+            aspect_ratio=1, offset=offset, rotation=0)
+
+    *field_layout, feasible = layout.generate_field_layout(
+        gcr=gcr, total_collector_area=collector_geometry.area,
+        min_tracker_spacing=min_tracker_spacing, neighbor_order=1,
+        aspect_ratio=1, offset=offset, rotation=0, return_feasible=True)
+    np.testing.assert_array_equal(feasible, [True, False, False, False])
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = field_layout
+    assert np.isfinite(X[0]).all()
+    assert np.isnan(X[1:]).all()
+    assert np.isnan(relative_slope[1:]).all()
+
+    max_shading_elevation = layout.max_shading_elevation(
+        collector_geometry, tracker_distance, relative_slope)
+    assert max_shading_elevation.shape == (4,)
+    expected = layout.max_shading_elevation(
+        collector_geometry, tracker_distance[0], relative_slope[0])
+    np.testing.assert_allclose(max_shading_elevation[0], expected)
+    assert np.isnan(max_shading_elevation[1:]).all()
+
+
+def test_layout_generation_return_feasible_scalar(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    *field_layout, feasible = layout.generate_field_layout(
+        gcr=0.125, total_collector_area=collector_geometry.area,
+        min_tracker_spacing=min_tracker_spacing, neighbor_order=1,
+        aspect_ratio=1, offset=0, rotation=0, return_feasible=True)
+    assert feasible
+    assert field_layout[0].shape == (8,)
+
+
+@pytest.fixture
+def planar_elevation_raster():
+    # Planar terrain with slope_azimuth=45 and slope_tilt=5 (cell size of 0.5)
+    rows, cols = np.mgrid[0:120, 0:100]
+    x, y = (cols + 0.5) * 0.5, -(rows + 0.5) * 0.5
+    elevation = -(x + y) * np.sin(np.deg2rad(45)) * np.tan(np.deg2rad(5))
+    return elevation
+
+
+def test_terrain_layout_planar(rectangular_geometry, planar_elevation_raster, tmp_path):
+    # Test that a planar raster results in the same relative slopes as
+    # generate_field_layout for collectors with all neighbors inside the raster
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    # The raster is memory-mapped to ensure that it is not loaded
+    np.save(tmp_path / 'elevation.npy', planar_elevation_raster)
+    elevation = np.load(tmp_path / 'elevation.npy', mmap_mode='r')
+    params = dict(gcr=0.125, total_collector_area=collector_geometry.area,
+                  min_tracker_spacing=min_tracker_spacing, neighbor_order=1,
+                  aspect_ratio=1, offset=0, rotation=30)
+    x, y, z, X, Y, tracker_distance, relative_azimuth, relative_slope = \
+        layout.generate_terrain_layout(elevation=elevation, cell_size=0.5, **params)
+    X_exp, Y_exp, _, tracker_distance_exp, relative_azimuth_exp, relative_slope_exp = \
+        layout.generate_field_layout(slope_azimuth=45, slope_tilt=5, **params)
+    np.testing.assert_allclose(X, X_exp)
+    np.testing.assert_allclose(tracker_distance, tracker_distance_exp)
+    # Collectors are within the extent of the raster
+    assert (x >= 0.25).all() & (x <= 49.75).all()
+    assert (y >= -59.75).all() & (y <= -0.25).all()
+    np.testing.assert_allclose(
+        z, -(x + y) * np.sin(np.deg2rad(45)) * np.tan(np.deg2rad(5)), atol=1e-9)
+    # Collectors are spaced 8 units apart
+    assert len(x) == pytest.approx(50 * 60 / 8**2, rel=0.25)
+    interior = ~np.isnan(relative_slope).any(axis=1)
+    assert interior.sum() > 10
+    assert np.isnan(relative_slope).any()
+    np.testing.assert_allclose(relative_slope[interior],
+                               np.tile(relative_slope_exp, (interior.sum(), 1)), atol=1e-9)
+
+
+def test_terrain_layout_invalid_raster(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    with pytest.raises(ValueError, match="two-dimensional"):
+        layout.generate_terrain_layout(
+            elevation=np.zeros((1, 10)), cell_size=1, gcr=0.125,
+            total_collector_area=collector_geometry.area,
+            min_tracker_spacing=min_tracker_spacing, neighbor_order=1,
+            aspect_ratio=1, offset=0, rotation=0)
+
+
+def test_group_neighbor_profiles():
+    relative_slope = np.array([
+        [1.001, 2, np.nan],
+        [1.002, 2, np.nan],
+        [1.002, 2, 0],
+        [1.2, 2, 0]])
+    group, group_relative_slope = layout.group_neighbor_profiles(
+        relative_slope, slope_tolerance=0.01)
+    assert group[0] == group[1]
+    assert len(np.unique(group)) == 3
+    np.testing.assert_allclose(group_relative_slope[group[0]], [1.0015, 2, np.nan])
+    np.testing.assert_allclose(group_relative_slope[group[3]], [1.2, 2, 0])
+
+
+def test_coordinate_layout_regular(rectangular_geometry):
+    # Test that a regular field results in a single group for the interior
+    # collectors with the same neighbors as generate_field_layout
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, _, tracker_distance, relative_azimuth, relative_slope = \
+        layout.generate_field_layout(
+            gcr=0.125, total_collector_area=collector_geometry.area,
+            min_tracker_spacing=min_tracker_spacing, neighbor_order=1,
+            aspect_ratio=1, offset=0, rotation=0,
+            slope_azimuth=45, slope_tilt=5)
+    x, y = np.meshgrid(np.arange(5) * 8.0, np.arange(5) * 8.0)
+    x, y = x.ravel(), y.ravel()
+    z = -(x + y) * np.sin(np.deg2rad(45)) * np.tan(np.deg2rad(5))
+    # Include only the neighbors up to the diagonal neighbors
+    group, group_layouts = layout.generate_coordinate_layout(
+        x, y, z, min_tracker_spacing, max_distance=12, tolerance=1e-6)
+    # Interior collectors are in the same group and all nine other are unique
+    assert len(np.unique(group[[6, 7, 8, 11, 12, 13, 16, 17, 18]])) == 1
+    assert len(group_layouts) == 9
+    td, ra, rs = group_layouts[group[12]]
+    order = np.lexsort((ra, td))
+    order_exp = np.lexsort((relative_azimuth, tracker_distance))
+    np.testing.assert_allclose(td[order], tracker_distance[order_exp])
+    np.testing.assert_allclose(ra[order], relative_azimuth[order_exp])
+    np.testing.assert_allclose(rs[order], relative_slope[order_exp], atol=1e-4)
+
+
+def test_coordinate_layout_too_close(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    with pytest.raises(ValueError, match="closer to each other"):
+        layout.generate_coordinate_layout(
+            [0, 4, 20], [0, 0, 0], 0, min_tracker_spacing, max_distance=50)
+    # Collectors that are exactly min_tracker_spacing apart are allowed
+    group, group_layouts = layout.generate_coordinate_layout(
+        [0, min_tracker_spacing], [0, 0], 0, min_tracker_spacing, max_distance=50)
+    assert len(group_layouts) == 2
+
+
+def test_coordinate_layout_missing_scipy(rectangular_geometry, monkeypatch):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    monkeypatch.setitem(sys.modules, 'scipy.spatial', None)
+    with pytest.raises(ImportError, match="scipy is required"):
+        layout.generate_coordinate_layout([0, 10], [0, 0], 0, min_tracker_spacing, 50)
+
+
+def test_field_layout_derivatives():
+    parameters = dict(gcr=0.3, total_collector_area=8, aspect_ratio=1.3, offset=0.2,
+                      rotation=17)
+    dX, dY = layout._field_layout_derivatives(2, **parameters)
+    assert dX.shape == dY.shape == (4, 24)
+    step = 1e-6
+    for k, name in enumerate(['gcr', 'aspect_ratio', 'offset', 'rotation']):
+        upper, lower = [layout.generate_field_layout(
+            min_tracker_spacing=4.5, neighbor_order=2,
+            **{**parameters, name: parameters[name] + sign*step}) for sign in (1, -1)]
+        np.testing.assert_allclose(dX[k], (upper[0] - lower[0]) / (2*step), atol=1e-8)
+        np.testing.assert_allclose(dY[k], (upper[1] - lower[1]) / (2*step), atol=1e-8)
@@ -1,7 +1,9 @@
 import matplotlib.pyplot as plt
+from matplotlib import animation
 from twoaxistracking import plotting, trackerfield
 from .conftest import assert_isinstance
 import numpy as np
+import pytest
 from shapely import geometry
 
 
@@ -54,3 +56,15 @@ def test_plotting_of_field_layout(rectangular_geometry):
     result = field.plot_field_layout()
     assert_isinstance(result, plt.Figure)
     plt.close('all')
+
+
+@pytest.mark.parametrize('available, filename, expected', [
+    (['pillow', 'imagemagick', 'ffmpeg'], 'shading.gif', 'imagemagick'),
+    (['pillow', 'ffmpeg'], 'shading.gif', 'ffmpeg'),
+    (['pillow'], 'shading.gif', 'pillow'),
+    (['pillow', 'imagemagick', 'ffmpeg'], 'shading.mp4', 'ffmpeg'),
+])
+def test_default_writer(monkeypatch, available, filename, expected):
+    # Pipe-based writers, which stream the frames, are preferred for gif files
+    monkeypatch.setattr(animation.writers, 'is_available', lambda name: name in available)
+    assert plotting._default_writer(filename) == expected
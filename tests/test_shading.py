@@ -1,7 +1,10 @@
 from twoaxistracking import shading
 import numpy as np
-from shapely import geometry
+import pandas as pd
+from shapely import affinity, geometry
 import shapely
+import matplotlib.pyplot as plt
+import pytest
 
 
 def test_shading(rectangular_geometry, active_geometry_split, square_field_layout):
@@ -235,3 +238,433 @@ def test_return_geometries_normal_case(
     assert geometries['shading_geometries'][0].equals_exact(
         expected_shading_geometries, tolerance=0.00001)
     assert len(geometries['shading_geometries']) == 1
+
+
+def test_screen_neighbors(square_field_layout_sloped):
+    # Test that the vectorized screening finds the same shading candidates as
+    # screening one solar position and one neighbor at a time
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout_sloped
+    min_tracker_spacing = np.sqrt(4**2+2**2)
+    solar_elevation = np.array([3, 10, 5, 20, 40])
+    solar_azimuth = np.array([120, 180, 240, 90, 180])
+    time_index, neighbor_index, xoff, yoff = shading.screen_neighbors(
+        solar_elevation, solar_azimuth, min_tracker_spacing, tracker_distance,
+        relative_azimuth, relative_slope)
+    expected = []
+    for t, (elevation, azimuth) in enumerate(zip(solar_elevation, solar_azimuth)):
+        for n in range(len(tracker_distance)):
+            azimuth_difference = np.deg2rad(azimuth - relative_azimuth[n])
+            x = tracker_distance[n] * np.sin(azimuth_difference)
+            y = - tracker_distance[n] * np.cos(azimuth_difference) * \
+                np.sin(np.deg2rad(elevation - relative_slope[n])) / \
+                np.cos(np.deg2rad(relative_slope[n]))
+            if (np.cos(azimuth_difference) > 0) & (np.sqrt(x**2+y**2) < min_tracker_spacing):
+                expected.append((t, n, x, y))
+    assert len(expected) > 0
+    np.testing.assert_array_equal(time_index, [e[0] for e in expected])
+    np.testing.assert_array_equal(neighbor_index, [e[1] for e in expected])
+    np.testing.assert_allclose(xoff, [e[2] for e in expected])
+    np.testing.assert_allclose(yoff, [e[3] for e in expected])
+
+
+def test_shaded_fraction_timeseries(rectangular_geometry, active_geometry_split,
+                                    square_field_layout_sloped):
+    # Test that the vectorized timeseries calculation is identical to calling
+    # shaded_fraction for each solar position
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout_sloped
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(-5, 30, 200)
+    solar_azimuth = rng.uniform(0, 360, 200)
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=active_geometry_split,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        slope_azimuth=45,
+        slope_tilt=5,
+        max_shading_elevation=25)
+    result = shading._shaded_fraction_timeseries(solar_elevation, solar_azimuth, **kwargs)
+    expected = [shading.shaded_fraction(e, a, **kwargs)
+                for e, a in zip(solar_elevation, solar_azimuth)]
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_shading_below_horizon_profile(rectangular_geometry, square_field_layout):
+    # Test that a horizon profile shades the collector in addition to the slope
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout
+    horizon_profile = pd.Series([20, 0, 0], index=[170, 200, 350])
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        horizon_profile=horizon_profile)
+    # The profile is interpolated linearly and periodically
+    assert shading.shaded_fraction(solar_elevation=19, solar_azimuth=171, **kwargs) == 1
+    assert shading.shaded_fraction(solar_elevation=19, solar_azimuth=180, **kwargs) == 0
+    assert shading.shaded_fraction(solar_elevation=9, solar_azimuth=80, **kwargs) == 1
+    assert shading.shaded_fraction(solar_elevation=11, solar_azimuth=80, **kwargs) < 1
+    # The horizon profile takes precedence over the max_shading_elevation
+    assert shading.shaded_fraction(solar_elevation=19, solar_azimuth=171,
+                                   max_shading_elevation=10, **kwargs) == 1
+
+
+def test_horizon_table(rectangular_geometry, active_geometry_split,
+                       square_field_layout_sloped):
+    horizon_profile = pd.Series([5, 25, 0, 10], index=[-30, 90, 180, 270])
+    horizon_table = shading._horizon_table(45, 5, horizon_profile)
+    azimuth = np.linspace(-360, 720, 1001)
+    expected = np.maximum(shading.horizon_elevation_angle(azimuth, 45, 5),
+                          shading._far_horizon_elevation_angle(azimuth, horizon_profile))
+    np.testing.assert_allclose(shading._lookup_horizon(horizon_table, azimuth), expected,
+                               atol=1e-3)
+    # The classification using the table is identical to the scalar calculation
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout_sloped
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(-5, 30, 200)
+    solar_azimuth = rng.uniform(0, 360, 200)
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=active_geometry_split,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        slope_azimuth=45,
+        slope_tilt=5,
+        max_shading_elevation=25)
+    result = shading._shaded_fraction_timeseries(
+        solar_elevation, solar_azimuth, horizon_table=horizon_table, **kwargs)
+    expected = [shading.shaded_fraction(e, a, horizon_profile=horizon_profile, **kwargs)
+                for e, a in zip(solar_elevation, solar_azimuth)]
+    np.testing.assert_array_equal(result, expected)
+    assert (result == 1).sum() > 50
+    # The shaded fractions are written directly into out
+    out = np.full(200, 0.5)
+    assert shading._shaded_fraction_timeseries(
+        solar_elevation, solar_azimuth, horizon_table=horizon_table, out=out,
+        **kwargs) is out
+    np.testing.assert_array_equal(out, expected)
+
+
+def test_shaded_fraction_timeseries_plot(rectangular_geometry, square_field_layout):
+    # Test that solar positions without shading candidates are also plotted
+    plt.close('all')
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout
+    result = shading._shaded_fraction_timeseries(
+        solar_elevation=[3, 60],
+        solar_azimuth=[120, 180],
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        plot=True)
+    assert result[0] > 0
+    assert result[1] == 0
+    assert len(plt.get_fignums()) == 2
+    plt.close('all')
+
+
+def test_pointing_error_projection():
+    # Test the shadows against a direct projection of points of a misaligned
+    # neighbor onto a misaligned reference collector on flat ground, for which
+    # the offsets of sun-pointing collectors are exact
+    solar_elevation, solar_azimuth = 10, 150
+    tracker_distance = np.array([8, 10])
+    relative_azimuth = np.array([180, 135])
+    relative_slope = np.zeros(2)
+    _, xoff, yoff = shading._shadow_offsets(
+        solar_elevation, solar_azimuth, tracker_distance, relative_azimuth, relative_slope)
+    # The solar position has the shape (n_solar_positions, 1)
+    dx, dy, matrix = shading._pointing_error_projection(
+        np.array([[solar_elevation]]), np.array([[solar_azimuth]]), tracker_distance,
+        relative_azimuth, relative_slope, reference_error=(np.zeros((1, 1)), np.full((1, 1), 2)),
+        neighbor_error=(np.array([[1, -3]]), np.array([[-1, 0.5]])))
+    sun, u_sun, v_sun = shading._sun_pointing_axes(solar_elevation, solar_azimuth)
+    # A rotation around the x-axis of the collector corresponds to a
+    # collector pointing 2 degrees above the sun
+    e, a = np.deg2rad(10), np.deg2rad(150)
+    normal = np.array([np.cos(e + np.deg2rad(2))*np.sin(a),
+                       np.cos(e + np.deg2rad(2))*np.cos(a), np.sin(e + np.deg2rad(2))])
+    u = np.array([-np.cos(a), np.sin(a), 0])
+    v = np.cross(normal, u)
+    for i, (error_x, error_y) in enumerate([(1, -1), (-3, 0.5)]):
+        ra = np.deg2rad(relative_azimuth[i])
+        position = tracker_distance[i] * np.array([np.sin(ra), np.cos(ra), 0])
+        neighbor_normal, neighbor_u, neighbor_v = shading._misaligned_axes(
+            sun, u_sun, v_sun, error_x, error_y)
+        for point in [(0, 0), (1.5, 0), (0, 1), (-2, 0.7)]:
+            point_3d = position + point[0]*neighbor_u + point[1]*neighbor_v
+            projected = point_3d - point_3d.dot(normal) / sun.dot(normal) * sun
+            shadow = np.array([xoff[0, i] + dx[0, i], yoff[0, i] + dy[0, i]]) \
+                + matrix[:, :, 0, i] @ point
+            np.testing.assert_allclose(shadow, [projected.dot(u), projected.dot(v)],
+                                       atol=1e-12)
+    # Without pointing errors, the shadows are translations by the offsets
+    zero = (np.zeros((1, 1)), np.zeros((1, 1)))
+    dx, dy, matrix = shading._pointing_error_projection(
+        np.array([[solar_elevation]]), np.array([[solar_azimuth]]), tracker_distance,
+        relative_azimuth, relative_slope, reference_error=zero, neighbor_error=zero)
+    np.testing.assert_allclose(dx, 0, atol=1e-12)
+    np.testing.assert_allclose(dy, 0, atol=1e-12)
+    np.testing.assert_allclose(matrix[..., 0, 0], np.eye(2), atol=1e-12)
+
+
+def test_transform_geometries(rectangular_geometry):
+    collector_geometry, _ = rectangular_geometry
+    matrix = np.array([[[1, 0.9], [0.1, 0]], [[0.2, 1], [1.1, 1]]])
+    result = shading._transform_geometries(collector_geometry, matrix, [1, -2], [0.5, 3])
+    for i in range(2):
+        expected = affinity.affine_transform(
+            collector_geometry, [*matrix[0, :, i], *matrix[1, :, i], [1, -2][i], [0.5, 3][i]])
+        assert result[i].equals(expected)
+
+
+def test_iter_shading_geometries(rectangular_geometry, active_geometry_split,
+                                 square_field_layout_sloped):
+    # Test that the geometries are identical to those of shaded_fraction
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout_sloped
+    solar_elevation = [-5, 2, 10, 20, 40]
+    solar_azimuth = [0, 0, 160, 200, 180]
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=active_geometry_split,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        slope_azimuth=180,
+        slope_tilt=10,
+        max_shading_elevation=30)
+    results = shading._iter_shading_geometries(solar_elevation, solar_azimuth, **kwargs)
+    for e, a, (shaded_fraction, unshaded_geometry, shading_geometries) in zip(
+            solar_elevation, solar_azimuth, results):
+        expected, geometries = shading.shaded_fraction(e, a, return_geometries=True,
+                                                       **kwargs)
+        np.testing.assert_equal(shaded_fraction, expected)
+        assert unshaded_geometry.equals(geometries['unshaded_geometry'])
+        assert shapely.equals(shading_geometries, geometries['shading_geometries']).all()
+
+
+def test_shading_geometry_arrays(rectangular_geometry, active_geometry_split,
+                                 square_field_layout_sloped):
+    # Test that the geometries are identical to those of shaded_fraction
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout_sloped
+    solar_elevation = [-5, 2, 10, 20, 40, 15]
+    solar_azimuth = [0, 0, 160, 200, 180, 90]
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=active_geometry_split,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        slope_azimuth=180,
+        slope_tilt=10,
+        max_shading_elevation=30)
+    shaded_fractions, unshaded_geometries, shading_geometries = \
+        shading._shading_geometry_arrays(solar_elevation, solar_azimuth, **kwargs)
+    for i, (e, a) in enumerate(zip(solar_elevation, solar_azimuth)):
+        expected, geometries = shading.shaded_fraction(e, a, return_geometries=True,
+                                                       **kwargs)
+        np.testing.assert_equal(shaded_fractions[i], expected)
+        assert unshaded_geometries[i].equals(geometries['unshaded_geometry'])
+        assert shading_geometries[i].geom_type == 'MultiPolygon'
+        assert list(shading_geometries[i].geoms) == geometries['shading_geometries']
+
+
+def test_encode_geometries():
+    geometries = np.array([geometry.box(0, 0, 1, 1), geometry.Polygon(),
+                           geometry.MultiPolygon([geometry.box(0, 0, 1, 1),
+                                                  geometry.box(2, 0, 3, 1)])])
+    assert shading._encode_geometries(geometries, 'shapely') is geometries
+    buffer, offsets = shading._encode_geometries(geometries, 'wkb')
+    assert buffer.dtype == np.uint8
+    assert offsets[-1] == len(buffer)
+    decoded = [shapely.from_wkb(buffer[i:j].tobytes()) for i, j in zip(offsets, offsets[1:])]
+    assert shapely.equals(decoded, geometries).all()
+    geometry_type, coordinates, ragged_offsets = \
+        shading._encode_geometries(geometries, 'geoarrow')
+    assert shapely.equals(shapely.from_ragged_array(
+        geometry_type, coordinates, ragged_offsets), geometries).all()
+    with pytest.raises(ValueError, match='output_format must be one of'):
+        shading._encode_geometries(geometries, 'geojson')
+
+
+def test_overlap_area_table(rectangular_geometry, active_geometry_split):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    overlap_areas, cell_size = shading._overlap_area_table(
+        collector_geometry, active_geometry_split, min_tracker_spacing, resolution=128)
+    assert overlap_areas.shape == (255, 255)
+    rng = np.random.default_rng(42)
+    xoff, yoff = rng.uniform(-1.2, 1.2, (2, 500)) * min_tracker_spacing
+    result = shading._interpolate_overlap_area(
+        overlap_areas, cell_size, min_tracker_spacing, xoff, yoff)
+    expected = shapely.area(shapely.intersection(
+        active_geometry_split, shading._translate_geometries(collector_geometry, xoff, yoff)))
+    np.testing.assert_allclose(result, expected, atol=0.01*active_geometry_split.area)
+    # No overlap outside the table
+    assert np.all(result[np.hypot(xoff, yoff) > min_tracker_spacing] == 0)
+
+
+def test_shaded_fraction_timeseries_overlap_table(rectangular_geometry, active_geometry_split,
+                                                  square_field_layout):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(-5, 30, 200)
+    solar_azimuth = rng.uniform(0, 360, 200)
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=active_geometry_split,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope)
+    overlap_table = shading._overlap_area_table(
+        collector_geometry, active_geometry_split, min_tracker_spacing)
+    result = shading._shaded_fraction_timeseries(
+        solar_elevation, solar_azimuth, engine='overlap_table', engine_state=overlap_table,
+        **kwargs)
+    # The table is calculated if not specified
+    np.testing.assert_array_equal(result, shading._shaded_fraction_timeseries(
+        solar_elevation, solar_azimuth, engine='overlap_table', **kwargs))
+    expected = shading._shaded_fraction_timeseries(solar_elevation, solar_azimuth, **kwargs)
+    np.testing.assert_allclose(result, expected, atol=0.005)
+    # Solar positions with overlapping shadows are calculated exactly
+    time_index, _, xoff, yoff = shading.screen_neighbors(
+        solar_elevation, solar_azimuth, min_tracker_spacing, tracker_distance,
+        relative_azimuth, relative_slope)
+    overlapping = shading._overlapping_shadows(
+        time_index, xoff, yoff, min_tracker_spacing, len(solar_elevation))
+    multiple = np.bincount(time_index, minlength=len(solar_elevation)) > 1
+    assert np.any(multiple & ~overlapping) and np.any(result != expected)
+    np.testing.assert_array_equal(result[overlapping], expected[overlapping])
+
+
+def test_coherent_rows():
+    row_index = np.array([0, 0, 1, 1, 2, 2, 3, 3, 4, 5])
+    neighbor_index = np.array([1, 2, 1, 2, 1, 2, 1, 2, 1, 3])
+    # The candidates move by 0.004 between the first four rows
+    xoff = np.array([0, 1, 0.004, 1.004, 0.008, 1.008, 0.012, 1.012, 0, 0])
+    yoff = np.zeros(10)
+    is_anchor, group_index = shading._coherent_rows(
+        row_index, neighbor_index, xoff, yoff, 6, offset_tolerance=0.01)
+    # New groups start when the cumulative displacement exceeds the tolerance
+    # and when the candidates change
+    np.testing.assert_array_equal(is_anchor, [True, False, False, True, True, True])
+    np.testing.assert_array_equal(group_index, [0, 0, 0, 1, 2, 3])
+    is_anchor, group_index = shading._coherent_rows(
+        row_index, neighbor_index, xoff, yoff, 6, offset_tolerance=0.001)
+    assert np.all(is_anchor)
+
+
+@pytest.mark.parametrize('max_elements', [2**24, 100])
+def test_rectangle_engine(rectangular_geometry, active_geometry_split, square_field_layout,
+                          max_elements):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout
+    rng = np.random.default_rng(42)
+    time_index, _, xoff, yoff = shading.screen_neighbors(
+        rng.uniform(0, 30, 500), rng.uniform(0, 360, 500), min_tracker_spacing,
+        tracker_distance, relative_azimuth, relative_slope)
+    # Rows without candidates are handled before calling the engine
+    row_index = np.unique(time_index, return_inverse=True)[1]
+    n_rows = row_index.max() + 1
+    for active_geometry in [collector_geometry, active_geometry_split]:
+        expected = shading._exact_engine(collector_geometry, active_geometry,
+                                         min_tracker_spacing, row_index, xoff, yoff, n_rows)
+        result = shading._rectangle_engine(collector_geometry, active_geometry,
+                                           min_tracker_spacing, row_index, xoff, yoff, n_rows,
+                                           max_elements=max_elements)
+        np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+
+
+def test_supports_rectangles(rectangular_geometry, circular_geometry, active_geometry_split):
+    collector_geometry, _ = rectangular_geometry
+    assert shading._supports_rectangles(collector_geometry, active_geometry_split)
+    assert not shading._supports_rectangles(circular_geometry[0], circular_geometry[0])
+    rotated = affinity.rotate(collector_geometry, 10)
+    assert not shading._supports_rectangles(rotated, rotated.buffer(-0.1))
+    overlapping = geometry.MultiPolygon([geometry.box(-1, -0.5, 0.5, 0.5),
+                                         geometry.box(0, -0.5, 1, 0.5)])
+    assert not shading._supports_rectangles(collector_geometry, overlapping)
+
+
+def test_select_shading_engine(rectangular_geometry, circular_geometry, monkeypatch):
+    collector_geometry, _ = rectangular_geometry
+    assert shading.select_shading_engine(collector_geometry, collector_geometry) == 'rectangle'
+    assert shading.select_shading_engine(*[circular_geometry[0]]*2) == 'exact'
+    # Engines are only selected if the requirements are met
+    monkeypatch.setattr(shading, 'SHADING_ENGINES', dict(shading.SHADING_ENGINES))
+    shading.register_shading_engine('fast', shading._exact_engine, priority=2,
+                                    min_solar_positions=1000)
+    shading.register_shading_engine('faster', shading._exact_engine, priority=3,
+                                    requires=['not_an_installed_package'])
+    assert shading.select_shading_engine(collector_geometry, collector_geometry, 10) \
+        == 'rectangle'
+    assert shading.select_shading_engine(collector_geometry, collector_geometry, 1000) \
+        == 'fast'
+    assert shading.select_shading_engine(collector_geometry, collector_geometry) == 'fast'
+    with pytest.raises(ImportError, match='requires not_an_installed_package'):
+        shading.check_shading_engine('faster', collector_geometry, collector_geometry)
+    with pytest.raises(ValueError, match='does not support the collector geometry'):
+        shading.check_shading_engine('rectangle', *[circular_geometry[0]]*2)
+    with pytest.raises(ValueError, match='engine must be one of'):
+        shading.check_shading_engine('fastest', collector_geometry, collector_geometry)
+
+
+def test_shaded_fraction_tracker_angles(rectangular_geometry, active_geometry_split,
+                                        square_field_layout_sloped):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    X, Y, Z, tracker_distance, relative_azimuth, relative_slope = \
+        square_field_layout_sloped
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(-5, 30, 200)
+    solar_azimuth = rng.uniform(0, 360, 200)
+    kwargs = dict(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=active_geometry_split,
+        min_tracker_spacing=min_tracker_spacing,
+        tracker_distance=tracker_distance,
+        relative_azimuth=relative_azimuth,
+        relative_slope=relative_slope,
+        slope_azimuth=45,
+        slope_tilt=5)
+    # Sun-pointing collectors give the same result as shaded_fraction
+    result, cos_incidence = shading._shaded_fraction_tracker_angles(
+        solar_elevation, solar_azimuth, solar_elevation, solar_azimuth, **kwargs)
+    expected = shading._shaded_fraction_timeseries(solar_elevation, solar_azimuth, **kwargs)
+    np.testing.assert_allclose(result, expected, atol=1e-12)
+    np.testing.assert_allclose(cos_incidence, 1)
+    # Horizontal collectors (e.g., stowed) with the sun behind a neighbor
+    result, cos_incidence = shading._shaded_fraction_tracker_angles(
+        [10, 10, 10], 180, 90, [0, 180, 180],
+        **dict(kwargs, slope_tilt=0, relative_slope=np.full_like(relative_slope, 8)))
+    np.testing.assert_allclose(cos_incidence, np.sin(np.deg2rad(10)))
+    assert np.isclose(result[0], result[1]) and 0 < result[0] < 1
+    # Collectors facing away from the sun receive no direct irradiance
+    result, cos_incidence = shading._shaded_fraction_tracker_angles(
+        10, 180, 10, 0, **kwargs)
+    assert result[0] == 1 and cos_incidence[0] < 0
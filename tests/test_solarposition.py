@@ -0,0 +1,36 @@
+from twoaxistracking import solarposition
+import numpy as np
+import pandas as pd
+
+
+def test_solar_position():
+    # Reference values calculated using the NREL solar position algorithm
+    times = pd.DatetimeIndex(['2020-03-20 12:00', '2021-06-21 06:30', '1990-12-01 16:00',
+                              '2045-09-10 23:00'], tz='Etc/GMT-1')
+    expected = {
+        (55.7, 12.5): [[34.329, 174.747], [21.731, 79.834], [-2.725, 233.788],
+                       [-28.245, 341.052]],
+        (-1, 36.8): [[70.012, 273.096], [25.863, 63.23], [5.584, 248.17],
+                     [-81.616, 65.116]],
+    }
+    for (latitude, longitude), values in expected.items():
+        result = solarposition.solar_position(times, latitude, longitude)
+        assert list(result.columns) == ['solar_elevation', 'solar_azimuth']
+        pd.testing.assert_index_equal(result.index, times)
+        # The accuracy is only specified for the sun above the horizon
+        values = np.array(values)
+        above_horizon = values[:, 0] > 0
+        np.testing.assert_allclose(result.values[above_horizon], values[above_horizon],
+                                   atol=0.02)
+        np.testing.assert_allclose(result.values[~above_horizon], values[~above_horizon],
+                                   atol=0.2)
+    # Timezone-naive timestamps are assumed to be in UTC
+    result = solarposition.solar_position(times.tz_convert(None), 55.7, 12.5)
+    np.testing.assert_allclose(result.values[:2], expected[(55.7, 12.5)][:2], atol=0.02)
+
+
+def test_atmospheric_refraction():
+    result = solarposition._atmospheric_refraction(np.array([90, 45, 0, -5]))
+    expected = [0, (58.1 - 0.07 + 0.000086) / 3600, 1735 / 3600,
+                -20.772 / np.tan(np.deg2rad(-5)) / 3600]
+    np.testing.assert_allclose(result, expected)
@@ -0,0 +1,87 @@
+from twoaxistracking import sparse
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def dense_series():
+    rng = np.random.default_rng(42)
+
+    def make():
+        index = pd.date_range('2023-06-21', periods=2000, freq='7min')
+        values = np.where(rng.uniform(size=2000) < 0.2, rng.uniform(size=2000), 0)
+        values[rng.uniform(size=2000) < 0.1] = np.nan
+        values[300:700] = np.nan
+        return pd.Series(values, index=index)
+    return make(), make()
+
+
+def test_from_dense(dense_series):
+    a, _ = dense_series
+    result = sparse.SparseShadedFraction.from_dense(a)
+    pd.testing.assert_series_equal(result.to_series(), a)
+    assert len(result) == 2000
+    assert len(result.values) == ((a != 0) & a.notna()).sum()
+    assert result.count_nan() == a.isna().sum()
+    assert result.nbytes < a.to_numpy().nbytes
+    assert repr(result) == \
+        f'SparseShadedFraction(length=2000, nonzero={len(result.values)}, nan={a.isna().sum()})'
+    np.testing.assert_allclose(result.sum(), a.sum())
+    np.testing.assert_allclose(result.mean(), a.mean())
+    assert np.isnan(sparse.SparseShadedFraction.from_dense([np.nan]).mean())
+    # Without index
+    result = sparse.SparseShadedFraction.from_dense(a.to_numpy())
+    np.testing.assert_array_equal(result.to_numpy(), a.to_numpy())
+    assert result.index is None
+    with pytest.raises(ValueError, match='length of the index'):
+        sparse.SparseShadedFraction.from_dense(a, index=a.index[:10])
+    with pytest.raises(ValueError, match='length of the index'):
+        result.index = a.index[:10]
+    result.index = a.index
+    pd.testing.assert_series_equal(result.to_series(), a)
+
+
+def test_arithmetic(dense_series):
+    a, b = dense_series
+    sa, sb = [sparse.SparseShadedFraction.from_dense(x) for x in (a, b)]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cases = [(sa + sb, a + b), (sa - sb, a - b), (sa * sb, a * b), (sa / sb, a / b),
+                 (sa - sa, a - a), (2 * sa, 2 * a), (sa * 2, a * 2), (sa / 0, a / 0),
+                 (sa + 0, a), (1 - sa, 1 - a), (sa - 1, a - 1), (-sa, -a),
+                 (0.5 + sa, 0.5 + a), (sa * b.to_numpy(), a * b.to_numpy()),
+                 (2 / sa, 2 / a)]
+    for result, expected in cases:
+        pd.testing.assert_series_equal(result.to_series(), expected)
+    # Sparse operations stay sparse
+    assert len((sa * sb).values) <= min(len(sa.values), len(sb.values))
+    # Undefined operations result in nan values
+    infinite = sparse.SparseShadedFraction.from_dense([np.inf, 1, 0])
+    np.testing.assert_array_equal((infinite - infinite).to_numpy(), [np.nan, 0, 0])
+    with pytest.raises(ValueError, match='same length'):
+        sa + sparse.SparseShadedFraction.from_dense(b[:10])
+
+
+def test_resample(dense_series):
+    a, _ = dense_series
+    result = sparse.SparseShadedFraction.from_dense(a)
+    for freq in ['h', '15min', 'D']:
+        pd.testing.assert_series_equal(result.resample(freq), a.resample(freq).mean())
+    with pytest.raises(ValueError, match='DatetimeIndex'):
+        sparse.SparseShadedFraction.from_dense(a.to_numpy()).resample('h')
+    with pytest.raises(ValueError, match='sorted index'):
+        sparse.SparseShadedFraction.from_dense(a[::-1]).resample('h')
+
+
+def test_concat(dense_series):
+    a, _ = dense_series
+    parts = [sparse.SparseShadedFraction.from_dense(a[start:stop])
+             for start, stop in [(0, 500), (500, 1234), (1234, 2000)]]
+    result = sparse.SparseShadedFraction.concat(parts)
+    pd.testing.assert_series_equal(result.to_series(), a)
+    # Runs spanning the boundaries are merged
+    expected = sparse.SparseShadedFraction.from_dense(a)
+    np.testing.assert_array_equal(result.run_starts, expected.run_starts)
+    np.testing.assert_array_equal(result.nan_starts, expected.nan_starts)
+    parts[1].index = None
+    assert sparse.SparseShadedFraction.concat(parts).index is None
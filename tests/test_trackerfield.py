@@ -1,7 +1,10 @@
-from twoaxistracking import trackerfield
+from twoaxistracking import trackerfield, layout, shading, solarposition, sparse
+from shapely import geometry
+import shapely
 import numpy as np
 import pandas as pd
 import pytest
+import matplotlib.pyplot as plt
 
 
 def test_invalid_layout_type(rectangular_geometry):
@@ -210,3 +213,870 @@ def test_total_collector_geometry_encloses_active_areas(rectangular_geometry, ci
             aspect_ratio=1,
             offset=0,
             rotation=0)
+
+
+@pytest.fixture
+def square_field(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=2,
+        gcr=0.25,
+        layout_type='square')
+    return field
+
+
+def assert_same_layout(field, expected_field):
+    for name in ['X', 'Y', 'Z', 'tracker_distance', 'relative_azimuth', 'relative_slope']:
+        np.testing.assert_allclose(getattr(field, name), getattr(expected_field, name),
+                                   atol=1e-12)
+    np.testing.assert_allclose(field.max_shading_elevation, expected_field.max_shading_elevation)
+
+
+def test_modify_layout_parameters(square_field, rectangular_geometry):
+    # Test that modifying the layout parameters gives the same layout as
+    # creating a new TrackerField
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    square_field.gcr = 0.3
+    square_field.rotation = 20
+    square_field.slope_tilt = 5
+    square_field.slope_azimuth = 30
+    square_field.neighbor_order = 1
+    expected_field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.3,
+        aspect_ratio=1,
+        offset=0,
+        rotation=20,
+        slope_azimuth=30,
+        slope_tilt=5)
+    assert_same_layout(square_field, expected_field)
+    # The layout is no longer a standard layout after changing the rotation
+    assert square_field.layout_type is None
+
+
+def test_modify_gcr_only_rescales_layout(square_field):
+    # Test that only quantities depending on the gcr are recalculated
+    relative_azimuth = square_field.relative_azimuth
+    relative_slope = square_field.relative_slope
+    X = square_field.X
+    square_field.gcr = 0.125
+    assert square_field.relative_azimuth is relative_azimuth
+    assert square_field.relative_slope is relative_slope
+    np.testing.assert_allclose(square_field.X, X * np.sqrt(2))
+    assert square_field.layout_type == 'square'
+
+
+def test_modify_slope_keeps_neighbor_positions(square_field):
+    X = square_field.X
+    max_shading_elevation = square_field.max_shading_elevation
+    square_field.slope_tilt = 10
+    assert square_field.X is X
+    assert square_field.max_shading_elevation != max_shading_elevation
+    assert square_field.slope_tilt == 10
+
+
+def test_update_layout_layout_type(square_field, rectangular_geometry):
+    # Test that several parameters can be changed simultaneously
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    square_field.update_layout(gcr=0.2, layout_type='hexagonal_n_s')
+    expected_field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=2,
+        gcr=0.2,
+        layout_type='hexagonal_n_s')
+    assert_same_layout(square_field, expected_field)
+    assert square_field.layout_type == 'hexagonal_n_s'
+
+
+def test_update_layout_infeasible(square_field):
+    # Test that an infeasible modification raises an error and leaves the
+    # layout unchanged
+    X = square_field.X
+    with pytest.raises(ValueError, match="Maximum ground cover ratio exceeded"):
+        square_field.gcr = 0.5
+    assert square_field.gcr == 0.25
+    assert square_field.X is X
+
+
+def test_update_layout_invalid_parameter(square_field):
+    with pytest.raises(TypeError, match="Invalid layout parameters"):
+        square_field.update_layout(min_tracker_spacing=10)
+
+
+def test_calculation_of_shaded_fraction_plot(rectangular_geometry, solar_position,
+                                             expected_shaded_fraction):
+    # Test that plotting does not affect the calculated shaded fraction
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.25,
+        aspect_ratio=1,
+        offset=0,
+        rotation=170)
+    solar_elevation, solar_azimuth = solar_position
+    result = field.get_shaded_fraction(solar_elevation, solar_azimuth, plot=True)
+    np.testing.assert_allclose(result, expected_shaded_fraction)
+    plt.close('all')
+
+
+@pytest.fixture
+def planar_terrain():
+    # Planar terrain with slope_azimuth=45 and slope_tilt=5
+    rows, cols = np.mgrid[0:60, 0:50]
+    x, y = cols + 0.5, -(rows + 0.5)
+    return -(x + y) * np.sin(np.deg2rad(45)) * np.tan(np.deg2rad(5))
+
+
+def test_tracker_shaded_fraction_terrain(rectangular_geometry, planar_terrain):
+    # Test that collectors with all neighbors on a planar terrain have the same
+    # shaded fraction as a field on a slope
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.125,
+        layout_type='square',
+        slope_azimuth=45,
+        slope_tilt=5)
+    field.set_terrain(planar_terrain, cell_size=1, slope_tolerance=0.1)
+    solar_elevation = pd.Series([-1, 3, 5, 10, 40], index=range(10, 15))
+    solar_azimuth = pd.Series([90, 120, 180, 200, 180], index=range(10, 15))
+    result = field.get_tracker_shaded_fraction(solar_elevation, solar_azimuth)
+    expected = field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert (result.columns == np.unique(field.trackers['group'])).all()
+    pd.testing.assert_index_equal(result.index, solar_elevation.index)
+    interior_groups = [g for g in result.columns
+                       if len(field._tracker_groups()[1][g][0]) == len(field.X)]
+    assert len(interior_groups) == 1
+    pd.testing.assert_series_equal(result[interior_groups[0]], expected,
+                                   check_names=False)
+    # Edge collectors have fewer neighbors and thereby less shading
+    assert (result.fillna(0) <= expected.fillna(0).values[:, np.newaxis] + 1e-9).all().all()
+
+    per_tracker = field.get_tracker_shaded_fraction(
+        solar_elevation, solar_azimuth, per_tracker=True)
+    assert per_tracker.shape == (5, len(field.trackers))
+    np.testing.assert_array_equal(per_tracker.values,
+                                  result[field.trackers['group']].values)
+
+
+def test_tracker_groups_invalidation(rectangular_geometry, planar_terrain):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.125,
+        layout_type='square')
+    with pytest.raises(ValueError, match="terrain needs to be specified"):
+        _ = field.trackers
+    field.set_terrain(planar_terrain, cell_size=1)
+    trackers = field.trackers
+    field.slope_tilt = 5
+    assert field.trackers is trackers
+    field.gcr = 0.25
+    assert len(field.trackers) > len(trackers)
+
+
+def test_tracker_shaded_fraction_isolated_collector(rectangular_geometry):
+    # Test that a collector without neighbors is not shaded
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.125,
+        layout_type='square')
+    field.set_terrain(np.zeros((4, 4)), cell_size=1)
+    assert len(field.trackers) == 1
+    result = field.get_tracker_shaded_fraction([-1, 1, 10], [180, 180, 180])
+    np.testing.assert_array_equal(result[0], [np.nan, 0, 0])
+
+
+def test_tracker_shaded_fraction_coordinates(rectangular_geometry):
+    # Test that the interior collector of a regular field defined by its
+    # coordinates has the same shaded fraction as a regular TrackerField
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.125,
+        layout_type='square')
+    x, y = np.meshgrid([-8, 0, 8], [-8, 0, 8])
+    # Remove one of the corner collectors (e.g., a road)
+    x, y = x.ravel()[1:], y.ravel()[1:]
+    coordinate_field = trackerfield.TrackerField.from_coordinates(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        x=x, y=y, min_solar_elevation=20)
+    assert coordinate_field.gcr is None
+    assert len(coordinate_field.trackers) == 8
+    solar_elevation = np.array([-1, 3, 5, 10, 3])
+    solar_azimuth = np.array([90, 120, 180, 200, 225])
+    result = coordinate_field.get_tracker_shaded_fraction(
+        solar_elevation, solar_azimuth, per_tracker=True)
+    # The center collector (index 3) only differs when the missing south-west
+    # collector is in the direction of the sun
+    expected = field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    np.testing.assert_allclose(result[3][:4], expected[:4])
+    assert result[3][4] < expected[4]
+    # The groups are calculated in chunks to limit the memory usage
+    pd.testing.assert_frame_equal(coordinate_field.get_tracker_shaded_fraction(
+        solar_elevation, solar_azimuth, per_tracker=True, max_elements=20), result)
+
+
+def test_from_coordinates_initialization(rectangular_geometry, square_field):
+    collector_geometry, _ = rectangular_geometry
+    field = trackerfield.TrackerField.from_coordinates(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        x=[0, 10], y=[0, 0])
+    # Both constructors initialize the same attributes
+    assert set(vars(field)) == set(vars(square_field))
+
+
+def test_coordinate_field_regular_layout_unavailable(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField.from_coordinates(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        x=[0, 10], y=[0, 0])
+    with pytest.raises(ValueError, match="layout is not regular"):
+        _ = field.X
+    with pytest.raises(ValueError, match="layout is not regular"):
+        field.gcr = 0.2
+    with pytest.raises(ValueError, match="layout is not regular"):
+        field.set_terrain(np.zeros((10, 10)), cell_size=1)
+    # The slope used for the horizon can be modified
+    field.slope_tilt = 5
+    assert field.slope_tilt == 5
+
+
+def test_shaded_fraction_uncertainty(rectangular_geometry, solar_position,
+                                     expected_shaded_fraction, expected_datetime_index):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.25,
+        aspect_ratio=1,
+        offset=0,
+        rotation=170)
+    solar_elevation, solar_azimuth = solar_position
+    solar_elevation = pd.Series(solar_elevation, index=expected_datetime_index)
+    # Without errors, all quantiles equal the deterministic shaded fraction
+    result = field.get_shaded_fraction_uncertainty(
+        solar_elevation, solar_azimuth, n_realizations=3)
+    assert list(result.columns) == [0.05, 0.5, 0.95]
+    pd.testing.assert_index_equal(result.index, expected_datetime_index)
+    for quantile in result.columns:
+        np.testing.assert_allclose(result[quantile], expected_shaded_fraction)
+
+    result = field.get_shaded_fraction_uncertainty(
+        solar_elevation, solar_azimuth, pointing_error=1, position_error=0.1,
+        n_realizations=200, quantiles=[0, 0.5, 1], seed=42)
+    np.testing.assert_allclose(result[0.5], expected_shaded_fraction, atol=0.03)
+    # The shaded fraction varies between realizations when partially shaded
+    assert (result[1][2:4] - result[0][2:4] > 0.01).all()
+    # Below the horizon and sloped horizon, the errors have no effect
+    assert result.iloc[0].isna().all()
+    assert (result.iloc[1] == 1).all()
+
+
+def test_shaded_fraction_uncertainty_distribution(rectangular_geometry):
+    # Test that distributions can be specified as scipy.stats distributions
+    stats = pytest.importorskip('scipy.stats')
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        neighbor_order=1,
+        gcr=0.25,
+        layout_type='square')
+    kwargs = dict(solar_elevation=[2, 5], solar_azimuth=[120, 180], n_realizations=100,
+                  quantiles=[0, 1], seed=1)
+    result = field.get_shaded_fraction_uncertainty(
+        pointing_error=stats.uniform(loc=-0.5, scale=1), **kwargs)
+    wider = field.get_shaded_fraction_uncertainty(
+        pointing_error=stats.uniform(loc=-2, scale=4), **kwargs)
+    assert ((wider[1] - wider[0]) > (result[1] - result[0])).all()
+
+
+def test_ground_sample_points(square_field):
+    x, y = square_field.get_ground_sample_points(resolution=4)
+    assert x.shape == y.shape == (4, 4)
+    # The sample points are centered on the reference collector and span the unit cell
+    spacing = np.sqrt(8 / 0.25)
+    np.testing.assert_allclose(x[:, 0], spacing * np.array([-3, -1, 1, 3]) / 8)
+    np.testing.assert_allclose(y[0], spacing * np.array([-3, -1, 1, 3]) / 8)
+
+
+def test_ground_shaded_fraction(square_field, rectangular_geometry):
+    # With the sun in zenith the shaded ground fraction equals the ground cover ratio
+    assert square_field.get_ground_shaded_fraction(90, 0, pivot_height=2, resolution=40) \
+        == pytest.approx(0.25, abs=0.01)
+    # The ground is unshaded when the sun is below the horizon, and fully shaded
+    # below the slope horizon
+    square_field.update_layout(slope_azimuth=0, slope_tilt=10)
+    result = square_field.get_ground_shaded_fraction(
+        np.array([-1, 5]), np.array([180, 180]), pivot_height=2)
+    np.testing.assert_array_equal(result, [np.nan, 1])
+    # Long shadows are accounted for using the periodicity of the layout
+    solar_elevation = pd.Series([60, 30, 10, 3], index=pd.date_range('2023-06-01', periods=4))
+    solar_azimuth = [200, 90, 270, 45]
+    fractions = []
+    for neighbor_order in [1, 3]:
+        collector_geometry, min_tracker_spacing = rectangular_geometry
+        field = trackerfield.TrackerField(
+            total_collector_geometry=collector_geometry,
+            active_collector_geometry=collector_geometry,
+            neighbor_order=neighbor_order,
+            gcr=0.25,
+            layout_type='square',
+            slope_azimuth=30,
+            slope_tilt=5)
+        fractions.append(field.get_ground_shaded_fraction(
+            solar_elevation, solar_azimuth, pivot_height=3, resolution=10))
+    pd.testing.assert_series_equal(fractions[0], fractions[1])
+    assert (fractions[0].diff().iloc[1:] > 0).all()
+    result = field.get_ground_shaded_fraction([90], [0], pivot_height=3)
+    assert isinstance(result, list)
+    assert result[0] == pytest.approx(0.25, abs=0.05)
+
+
+def test_ground_shade_maps(square_field):
+    index = pd.date_range('2023-06-01', periods=72, freq='h', tz='UTC')
+    solar_elevation = pd.Series(np.tile(np.r_[-10, -5, 30, 60, 90, 60], 12), index=index)
+    solar_elevation['2023-06-03'] = -10
+    solar_azimuth = pd.Series(np.tile(np.r_[0, 0, 90, 135, 180, 225], 12), index=index)
+    maps = list(square_field.iter_ground_shade_maps(
+        solar_elevation, solar_azimuth, pivot_height=2, resolution=10))
+    assert [date for date, _ in maps] == list(pd.date_range('2023-06-01', periods=3, tz='UTC'))
+    assert maps[0][1].shape == (10, 10)
+    assert maps[0][1].dtype == np.float32
+    np.testing.assert_array_equal(maps[0][1], maps[1][1])
+    assert np.isnan(maps[2][1]).all()
+    # The daily average equals the average of the time-resolved ground shading
+    expected = square_field.get_ground_shaded_fraction(
+        solar_elevation['2023-06-01'], solar_azimuth['2023-06-01'], pivot_height=2,
+        resolution=10)
+    assert maps[0][1].mean() == pytest.approx(expected.mean())
+    # With weights only the sun in zenith contributes
+    weights = (solar_elevation == 90).astype(float)
+    _, shade_map = next(square_field.iter_ground_shade_maps(
+        solar_elevation, solar_azimuth, pivot_height=2, resolution=10, weights=weights))
+    assert shade_map.mean() == pytest.approx(square_field.get_ground_shaded_fraction(
+        90, 0, pivot_height=2, resolution=10))
+    with pytest.raises(ValueError, match='DatetimeIndex'):
+        next(square_field.iter_ground_shade_maps([30], [180], pivot_height=2))
+
+
+def test_horizon_profile(square_field):
+    solar_elevation = pd.Series([5, 15, 15, 40])
+    solar_azimuth = [180, 180, 270, 180]
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert square_field.horizon_profile is None
+    square_field.horizon_profile = pd.Series([10, 20, 10], index=[0, 180, 270])
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    pd.testing.assert_series_equal(result, pd.Series([1, 1, expected[2], expected[3]]))
+    # The horizon table is updated when the slope is modified
+    square_field.slope_tilt = 45
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert result[3] == 1
+    # The horizon profile is also used for the ground shading and the uncertainty
+    assert square_field.get_ground_shaded_fraction(15, 180, pivot_height=2) == 1
+    result = square_field.get_shaded_fraction_uncertainty(
+        solar_elevation, solar_azimuth, n_realizations=2, quantiles=[0.5])
+    assert (result[0.5][[0, 1, 3]] == 1).all()
+    square_field.update_layout(slope_tilt=0)
+    square_field.horizon_profile = None
+    pd.testing.assert_series_equal(
+        square_field.get_shaded_fraction(solar_elevation, solar_azimuth), expected)
+
+
+def test_horizon_profile_coordinates(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    horizon_profile = pd.Series([30], index=[0])
+    pytest.importorskip('scipy')
+    field = trackerfield.TrackerField.from_coordinates(
+        total_collector_geometry=collector_geometry,
+        active_collector_geometry=collector_geometry,
+        x=[0, 10], y=[0, 0], horizon_profile=horizon_profile)
+    result = field.get_tracker_shaded_fraction([20, 40], [180, 180])
+    np.testing.assert_array_equal(result.values, [[1, 1], [0, 0]])
+
+
+def test_simplify_collector_geometry(rectangular_geometry):
+    collector_geometry, min_tracker_spacing = rectangular_geometry
+    # Active area consisting of cells with rounded corners separated by gaps
+    cells = [geometry.box(x + 0.1, y + 0.1, x + 0.4, y + 0.4).buffer(0.05, quad_segs=16)
+             for x in np.arange(-2, 2, 0.5) for y in np.arange(-1, 1, 0.5)]
+    active_geometry = geometry.MultiPolygon(cells)
+    field = trackerfield.TrackerField(
+        total_collector_geometry=collector_geometry.buffer(0.2, quad_segs=16),
+        active_collector_geometry=active_geometry,
+        neighbor_order=2,
+        gcr=0.25,
+        layout_type='square')
+    solar_elevation, solar_azimuth = np.array([5, 10, 20]), np.array([150, 180, 200])
+    expected = field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    # A dry run reports the area errors without modifying the field
+    preview = field.simplify_collector_geometry(tolerance=0.01, grid_size=1e-3,
+                                                dry_run=True)
+    assert field.active_collector_geometry is active_geometry
+    np.testing.assert_array_equal(field.get_shaded_fraction(solar_elevation, solar_azimuth),
+                                  expected)
+    result = field.simplify_collector_geometry(tolerance=0.01, grid_size=1e-3)
+    assert result['total_area_error'] == preview['total_area_error']
+    assert result['active_area_error'] == preview['active_area_error']
+    assert field.active_collector_geometry.equals(preview['active_collector_geometry'])
+    assert field.total_collector_geometry.equals(result['total_collector_geometry'])
+    assert abs(result['total_area_error']) < 1e-3
+    assert abs(result['active_area_error']) < 1e-2
+    assert result['num_coordinates'][1] < result['num_coordinates'][0] / 4
+    # The cached layout is recalculated using the simplified geometry
+    assert field.min_tracker_spacing == \
+        layout._calculate_min_tracker_spacing(field.total_collector_geometry)
+    np.testing.assert_allclose(field.get_shaded_fraction(solar_elevation, solar_azimuth),
+                               expected, atol=0.01)
+    # Merging the cells considers the gaps between the cells active
+    result = field.simplify_collector_geometry(merge_distance=0.2)
+    assert field.active_collector_geometry.geom_type == 'Polygon'
+    assert field.active_collector_geometry.area == pytest.approx(3.9 * 1.9, rel=0.02)
+    assert result['active_area_error'] == pytest.approx(3.9 * 1.9 / (32 * 0.4**2) - 1, abs=0.02)
+
+
+def test_simplify_collector_geometry_infeasible(square_field):
+    square_field.gcr = 0.399
+    total_collector_geometry = square_field.total_collector_geometry
+    # Snapping the corners outwards makes the layout infeasible
+    with pytest.raises(ValueError, match='Maximum ground cover ratio exceeded'):
+        square_field.simplify_collector_geometry(grid_size=0.3)
+    assert square_field.total_collector_geometry is total_collector_geometry
+
+
+def test_animate_shading(square_field, tmp_path):
+    plt.close('all')
+    solar_elevation = pd.Series([-5, 3, 10, 20, 80],
+                                index=pd.date_range('2023-06-01', periods=5, freq='h'))
+    solar_azimuth = pd.Series([0, 120, 150, 180, 180], index=solar_elevation.index)
+    square_field.slope_tilt = 5
+    filename = tmp_path / 'shading.gif'
+    result = square_field.animate_shading(solar_elevation, solar_azimuth, filename, fps=2,
+                                          dpi=20)
+    pd.testing.assert_series_equal(
+        result, square_field.get_shaded_fraction(solar_elevation, solar_azimuth))
+    # One frame is written for each solar position and no figures are left open
+    PIL = pytest.importorskip('PIL.Image')
+    assert PIL.open(filename).n_frames == 5
+    assert plt.get_fignums() == []
+    assert square_field.animate_shading(20, 180, tmp_path / 'single.gif', dpi=20,
+                                        writer='pillow') == \
+        square_field.get_shaded_fraction(20, 180)
+
+
+def test_shaded_fraction_at_location(square_field, monkeypatch):
+    times = pd.date_range('2023-06-21', '2023-06-22', freq='10min', tz='Etc/GMT-1',
+                          inclusive='left')
+    result = square_field.get_shaded_fraction_at_location(55.7, 12.5, times)
+    solar_position = solarposition.solar_position(times, 55.7, 12.5)
+    expected = square_field.get_shaded_fraction(solar_position['solar_elevation'],
+                                                solar_position['solar_azimuth'])
+    pd.testing.assert_series_equal(result, expected)
+    assert result.isna().any() and (result > 0).any()
+    # The cached solar positions are reused after modifying the layout
+    monkeypatch.setattr(solarposition, 'solar_position', None)
+    square_field.gcr = 0.2
+    result = square_field.get_shaded_fraction_at_location(55.7, 12.5, times)
+    assert (result.fillna(0) <= expected.fillna(0)).all()
+    assert (result < expected).any()
+    monkeypatch.undo()
+    result = square_field.get_shaded_fraction_at_location(0, 0, times, cache=False)
+    assert len(square_field._solar_positions) == 1
+    square_field.clear_solar_position_cache()
+    assert len(square_field._solar_positions) == 0
+
+
+def test_shaded_fraction_at_location_cache_size(square_field, monkeypatch):
+    monkeypatch.setattr(trackerfield, '_SOLAR_POSITION_CACHE_SIZE', 2)
+    times = pd.date_range('2023-06-21', periods=3, freq='h', tz='UTC')
+    for latitude in [10, 20, 10, 30]:
+        square_field.get_shaded_fraction_at_location(latitude, 0, times)
+    # The least recently used location is discarded when the cache is full
+    assert [key[0] for key in square_field._solar_positions] == [10, 30]
+
+
+@pytest.mark.parametrize('engine', ['exact', 'rectangle'])
+def test_shaded_fraction_offset_tolerance(square_field, engine):
+    times = pd.date_range('2023-01-10', '2023-01-11', freq='10s', tz='Etc/GMT-1')
+    solar_position = solarposition.solar_position(times, 55.7, 12.5)
+    solar_elevation = solar_position['solar_elevation'].to_numpy()
+    solar_azimuth = solar_position['solar_azimuth'].to_numpy()
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth, engine=engine)
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth, engine=engine,
+                                              offset_tolerance=0.1)
+    # Error bound for at most six shading candidates
+    max_extent = square_field.min_tracker_spacing
+    error_bound = 6 * 0.1 * max_extent / square_field.active_collector_area
+    assert np.nanmax(np.abs(result - expected)) < error_bound
+    # Consecutive solar positions reuse the shaded fraction
+    is_shaded = expected > 0
+    assert np.mean(result[1:][is_shaded[1:]] == result[:-1][is_shaded[1:]]) > 0.5
+    np.testing.assert_array_equal(np.isnan(result), np.isnan(expected))
+
+
+def test_shaded_fraction_interval(square_field, monkeypatch):
+    times = pd.date_range('2023-01-10', '2023-01-12', freq='h', tz='Etc/GMT-1',
+                          inclusive='left')
+    n_evaluated = []
+    get_shaded_fraction = square_field.get_shaded_fraction
+
+    def spy(solar_elevation, solar_azimuth, **kwargs):
+        n_evaluated.append(len(solar_elevation))
+        return get_shaded_fraction(solar_elevation, solar_azimuth, **kwargs)
+
+    monkeypatch.setattr(square_field, 'get_shaded_fraction', spy)
+    result = square_field.get_shaded_fraction_interval(55.7, 12.5, times)
+    # Only the intervals straddling shading transitions are sub-sampled
+    assert n_evaluated[0] == 3*len(times)
+    assert sum(n_evaluated[1:]) < 64*len(times) / 4
+    monkeypatch.undo()
+    # Reference: average of the shaded fraction sampled every 15 seconds
+    samples = square_field.get_shaded_fraction_at_location(
+        55.7, 12.5, pd.date_range(times[0], times[-1] + pd.Timedelta('1h'), freq='15s',
+                                  inclusive='left'))
+    expected = samples.groupby(samples.index.floor('h')).mean()
+    assert result.isna().equals(expected.isna())
+    assert ((result > 0) & (result < 1)).any()
+    np.testing.assert_allclose(result, expected, atol=0.005)
+    # The shaded fraction at the midpoint is biased around sunrise and sunset
+    midpoint = square_field.get_shaded_fraction_at_location(
+        55.7, 12.5, times + pd.Timedelta('30min'))
+    assert np.nanmax(np.abs(midpoint.to_numpy() - expected.to_numpy())) > 0.01
+    # Intervals labeled by their end and midpoint
+    result_right = square_field.get_shaded_fraction_interval(
+        55.7, 12.5, times + pd.Timedelta('1h'), label='right')
+    np.testing.assert_array_equal(result_right, result)
+    result_center = square_field.get_shaded_fraction_interval(
+        55.7, 12.5, times + pd.Timedelta('30min'), interval_length='1h', label='center')
+    np.testing.assert_array_equal(result_center, result)
+
+
+def test_shaded_fraction_interval_errors(square_field):
+    times = pd.DatetimeIndex(['2023-01-10 10:00', '2023-01-10 11:00', '2023-01-10 13:00'])
+    with pytest.raises(ValueError, match='could not be inferred'):
+        square_field.get_shaded_fraction_interval(55.7, 12.5, times)
+    with pytest.raises(ValueError, match='label must be one of'):
+        square_field.get_shaded_fraction_interval(55.7, 12.5, times, '1h', label='end')
+    result = square_field.get_shaded_fraction_interval(55.7, 12.5, times, '1h')
+    pd.testing.assert_index_equal(result.index, times)
+
+
+def test_get_shading_geometries(square_field):
+    solar_elevation, solar_azimuth = [-5, 5, 10, 80], [0, 180, 200, 180]
+    result = square_field.get_shading_geometries(solar_elevation, solar_azimuth)
+    np.testing.assert_array_equal(
+        result['shaded_fraction'],
+        square_field.get_shaded_fraction(np.array(solar_elevation), np.array(solar_azimuth)))
+    assert result['unshaded_geometry'][3].equals(square_field.active_collector_geometry)
+    assert result['shading_geometry'][3].is_empty
+    buffer, offsets = square_field.get_shading_geometries(
+        solar_elevation, solar_azimuth, output_format='wkb')['shading_geometry']
+    assert len(offsets) == 5
+    assert buffer[offsets[2]:offsets[3]].tobytes() == \
+        shapely.to_wkb(result['shading_geometry'][2])
+
+
+def test_get_shading_geometries_invalid_format(square_field, monkeypatch):
+    # The output format is checked before any geometries are calculated
+    monkeypatch.setattr(shading, '_shading_geometry_arrays', None)
+    with pytest.raises(ValueError, match='output_format must be one of'):
+        square_field.get_shading_geometries([10], [180], output_format='geojson')
+
+
+def test_shaded_fraction_multi_site(square_field):
+    times = pd.date_range('2023-06-21', periods=6, freq='3h')
+    solar_positions = {
+        'a': pd.DataFrame({'solar_elevation': [-5, 3, 10, 20, 10, 60],
+                           'solar_azimuth': [0, 90, 120, 180, 240, 180]}, index=times),
+        'b': pd.DataFrame({'solar_elevation': [-5, 3.001, 10, 25, 15, 60],
+                           'solar_azimuth': [0, 90, 120, 180, 240, 180]}, index=times),
+    }
+    result = square_field.get_shaded_fraction_multi_site(solar_positions)
+    assert list(result) == ['a', 'b']
+    for site, frame in solar_positions.items():
+        expected = square_field.get_shaded_fraction(frame['solar_elevation'],
+                                                    frame['solar_azimuth'])
+        pd.testing.assert_series_equal(result[site], expected)
+    # DataFrame with a MultiIndex of (site, time)
+    frame = pd.concat(solar_positions, names=['site', 'time'])
+    result = square_field.get_shaded_fraction_multi_site(frame)
+    pd.testing.assert_index_equal(result.index, frame.index)
+    pd.testing.assert_series_equal(
+        result, square_field.get_shaded_fraction(frame['solar_elevation'],
+                                                 frame['solar_azimuth']))
+    # Rounding the solar positions merges nearly identical solar positions
+    result = square_field.get_shaded_fraction_multi_site(frame, decimals=1)
+    assert result['b'].iloc[1] == result['a'].iloc[1]
+
+
+def test_shaded_fraction_multi_site_empty(square_field):
+    assert square_field.get_shaded_fraction_multi_site({}) == {}
+    empty = pd.DataFrame({'solar_elevation': [], 'solar_azimuth': []},
+                         index=pd.DatetimeIndex([]))
+    result = square_field.get_shaded_fraction_multi_site({'a': empty, 'b': empty})
+    assert list(result) == ['a', 'b']
+    for series in result.values():
+        pd.testing.assert_series_equal(series, pd.Series([], index=empty.index, dtype=float))
+    result = square_field.get_shaded_fraction_multi_site(empty)
+    pd.testing.assert_index_equal(result.index, empty.index)
+    assert result.dtype == float
+
+
+def test_shaded_fraction_overlap_table(square_field, rectangular_geometry):
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(0, 20, 100)
+    solar_azimuth = rng.uniform(0, 360, 100)
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth,
+                                              engine='overlap_table')
+    np.testing.assert_allclose(result, expected, atol=0.005)
+    assert square_field.last_shading_engine == 'overlap_table'
+    # The table is calculated once and reused after modifying the layout
+    _, table = square_field._shading_engine('overlap_table', 100)
+    square_field.update_layout(gcr=0.3)
+    assert square_field._shading_engine('overlap_table', 100)[1] is table
+    # The table is recalculated if the collector geometry is replaced
+    collector_geometry, _ = rectangular_geometry
+    square_field.active_collector_geometry = collector_geometry.buffer(-0.1)
+    assert square_field._shading_engine('overlap_table', 100)[1] is not table
+
+
+def test_shaded_fraction_engine_selection(square_field, circular_geometry):
+    assert square_field.last_shading_engine is None
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(0, 20, 100)
+    solar_azimuth = rng.uniform(0, 360, 100)
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert square_field.last_shading_engine == 'rectangle'
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth,
+                                                engine='exact')
+    assert square_field.last_shading_engine == 'exact'
+    np.testing.assert_allclose(result, expected, rtol=0, atol=1e-12)
+    # The rectangle engine does not support circular collectors
+    collector_geometry, _ = circular_geometry
+    field = trackerfield.TrackerField(collector_geometry, collector_geometry, neighbor_order=2,
+                                      gcr=0.25, layout_type='square')
+    field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert field.last_shading_engine == 'exact'
+    with pytest.raises(ValueError, match='does not support the collector geometry'):
+        field.get_shaded_fraction(solar_elevation, solar_azimuth, engine='rectangle')
+
+
+def test_shaded_fraction_engine_invalid(square_field):
+    with pytest.raises(ValueError, match='engine must be one of'):
+        square_field.get_shaded_fraction(10, 180, engine='fast')
+    with pytest.raises(ValueError, match='Plotting requires'):
+        square_field.get_shaded_fraction(10, 180, plot=True, engine='overlap_table')
+    square_field.get_shaded_fraction(10, 180, plot=True)
+    assert square_field.last_shading_engine == 'exact'
+
+
+def test_shaded_fraction_dataarray(square_field):
+    xr = pytest.importorskip('xarray')
+    pytest.importorskip('dask')
+    rng = np.random.default_rng(42)
+    coords = {'time': pd.date_range('2023-06-21', periods=6, freq='h'),
+              'lat': [50, 51, 52, 53], 'lon': [10, 11, 12]}
+    solar_elevation = xr.DataArray(rng.uniform(-5, 30, (6, 4, 3)), coords=coords)
+    solar_azimuth = xr.DataArray(rng.uniform(0, 360, (6, 4, 3)), coords=coords)
+    expected = square_field.get_shaded_fraction(solar_elevation.values.ravel(),
+                                                solar_azimuth.values.ravel())
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert result.name == 'shaded_fraction'
+    xr.testing.assert_equal(result.coords.to_dataset(), solar_elevation.coords.to_dataset())
+    np.testing.assert_array_equal(result.values.ravel(), expected)
+    # Dask-backed DataArrays are evaluated lazily with the same chunks
+    chunks = {'time': 2, 'lat': 3}
+    result = square_field.get_shaded_fraction(solar_elevation.chunk(chunks),
+                                              solar_azimuth.chunk(chunks),
+                                              engine='overlap_table', dtype=np.float32)
+    assert result.chunks == solar_elevation.chunk(chunks).chunks
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result.compute().values.ravel(), expected, atol=0.005)
+    # Inputs are broadcasted, e.g., solar positions that do not depend on lon
+    result = square_field.get_shaded_fraction(solar_elevation.isel(lon=0),
+                                              solar_azimuth)
+    assert result.dims == ('time', 'lat', 'lon')
+    with pytest.raises(ValueError, match='Plotting and out are not supported'):
+        square_field.get_shaded_fraction(solar_elevation, solar_azimuth, plot=True)
+
+
+def test_shaded_fraction_array_inputs(square_field, tmp_path):
+    pa = pytest.importorskip('pyarrow')
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(-5, 30, 50)
+    solar_azimuth = rng.uniform(0, 360, 50)
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    # Read-only pyarrow arrays and buffers are supported and return arrays
+    result = square_field.get_shaded_fraction(pa.array(solar_elevation),
+                                              memoryview(solar_azimuth))
+    assert isinstance(result, np.ndarray)
+    np.testing.assert_array_equal(result, expected)
+    # Tuples return lists
+    result = square_field.get_shaded_fraction(tuple(solar_elevation), tuple(solar_azimuth))
+    assert isinstance(result, list)
+    np.testing.assert_array_equal(result, expected)
+    # float32 output
+    result = square_field.get_shaded_fraction(pd.Series(solar_elevation),
+                                              pd.Series(solar_azimuth), dtype='float32')
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, rtol=1e-6)
+
+
+def test_shaded_fraction_out(square_field, tmp_path):
+    rng = np.random.default_rng(42)
+    solar_elevation = rng.uniform(-5, 30, 50)
+    solar_azimuth = rng.uniform(0, 360, 50)
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    # Results are written into a memory-mapped array
+    out = np.lib.format.open_memmap(tmp_path / 'out.npy', mode='w+', dtype=np.float32,
+                                    shape=(50,))
+    result = square_field.get_shaded_fraction(solar_elevation, solar_azimuth, out=out)
+    assert result is out
+    np.testing.assert_allclose(out, expected, rtol=1e-6)
+    out = np.empty(1)
+    assert square_field.get_shaded_fraction(10, 180, out=out) is out
+    np.testing.assert_array_equal(out, square_field.get_shaded_fraction(10, 180))
+    with pytest.raises(ValueError, match='out must have the shape'):
+        square_field.get_shaded_fraction(solar_elevation, solar_azimuth, out=np.empty(10))
+    with pytest.raises(ValueError, match='does not match dtype'):
+        square_field.get_shaded_fraction(solar_elevation, solar_azimuth, out=np.empty(50),
+                                         dtype=np.float32)
+    with pytest.raises(ValueError, match='dtype must be float32 or float64'):
+        square_field.get_shaded_fraction(solar_elevation, solar_azimuth, dtype=int)
+
+
+def test_shade_avoidance_pointing(square_field):
+    solar_elevation = pd.Series([-5, 3, 8, 15, 60], index=pd.date_range(
+        '2023-06-21 04:00', periods=5, freq='h'))
+    solar_azimuth = pd.Series([40, 60, 90, 110, 180], index=solar_elevation.index)
+    result = square_field.get_shade_avoidance_pointing(solar_elevation, solar_azimuth,
+                                                       max_deviation=20, n_iterations=3)
+    pd.testing.assert_index_equal(result.index, solar_elevation.index)
+    sun_pointing = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert np.isnan(result['relative_irradiance'].iloc[0])
+    # Unshaded solar positions point at the sun
+    unshaded = sun_pointing == 0
+    np.testing.assert_allclose(result.loc[unshaded, 'tracker_elevation'],
+                               solar_elevation[unshaded])
+    np.testing.assert_allclose(result.loc[unshaded, 'relative_irradiance'], 1)
+    # Shaded solar positions deviate from the sun, which increases the irradiance
+    shaded = sun_pointing > 0
+    assert shaded.sum() >= 2
+    assert np.all(result.loc[shaded, 'relative_irradiance'] > 1 - sun_pointing[shaded])
+    assert np.all(result.loc[shaded, 'shaded_fraction'] < sun_pointing[shaded])
+    deviation = np.hypot(result['tracker_elevation'] - solar_elevation,
+                         result['tracker_azimuth'] - solar_azimuth)
+    assert np.all(deviation[shaded] > 0) and np.all(deviation[1:] <= 20*np.sqrt(2))
+
+
+def test_shaded_fraction_tracker_angles(square_field):
+    solar_elevation = pd.Series([-5, 3, 8, 15, 30, 60], index=pd.date_range(
+        '2023-06-21 04:00', periods=6, freq='h'))
+    solar_azimuth = pd.Series([40, 60, 90, 110, 140, 180], index=solar_elevation.index)
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    # Sun-pointing by default
+    result = square_field.get_shaded_fraction_tracker_angles(solar_elevation, solar_azimuth)
+    pd.testing.assert_index_equal(result.index, solar_elevation.index)
+    np.testing.assert_allclose(result['shaded_fraction'], expected, atol=1e-12)
+    # Rotation limits
+    result = square_field.get_shaded_fraction_tracker_angles(
+        solar_elevation, solar_azimuth, elevation_limits=(10, 80), azimuth_limits=(80, 280))
+    np.testing.assert_array_equal(result['tracker_elevation'], [10, 10, 10, 15, 30, 60])
+    np.testing.assert_array_equal(result['tracker_azimuth'], [80, 80, 90, 110, 140, 180])
+    assert result['shaded_fraction'].iloc[1] < expected.iloc[1]
+    assert result['cos_incidence'].iloc[1] < 1
+    # Azimuth angles are limited to the nearest limit by angular distance
+    result = square_field.get_shaded_fraction_tracker_angles(
+        [10, 10, 10, 10], [5, 20, 345, 350], azimuth_limits=(30, 330))
+    np.testing.assert_array_equal(result['tracker_azimuth'], [30, 30, 330, 330])
+    # Ranges including north wrap around
+    result = square_field.get_shaded_fraction_tracker_angles(
+        [10, 10, 10, 10, 10], [320, 10, 100, 170, 250], azimuth_limits=(300, 60))
+    np.testing.assert_array_equal(result['tracker_azimuth'], [320, 10, 60, 60, 300])
+    result = square_field.get_shaded_fraction_tracker_angles(
+        [10, 10], [0, 350], azimuth_limits=(0, 360))
+    np.testing.assert_array_equal(result['tracker_azimuth'], [0, 350])
+    # Stowed collectors are horizontal and unshaded on a flat field
+    result = square_field.get_shaded_fraction_tracker_angles(
+        solar_elevation, solar_azimuth, stow=[False, True, True, False, False, False])
+    np.testing.assert_array_equal(result['tracker_elevation'], [0, 90, 90, 15, 30, 60])
+    np.testing.assert_allclose(result['shaded_fraction'].iloc[1:3], 0)
+    np.testing.assert_allclose(result['cos_incidence'].iloc[1:3],
+                               np.sin(np.deg2rad(solar_elevation.iloc[1:3])))
+    # Explicit tracker angles, e.g., from a tracker controller
+    result = square_field.get_shaded_fraction_tracker_angles(
+        [10, 10], [180, 180], tracker_elevation=[10, 20], tracker_azimuth=180)
+    assert result['shaded_fraction'].iloc[1] < result['shaded_fraction'].iloc[0]
+
+
+@pytest.mark.parametrize('slope_tilt', [0, 5])
+def test_shaded_fraction_gradient(rectangular_geometry, active_geometry_split, slope_tilt):
+    collector_geometry, _ = rectangular_geometry
+    parameters = dict(gcr=0.3, aspect_ratio=1.3, offset=0.2, rotation=17)
+    field = trackerfield.TrackerField(
+        collector_geometry, active_geometry_split, neighbor_order=2,
+        slope_azimuth=150, slope_tilt=slope_tilt, **parameters)
+    solar_elevation = pd.Series(np.linspace(-2, 25, 28))
+    solar_azimuth = pd.Series(np.linspace(60, 300, 28))
+    result = field.get_shaded_fraction_gradient(solar_elevation, solar_azimuth)
+    assert list(result.columns) == ['shaded_fraction', *parameters]
+    pd.testing.assert_series_equal(
+        result['shaded_fraction'], field.get_shaded_fraction(solar_elevation, solar_azimuth),
+        check_names=False)
+    assert result.iloc[0].isna().all()
+    assert (result['shaded_fraction'] > 0).sum() > 5
+    # Compare to central differences
+    step = 1e-6
+    for name, value in parameters.items():
+        field.update_layout(**{name: value + step})
+        upper = field.get_shaded_fraction(solar_elevation, solar_azimuth)
+        field.update_layout(**{name: value - step})
+        lower = field.get_shaded_fraction(solar_elevation, solar_azimuth)
+        field.update_layout(**{name: value})
+        np.testing.assert_allclose(result[name], (upper - lower) / (2*step), atol=1e-6)
+    assert np.any(result[list(parameters)] != 0, axis=0).all()
+
+
+def test_shaded_fraction_sparse(square_field):
+    rng = np.random.default_rng(42)
+    index = pd.date_range('2023-06-21', periods=500, freq='15min')
+    solar_elevation = pd.Series(rng.uniform(-20, 60, 500), index=index)
+    solar_azimuth = pd.Series(rng.uniform(0, 360, 500), index=index)
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    result = square_field.get_shaded_fraction_sparse(solar_elevation, solar_azimuth,
+                                                     batch_size=64)
+    pd.testing.assert_series_equal(result.to_series(), expected)
+    # Fully shaded solar positions below the horizon of the slope are stored
+    square_field.slope_tilt = 20
+    expected = square_field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert (expected == 1).any()
+    result = square_field.get_shaded_fraction_sparse(solar_elevation, solar_azimuth,
+                                                     batch_size=64)
+    pd.testing.assert_series_equal(result.to_series(), expected)
+    dense = sparse.SparseShadedFraction.from_dense(expected)
+    for name in ['run_starts', 'run_stops', 'values', 'nan_starts', 'nan_stops']:
+        np.testing.assert_array_equal(getattr(result, name), getattr(dense, name))
+    result = square_field.get_shaded_fraction_sparse([], [])
+    assert len(result) == 0 and result.index is None
@@ -0,0 +1,98 @@
+from twoaxistracking import validation
+import numpy as np
+import pytest
+
+
+# Maximum absolute error of the shaded fraction allowed for each engine
+ERROR_BUDGETS = {
+    'vectorized': 1e-12,
+    'exact': 1e-12,
+    'rectangle': 1e-12,
+    'monte_carlo': 1e-12,
+    'overlap_table': 0.005,
+}
+
+
+def vectorized(field, solar_elevation, solar_azimuth):
+    return field.get_shaded_fraction(solar_elevation, solar_azimuth)
+
+
+def exact(field, solar_elevation, solar_azimuth):
+    return field.get_shaded_fraction(solar_elevation, solar_azimuth, engine='exact')
+
+
+def rectangle(field, solar_elevation, solar_azimuth):
+    return field.get_shaded_fraction(solar_elevation, solar_azimuth, engine='rectangle')
+
+
+def monte_carlo(field, solar_elevation, solar_azimuth):
+    # Without errors, all realizations equal the exact shaded fraction
+    return field.get_shaded_fraction_uncertainty(
+        solar_elevation, solar_azimuth, n_realizations=1, quantiles=[0.5])[0.5].values
+
+
+def overlap_table(field, solar_elevation, solar_azimuth):
+    return field.get_shaded_fraction(solar_elevation, solar_azimuth, engine='overlap_table')
+
+
+ENGINES = {
+    'vectorized': vectorized,
+    'exact': exact,
+    'rectangle': rectangle,
+    'monte_carlo': monte_carlo,
+    'overlap_table': overlap_table,
+}
+
+
+@pytest.fixture(scope='module')
+def validation_report():
+    return validation.validate_engines(ENGINES, n_solar_positions=100, seed=42)
+
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_error_budget(validation_report, engine):
+    assert validation_report.loc[engine, 'max_error'] <= ERROR_BUDGETS[engine]
+    assert validation_report.loc[engine, 'mean_error'] <= \
+        validation_report.loc[engine, 'max_error']
+    assert validation_report.loc[engine, 'speed_up'] > 0
+
+
+def test_sample_fields():
+    fields = validation.sample_fields(n_random=4, seed=1)
+    assert len(fields) == 8
+    assert list(fields)[-4:] == ['random 1', 'random 2', 'random 3', 'random 4']
+    assert any(field.slope_tilt > 0 for field in fields.values())
+    assert any(field.active_collector_geometry.geom_type == 'MultiPolygon'
+               for field in fields.values())
+    # The solar positions are sampled up to the maximum shading elevation
+    field = fields['square']
+    solar_elevation, solar_azimuth = validation.sample_solar_positions(field, 50, seed=1)
+    assert (solar_elevation <= 1.1 * field.max_shading_elevation).all()
+    assert len(solar_azimuth) == 50
+
+
+def test_exact_shaded_fraction_horizon_profile():
+    # The reference uses the horizon profile of the field, as do the engines
+    field = validation.sample_fields(n_random=0)['hexagonal_n_s, horizon profile']
+    solar_elevation, solar_azimuth = [10, 10, 20], [90, 180, 180]
+    expected = field.get_shaded_fraction(solar_elevation, solar_azimuth)
+    assert expected[0] == 1
+    np.testing.assert_array_equal(
+        validation._exact_shaded_fraction(field, solar_elevation, solar_azimuth), expected)
+
+
+def test_validate_engines_errors():
+    # Errors are detected, including nan values where the reference is not nan
+    fields = {'square': validation.sample_fields(n_random=0)['square']}
+
+    def wrong(field, solar_elevation, solar_azimuth):
+        result = field.get_shaded_fraction(solar_elevation, solar_azimuth) + 0.1
+        result[0] = np.nan
+        return result
+
+    report = validation.validate_engines({'wrong': wrong}, fields=fields,
+                                         n_solar_positions=20, seed=1)
+    assert report.loc['wrong', 'max_error'] == np.inf
+    np.testing.assert_array_equal(
+        validation._absolute_error(np.array([np.nan, 0.5, np.nan]), np.array([np.nan, 0.25, 1])),
+        [0, 0.25, np.inf])